@@ -0,0 +1 @@
+__all__ = ["corpus", "huffman_bench", "table_bench", "connection_bench", "frame_bench", "priority_bench", "decode_bench", "encode_bench", "compression_bench", "import_bench"]
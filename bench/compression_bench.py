@@ -0,0 +1,47 @@
+# Compressed header block sizes with different indexing policies, over a
+# trace of requests and responses on one connection. Run from the
+# repository root with
+#   python -m bench.compression_bench
+
+from hpack import hpack
+from hpack import policy
+from . import corpus
+
+def trace(count):
+    # Requests to a few hosts interleaved with their responses, as one
+    # client connection to a proxy would see them
+    requests = corpus.request_headers(count)
+    responses = corpus.response_headers(count)
+    for idx in range(count):
+        requests[idx][2] = (":authority", "host{:d}.example.com".format(idx % 4))
+    return requests, responses
+
+def encoded_sizes(headers, index_policy, table_size):
+    ctx = hpack.ctx(max_table_size_out=table_size, huffman_encoding=hpack.huffman_opts.SHORTEST,
+            index_policy=index_policy)
+    total = 0
+    for header_list in headers:
+        ctx.start_encode()
+        ctx.encode_header_list(header_list)
+        total += len(ctx.end_encode())
+    return total
+
+def main():
+    count = 2000
+    requests, responses = trace(count)
+    policies = [
+            ("index everything", lambda: None),
+            ("name rules", lambda: policy.index_policy(learn=False, max_entry_fraction=None)),
+            ("size rule", lambda: policy.index_policy(rules=None, learn=False)),
+            ("learning", lambda: policy.index_policy(rules=None, max_entry_fraction=None)),
+            ("all", lambda: policy.index_policy()),
+        ]
+    for table_size in [1024, 4096]:
+        for name,make_policy in policies:
+            request_bytes = encoded_sizes(requests, make_policy(), table_size)
+            response_bytes = encoded_sizes(responses, make_policy(), table_size)
+            print("table {:>5d}, {:<16s}: {:>6.1f} bytes/request {:>6.1f} bytes/response".format(
+                    table_size, name, request_bytes / count, response_bytes / count))
+
+if __name__ == '__main__':
+    main()
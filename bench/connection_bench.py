@@ -0,0 +1,76 @@
+# Receive path throughput for bursts of small frames, writes made when many
+# streams get to send at once, and the cost of sending large bodies. Run from the repository root with
+#   python -m bench.connection_bench
+
+import struct
+import time
+from h2 import connection
+from h2 import frames
+
+def raw_frame(frame_type, flags, stream_id, payload):
+    return struct.pack("!BHBBI", len(payload) >> 16, len(payload) & 0xffff,
+            frame_type, flags, stream_id) + payload
+
+def new_connection(send=lambda data: 0):
+    callbacks = {
+        "send": send,
+        "handle_message": lambda message: None,
+    }
+    conn = connection.connection(callbacks)
+    conn.initiate()
+    conn.process_bytes(raw_frame(frames.frame_type.SETTINGS, 0x1, 0, b''))
+    conn.send_request({":method": "GET", ":scheme": "https", ":path": "/", ":authority": "localhost"})
+    return conn
+
+def response_burst(total_size, frame_size):
+    encoded = [raw_frame(frames.frame_type.HEADERS, 0x4, 1, b'\x88')]
+    chunk = b'x' * frame_size
+    for _ in range(total_size // frame_size - 1):
+        encoded.append(raw_frame(frames.frame_type.DATA, 0x0, 1, chunk))
+    encoded.append(raw_frame(frames.frame_type.DATA, 0x1, 1, chunk))
+    return b''.join(encoded)
+
+def blocked_streams(count):
+    # Opens count streams with bodies that the connection window holds back
+    writes = []
+    conn = new_connection(lambda data: writes.append(len(data)))
+    body = b'x' * 4096
+    for _ in range(count):
+        conn.send_request({":method": "POST", ":scheme": "https", ":path": "/", ":authority": "localhost"}, body)
+    del writes[:]
+    return conn, writes
+
+def upload(size):
+    conn = new_connection()
+    settings = struct.pack("!HI", frames.settings_identifiers.INITIAL_WINDOW_SIZE, 2**31 - 1)
+    conn.process_bytes(raw_frame(frames.frame_type.SETTINGS, 0x0, 0, settings) +
+            raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, 0, (2**31 - 1 - 65535).to_bytes(4, 'big')))
+    body = b'x' * size
+    start = time.perf_counter()
+    conn.send_request({":method": "POST", ":scheme": "https", ":path": "/", ":authority": "localhost"}, body)
+    return time.perf_counter() - start
+
+def main():
+    for size in [1 << 20, 1 << 24, 1 << 26]:
+        seconds = upload(size)
+        print("{:>8d} byte upload: {:>9.2f} ms, {:>6.2f} ns/byte".format(size, seconds * 1e3, seconds / size * 1e9))
+
+    for count in [64, 256, 1024]:
+        conn, writes = blocked_streams(count)
+        start = time.perf_counter()
+        conn.process_bytes(raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, 0, (count * 4096).to_bytes(4, 'big')))
+        seconds = time.perf_counter() - start
+        print("{:>8d} streams unblocked: {:>5d} writes of {:>8d} bytes, {:>9.2f} ms".format(
+                count, len(writes), sum(writes), seconds * 1e3))
+
+    for total_size in [1 << 16, 1 << 18, 1 << 20, 1 << 22]:
+        burst = response_burst(total_size, 64)
+        conn = new_connection()
+        start = time.perf_counter()
+        conn.process_bytes(burst)
+        seconds = time.perf_counter() - start
+        print("{:>8d} byte burst of 64 byte DATA frames: {:>9.2f} ms, {:>6.1f} ns/byte".format(
+                len(burst), seconds * 1e3, seconds / len(burst) * 1e9))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Synthetic but realistic looking request/response headers, used by the
+# benchmarks. Generated from a fixed seed so runs are comparable.
+
+import random
+
+user_agents = [
+        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_2) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15",
+        "curl/8.5.0",
+    ]
+
+paths = [
+        "/", "/index.html", "/static/js/app.3f9a1c.js", "/static/css/main.css",
+        "/api/v1/users/{:d}/profile", "/api/v1/search?q={:d}&page=2",
+        "/images/thumbnails/{:d}.jpg", "/feed.xml",
+    ]
+
+def random_token(rng, length):
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+def request_headers(count, seed=0):
+    rng = random.Random(seed)
+    session = random_token(rng, 48)
+    requests = []
+    for request_id in range(count):
+        path = rng.choice(paths).format(rng.randrange(100000))
+        requests.append([
+                (":method", "GET"),
+                (":scheme", "https"),
+                (":authority", "www.example.com"),
+                (":path", path),
+                ("user-agent", user_agents[request_id % 3]),
+                ("accept", "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"),
+                ("accept-encoding", "gzip, deflate, br"),
+                ("accept-language", "en-US,en;q=0.5"),
+                ("cookie", "session={}; theme=dark; _ga=GA1.2.{:d}".format(session, rng.randrange(10**9))),
+                ("x-request-id", "{:032x}".format(rng.getrandbits(128))),
+            ])
+    return requests
+
+def response_headers(count, seed=0):
+    rng = random.Random(seed)
+    responses = []
+    for _ in range(count):
+        responses.append([
+                (":status", rng.choice(["200", "200", "200", "304", "404"])),
+                ("date", "Mon, 21 Oct 2013 20:{:02d}:{:02d} GMT".format(rng.randrange(60), rng.randrange(60))),
+                ("content-type", "text/html; charset=utf-8"),
+                ("content-length", str(rng.randrange(100, 100000))),
+                ("cache-control", "private, max-age=0"),
+                ("etag", '"{:016x}"'.format(rng.getrandbits(64))),
+                ("set-cookie", "id={}; Path=/; Secure; HttpOnly".format(random_token(rng, 32))),
+                ("server", "nginx"),
+            ])
+    return responses
+
+def header_values(count, seed=0):
+    values = []
+    for headers in request_headers(count, seed) + response_headers(count, seed):
+        values.extend(value for _,value in headers)
+    return values
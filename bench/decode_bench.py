@@ -0,0 +1,85 @@
+# Header block decoding cost: the header block sequences of RFC 7541
+# appendices C.3 to C.6, and decoding everything into a dict against a
+# header_list of which only a few headers are read. Run from the repository
+# root with
+#   python -m bench.decode_bench
+
+import timeit
+from hpack import hpack
+from . import corpus
+
+# (decoding table size, header blocks) for each appendix
+rfc_sequences = [
+        (4096, [
+            "828684410f7777772e6578616d706c652e636f6d",
+            "828684be58086e6f2d6361636865",
+            "828785bf400a637573746f6d2d6b65790c637573746f6d2d76616c7565",
+        ]),
+        (4096, [
+            "828684418cf1e3c2e5f23a6ba0ab90f4ff",
+            "828684be5886a8eb10649cbf",
+            "828785bf408825a849e95ba97d7f8925a849e95bb8e8b4bf",
+        ]),
+        (256, [
+            "4803333032580770726976617465611d4d6f6e2c203231204f637420323031332032303a31333a323120474d54"
+                "6e1768747470733a2f2f7777772e6578616d706c652e636f6d",
+            "4803333037c1c0bf",
+            "88c1611d4d6f6e2c203231204f637420323031332032303a31333a323220474d54c05a04677a69707738666f6f"
+                "3d4153444a4b48514b425a584f5157454f50495541585157454f49553b206d61782d6167653d333630303b"
+                "2076657273696f6e3d31",
+        ]),
+        (256, [
+            "488264025885aec3771a4b6196d07abe941054d444a8200595040b8166e082a62d1bff6e919d29ad171863c7"
+                "8f0b97c8e9ae82ae43d3",
+            "4883640effc1c0bf",
+            "88c16196d07abe941054d444a8200595040b8166e084a62d1bffc05a839bd9ab77ad94e7821dd7f2e6c7b335"
+                "dfdfcd5b3960d5af27087f3672c1ab270fb5291f9587316065c003ed4ee5b1063d5007",
+        ]),
+    ]
+
+def rfc_examples():
+    sequences = [(table_size, [bytes.fromhex(block) for block in blocks]) for table_size,blocks in rfc_sequences]
+    def run():
+        for _ in range(100):
+            for table_size,blocks in sequences:
+                ctx = hpack.ctx(max_table_size_in=table_size)
+                for block in blocks:
+                    ctx.decode_headers(block)
+    seconds = min(timeit.repeat(run, number=1, repeat=10))
+    print("RFC 7541 C.3-C.6: {:>7.2f} us/block".format(seconds / 100 / 12 * 1e6))
+
+def encoded_blocks(responses, index_opt):
+    ctx = hpack.ctx()
+    blocks = []
+    for headers in responses:
+        ctx.start_encode()
+        ctx.encode_header_list(headers, index_opt)
+        blocks.append(bytes(ctx.end_encode()))
+    return blocks
+
+def main():
+    responses = corpus.response_headers(1000)
+    for index_opt in [hpack.index_opts.INCREMENTAL, hpack.index_opts.WITHOUT]:
+        blocks = encoded_blocks(responses, index_opt)
+        def run_dict():
+            ctx = hpack.ctx()
+            for block in blocks:
+                headers = ctx.decode_headers(block)
+                headers.get(":status")
+                headers.get("content-length")
+        def run_list(decode_bytes):
+            ctx = hpack.ctx(decode_bytes=decode_bytes)
+            status, content_length = (b":status", b"content-length") if decode_bytes else (":status", "content-length")
+            for block in blocks:
+                headers = ctx.decode_header_list(block)
+                headers.get(status)
+                headers.get(content_length)
+        for name,run in [("dict", run_dict), ("header_list", lambda: run_list(False)),
+                ("header_list bytes", lambda: run_list(True))]:
+            seconds = timeit.timeit(run, number=5)
+            print("{:<12s} {:<18s}: {:>7.2f} us/block".format(index_opt.name, name,
+                    seconds / 5 / len(blocks) * 1e6))
+
+if __name__ == '__main__':
+    rfc_examples()
+    main()
@@ -0,0 +1,40 @@
+# Request header encoding cost, with and without a template for the headers
+# that are the same on every request, and with and without the literal cache.
+# Run from the repository root with
+#   python -m bench.encode_bench
+
+import timeit
+from hpack import hpack
+from . import corpus
+
+# Headers of corpus.request_headers that don't change between requests
+common_names = {":method", ":scheme", ":authority", "accept", "accept-encoding", "accept-language"}
+
+def main():
+    requests = corpus.request_headers(1000)
+    common = [header for header in requests[0] if header[0] in common_names]
+    rest = [[header for header in headers if header[0] not in common_names] for headers in requests]
+    for literal_cache_size in [0, 256]:
+        def run_plain():
+            ctx = hpack.ctx(huffman_encoding=hpack.huffman_opts.SHORTEST, literal_cache_size=literal_cache_size)
+            for headers in requests:
+                ctx.start_encode()
+                ctx.encode_header_list(headers)
+                ctx.end_encode()
+        def run_template():
+            ctx = hpack.ctx(huffman_encoding=hpack.huffman_opts.SHORTEST, literal_cache_size=literal_cache_size)
+            template = ctx.compile_headers(common)
+            for headers in rest:
+                ctx.start_encode()
+                ctx.encode_template(template)
+                ctx.encode_header_list(headers)
+                ctx.end_encode()
+        for name,run in [("encode_header_list", run_plain), ("template", run_template)]:
+            # The best of several runs, which is the least disturbed by
+            # anything else going on
+            seconds = min(timeit.repeat(run, number=1, repeat=10))
+            print("literal cache {:>3d}, {:<18s}: {:>7.2f} us/request".format(literal_cache_size, name,
+                    seconds / len(requests) * 1e6))
+
+if __name__ == '__main__':
+    main()
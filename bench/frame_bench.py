@@ -0,0 +1,47 @@
+# Memory held by decoded frames, streams and messages, and frame decoding
+# rate. Run from the repository root with
+#   python -m bench.frame_bench
+
+import struct
+import time
+import tracemalloc
+from h2 import frames
+from h2 import stream
+from hpack import hpack
+
+def raw_frame(frame_type, flags, stream_id, payload):
+    return struct.pack("!BHBBI", len(payload) >> 16, len(payload) & 0xffff,
+            frame_type, flags, stream_id) + payload
+
+def allocated(make, count=10000):
+    # Average number of bytes still allocated per object made
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objects = [make() for _ in range(count)]
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del objects
+    return size / count
+
+def main():
+    samples = [
+        ("DATA", raw_frame(frames.frame_type.DATA, 0x0, 1, b'x' * 64)),
+        ("HEADERS", raw_frame(frames.frame_type.HEADERS, 0x4, 1, b'\x88')),
+        ("WINDOW_UPDATE", raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, 1, b'\x00\x00\x10\x00')),
+    ]
+    for name, encoded in samples:
+        size = allocated(lambda: frames.frame.decode_static(encoded)[0])
+        burst = encoded * 100000
+        start = time.perf_counter()
+        offset = 0
+        while offset < len(burst):
+            offset += frames.frame.decode_static(burst, offset)[1]
+        seconds = time.perf_counter() - start
+        print("{:<14s} frame: {:>6.1f} bytes each, {:>6.0f} k frames/s".format(name, size, 100 / seconds))
+
+    ctx = hpack.ctx()
+    print("stream:              {:>6.1f} bytes each".format(allocated(lambda: stream.stream(1, ctx))))
+    print("http_message:        {:>6.1f} bytes each".format(allocated(lambda: stream.http_message({}))))
+
+if __name__ == '__main__':
+    main()
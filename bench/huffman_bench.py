@@ -0,0 +1,46 @@
+# Huffman encode/decode throughput. Run from the repository root with
+#   python -m bench.huffman_bench
+
+import timeit
+from hpack import ed
+from . import corpus
+
+# Huffman encoded literals from RFC 7541 appendices C.4 and C.6
+rfc_examples = [
+        'f1e3c2e5f23a6ba0ab90f4ff', 'a8eb10649cbf', '25a849e95ba97d7f',
+        '25a849e95bb8e8b4bf', '6402', 'aec3771a4b',
+        'd07abe941054d444a8200595040b8166e082a62d1bff',
+        '9d29ad171863c78f0b97c8e9ae82ae43d3', '640eff',
+        'd07abe941054d444a8200595040b8166e084a62d1bff', '9bd9ab',
+        '94e7821dd7f2e6c7b335dfdfcd5b3960d5af27087f3672c1ab270fb5291f9587316065c003ed4ee5b1063d5007',
+    ]
+
+def report(name, total_bytes, repeat, seconds):
+    print("{:<32} {:>10.2f} MB/s {:>10.2f} us/iteration".format(
+            name, total_bytes * repeat / seconds / 1e6, seconds / repeat * 1e6))
+
+def bench_decode(name, encoded_strings, repeat):
+    total_bytes = sum(len(encoded) for encoded in encoded_strings)
+    def run():
+        for encoded in encoded_strings:
+            ed.decode_huffman_string(encoded, 0, len(encoded))
+    report(name, total_bytes, repeat, timeit.timeit(run, number=repeat))
+
+def bench_encode(name, strings, repeat):
+    total_bytes = sum(len(string) for string in strings)
+    def run():
+        for string in strings:
+            ed.encode_huffman_string(string)
+    report(name, total_bytes, repeat, timeit.timeit(run, number=repeat))
+
+def main():
+    rfc_encoded = [bytes.fromhex(example) for example in rfc_examples]
+    corpus_strings = [value.encode('ascii') for value in corpus.header_values(500)]
+    corpus_encoded = [ed.encode_huffman_string(string) for string in corpus_strings]
+
+    bench_decode("decode rfc C.4/C.6", rfc_encoded, 2000)
+    bench_decode("decode header corpus", corpus_encoded, 20)
+    bench_encode("encode header corpus", corpus_strings, 20)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# Import time of the packages, as reported by python -X importtime, for
+# processes that only live long enough for a few requests. Run from the
+# repository root with
+#   python -m bench.import_bench
+
+import subprocess
+import sys
+import timeit
+
+modules = ["hpack.ed", "hpack.table", "hpack.hpack", "h2.frames", "h2.connection"]
+
+def import_times(module):
+    # Maps every module imported along with module to its cumulative import
+    # time in microseconds
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+def main():
+    for module in modules:
+        # The best of several runs; the first one may also be compiling
+        seconds = min(import_times(module)[module] for _ in range(10)) / 1e6
+        print("{:<14s}: {:>6.2f} ms".format(module, seconds * 1e3))
+
+    # What building the lazily built tables costs their first user
+    from hpack import ed
+    from hpack import table
+    for name,build in [("huffman decode tables", ed.build_huffman_decode_states),
+            ("static table indexes", table.build_static_indexes)]:
+        seconds = min(timeit.repeat(build, number=1, repeat=5))
+        print("{:<22s}: {:>6.2f} ms on first use".format(name, seconds * 1e3))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# How long small requests wait behind a large upload sharing the connection.
+# Run from the repository root with
+#   python -m bench.priority_bench
+
+import struct
+import time
+from h2 import connection
+from h2 import frames
+
+def raw_frame(frame_type, flags, stream_id, payload):
+    return struct.pack("!BHBBI", len(payload) >> 16, len(payload) & 0xffff,
+            frame_type, flags, stream_id) + payload
+
+def run(large_size, small_count, small_size, small_weight):
+    sent = bytearray()
+    callbacks = {
+        "send": lambda data: sent.extend(data) or 0,
+        "handle_message": lambda message: None,
+    }
+    conn = connection.connection(callbacks)
+    conn.initiate()
+    settings = struct.pack("!HI", frames.settings_identifiers.INITIAL_WINDOW_SIZE, 1 << 30)
+    conn.process_bytes(raw_frame(frames.frame_type.SETTINGS, 0x0, 0, settings))
+
+    # The default connection window holds everything back until the
+    # requests are all made
+    headers = {":method": "POST", ":scheme": "https", ":path": "/", ":authority": "localhost"}
+    conn.send_request(headers, b'w' * 65535)
+    conn.send_request(headers, b'l' * large_size)
+    for _ in range(small_count):
+        conn.send_request(headers, b's' * small_size, weight=small_weight)
+    del sent[:]
+
+    start = time.perf_counter()
+    conn.process_bytes(raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, 0, (1 << 30).to_bytes(4, 'big')))
+    seconds = time.perf_counter() - start
+
+    # Offset in the output at which each stream's body was complete
+    done = {}
+    offset = 0
+    while offset < len(sent):
+        frame, read = frames.frame.decode_static(sent, offset)
+        offset += read
+        if frame.frame_type == frames.frame_type.DATA and frame.is_flag_set(frames.data_flags.END_STREAM):
+            done[frame.stream_id] = offset
+    small = [done[stream_id] for stream_id in range(5, 5 + 2 * small_count, 2)]
+    return sum(small) / len(small), max(small), done[3], seconds
+
+def main():
+    for small_weight in [16, 64, 256]:
+        mean, last, large, seconds = run(8 << 20, 4, 1 << 18, small_weight)
+        print("small weight {:>3d}: small requests done after {:>8.0f} bytes on average, all after {:>8d}; large after {:>8d} ({:.1f} ms)".format(
+                small_weight, mean, last, large, seconds * 1e3))
+
+if __name__ == '__main__':
+    main()
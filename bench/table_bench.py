@@ -0,0 +1,48 @@
+# Header encoding cost as the dynamic table grows. Run from the repository
+# root with
+#   python -m bench.table_bench
+
+import timeit
+from hpack import hpack
+from . import corpus
+
+def filled_ctx(table_size):
+    # Fill the encoding table with distinct headers, none of which match the
+    # headers being encoded
+    ctx = hpack.ctx(max_table_size_out=table_size)
+    ctx.start_encode()
+    idx = 0
+    while ctx.table_encode.dynamic_size() + 100 < table_size:
+        ctx.encode_header("x-filler-{:d}".format(idx), "v" * 48)
+        idx += 1
+    ctx.end_encode()
+    return ctx
+
+def main():
+    requests = corpus.request_headers(100)
+    for table_size in [4096, 16384, 65536, 262144]:
+        ctx = filled_ctx(table_size)
+        entries = ctx.table_encode.length() - ctx.table_encode.st_len
+        def run():
+            for headers in requests:
+                ctx.start_encode()
+                ctx.encode_header_list(headers, hpack.index_opts.WITHOUT)
+                ctx.end_encode()
+        seconds = timeit.timeit(run, number=10)
+        print("table size {:>7d} ({:>5d} entries): {:>8.2f} us/request".format(
+                table_size, entries, seconds / 10 / len(requests) * 1e6))
+
+def churn():
+    # Every header is inserted into a full table, evicting the oldest entry
+    for table_size in [4096, 65536, 262144]:
+        hpack_table = filled_ctx(table_size).table_encode
+        def run():
+            for idx in range(10000):
+                hpack_table.new_header("x-churn", "v" * 60)
+        seconds = timeit.timeit(run, number=5)
+        print("table size {:>7d}: {:>8.2f} us/insertion with eviction".format(
+                table_size, seconds / 5 / 10000 * 1e6))
+
+if __name__ == '__main__':
+    main()
+    churn()
@@ -1,88 +1,344 @@
 from enum import IntEnum
+from collections import deque
 from . import frames
 from . import stream
-import hpack
+from . import priority
+from .stream import stream_event
+from .stream import stream_state
+import hpack.hpack
 import logging
-import hexdump
+import time
 
 connection_preface = bytearray("PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n", "ascii")
 
 logger = logging.getLogger('connection')
 
+# Number of decoded bytes allowed to pile up at the front of the receive
+# buffer before they're dropped
+recv_buffer_compact_threshold = 65536
+
+# Flow control window every stream and the connection start with
+default_window_size = 65535
+
+# Values of every setting until SETTINGS frames say otherwise (RFC 7540
+# section 6.5.2); None stands for unlimited
+default_settings = {
+        frames.settings_identifiers.HEADERS_TABLE_SIZE: 4096,
+        frames.settings_identifiers.ENABLE_PUSH: 1,
+        frames.settings_identifiers.MAX_CONCURRENT_STREAMS: None,
+        frames.settings_identifiers.INITIAL_WINDOW_SIZE: default_window_size,
+        frames.settings_identifiers.MAX_FRAME_SIZE: 16384,
+        frames.settings_identifiers.MAX_HEADER_LIST_SIZE: None,
+    }
+
+# Largest frame payload anybody can allow
+max_frame_size_limit = 2**24 - 1
+
+# Opaque data of the PINGs used to measure round trip time for window
+# autotuning
+bdp_ping_data = b'h2bdping'
+
+# Frames carrying header block fragments; a block goes on in CONTINUATION
+# frames until one of them sets END_HEADERS
+header_block_frame_types = (frames.frame_type.HEADERS, frames.frame_type.PUSH_PROMISE,
+        frames.frame_type.CONTINUATION)
+
+# Returned by send_request. A request that has to wait for a stream only
+# gets its stream id once one opens, which is before any of its response
+# arrives; until then stream_id is None.
+class request_handle:
+    __slots__ = ('stream_id', 'tag')
+
+    def __init__(self, tag=None):
+        self.stream_id = None
+        # Whatever the caller passed to send_request to tell requests apart
+        self.tag = tag
+
 class connection:
-    def __init__(self, callbacks, is_client = True):
+    # With streaming set, responses aren't delivered whole through the
+    # 'handle_message' callback. Instead, as each part arrives, the connection
+    # calls 'handle_headers' with (stream id, headers), 'handle_data' with
+    # (stream id, chunk) and 'handle_end' with (stream id, trailers or None).
+    # The chunk is a memoryview into the receive buffer, so it has to be
+    # copied if it's needed after 'handle_data' returns.
+    #
+    # initial_window_size and connection_window_size are the flow control
+    # windows the peer gets for sending us DATA, per stream and for the whole
+    # connection. Received DATA is credited back with WINDOW_UPDATE frames as
+    # it's consumed: when it's been delivered to the application, or, in
+    # streaming mode with auto_acknowledge unset, when the application calls
+    # acknowledge_data. With autotune_window set, both windows are grown up to
+    # max_window_size to match the bandwidth-delay product of the connection,
+    # as measured with PINGs.
+    #
+    # max_frame_size is the largest frame payload the peer may send us.
+    #
+    # Outbound frames are queued and written out together: once for each
+    # call to process_bytes or send_request, or whenever the connection is
+    # uncorked. The 'send' callback gets them joined into one buffer; if
+    # there's a 'send_buffers' callback, it gets the list of buffers instead,
+    # to pass on to writelines or sendmsg. Request bodies go into that list
+    # without being copied, so they mustn't be modified until they're sent.
+    #
+    # Requests beyond the peer's MAX_CONCURRENT_STREAMS wait in a queue until
+    # other streams close. With max_pending_requests set, send_request
+    # refuses requests when that many are waiting already.
+    #
+    # max_header_list_size, if set, is advertised to the peer as the largest
+    # header list it may send. Larger header blocks are a connection error.
+    #
+    # With header_list set, received headers and trailers are hpack
+    # header_lists instead of dicts, which keep repeated headers and only
+    # decode what is looked at. With decode_bytes set, header names and
+    # values are bytes instead of str.
+    #
+    # index_policy decides which headers sent go into the dynamic table; see
+    # hpack.policy.index_policy. Without one, they all do.
+    #
+    # With hpack_stats set, hpack_ctx.stats_snapshot() tells how well header
+    # compression is doing.
+    def __init__(self, callbacks, is_client = True, streaming = False,
+            initial_window_size = default_window_size, connection_window_size = default_window_size,
+            auto_acknowledge = True, autotune_window = False, max_window_size = 16 * 1024 * 1024,
+            max_frame_size = 16384, max_pending_requests = None, max_header_list_size = None,
+            header_list = False, decode_bytes = False, index_policy = None, hpack_stats = False):
         self.waiting_for_preface = True
         self.is_client = is_client
         self.next_stream_id = (1 if is_client else 2)
-        self.hpack_ctx = hpack.hpack.ctx()
+        # Streams are forgotten once they're closed. Any stream with a lower
+        # id than the next one we'd open, or the last one the peer opened, is
+        # closed if it isn't in streams.
+        self.last_remote_stream_id = 0
+        # Number of streams in streams that we opened, and the (headers, data)
+        # of requests waiting for one of them to close
+        self.local_stream_count = 0
+        self.pending_requests = deque()
+        self.max_pending_requests = max_pending_requests
+        # Decides which stream sends DATA next
+        self.priority = priority.priority_tree()
+        self.hpack_ctx = hpack.hpack.ctx(decode_bytes=decode_bytes, index_policy=index_policy,
+                stats=hpack_stats)
+        self.header_list = header_list
         self.streams = { }
         self.callbacks = callbacks
+        self.streaming = streaming
         self.recv_buffer = bytearray()
+        # Bytes before recv_offset in recv_buffer have already been decoded
+        self.recv_offset = 0
+        # Stream whose header block is still waiting for CONTINUATION frames
+        self.header_block_stream = None
+        # Encoded frames waiting to be sent, which only happens when corked
+        # is 0
+        self.send_queue = []
+        self.corked = 0
+
+        # Settings the peer asked us to use, and the ones we ask it to use
+        self.remote_settings = dict(default_settings)
+        self.local_settings = dict(default_settings)
+        self.local_settings[frames.settings_identifiers.INITIAL_WINDOW_SIZE] = initial_window_size
+        self.local_settings[frames.settings_identifiers.MAX_FRAME_SIZE] = max_frame_size
+        self.local_settings[frames.settings_identifiers.MAX_HEADER_LIST_SIZE] = max_header_list_size
+
+        # Connection flow control windows; see stream for the meaning of each
+        self.send_window = default_window_size
+        self.recv_window = default_window_size
+        self.recv_window_size = connection_window_size
+        self.recv_unacked = 0
+        self.auto_acknowledge = auto_acknowledge
+
+        # Window autotuning state: when the outstanding PING was sent, and how
+        # many bytes have been received since
+        self.autotune_window = autotune_window
+        self.max_window_size = max_window_size
+        self.bdp_ping_time = None
+        self.bdp_bytes = 0
+        self.rtt = None
 
     def initiate(self):
         logger.debug("Sending connection preface")
-        if self.callbacks['send'](connection_preface):
-            # Report send error
-            return
+        self.cork()
+        self.send_queue.append(connection_preface)
 
+        # Only send the settings that differ from their defaults
         initial_settings_frame = frames.settings_frame(0x0)
+        for identifier,value in self.local_settings.items():
+            if value != default_settings[identifier]:
+                initial_settings_frame.set_param(identifier, value)
         logger.debug("Sending initial settings frame %s", initial_settings_frame)
-        if self.callbacks['send'](initial_settings_frame.encode()):
-            # Report send error
-            return
+        self.send_frame(initial_settings_frame)
+
+        # The connection window can only be changed with WINDOW_UPDATE
+        if self.recv_window_size > default_window_size:
+            self.recv_window = self.recv_window_size
+            self.send_frame(frames.window_update_frame(0x0, self.recv_window_size - default_window_size))
+
+        return self.uncork()
+
+    def send_frame(self, frame):
+        self.queue_frame(frame)
+        if self.corked == 0:
+            return self.flush()
+        return 0
+
+    def queue_frame(self, frame):
+        if frame.frame_type == frames.frame_type.DATA and not frame.has_padding():
+            # DATA is queued as its header followed by the data itself, so the
+            # body isn't copied until it's written
+            self.send_queue.append(frame.header_bytes())
+            self.send_queue.append(frame.data)
+        else:
+            self.send_queue.append(frame.encode())
+
+    def cork(self):
+        # Holds back writes until the matching uncork, so frames queued in
+        # between go out together
+        self.corked += 1
+
+    def uncork(self):
+        self.corked -= 1
+        if self.corked == 0:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        # DATA is only picked just before writing, once every stream that has
+        # some to send is known. Streams opened meanwhile (from the pending
+        # requests) mustn't flush on their own.
+        self.corked += 1
+        self.send_data_frames()
+        self.corked -= 1
+
+        if len(self.send_queue) == 0:
+            return 0
+
+        send_queue = self.send_queue
+        self.send_queue = []
+        if 'send_buffers' in self.callbacks:
+            return self.callbacks['send_buffers'](send_queue)
+        return self.callbacks['send'](b''.join(send_queue))
 
     def process_bytes(self, some_bytes):
-        self.recv_buffer.extend(some_bytes)
+        self.cork()
+        self.extend_recv_buffer(some_bytes)
 
         # 9 bytes is the size of a frame header, so minimum size of frame
-        while len(self.recv_buffer) >= 9:
-            length = int.from_bytes(self.recv_buffer[0:3], 'big')
-            logger.debug("LENGTH %d %s", length, self.recv_buffer[0:3])
+        while len(self.recv_buffer) - self.recv_offset >= 9:
+            offset = self.recv_offset
+            length = int.from_bytes(self.recv_buffer[offset:offset+3], 'big')
+            if length > self.local_settings[frames.settings_identifiers.MAX_FRAME_SIZE]:
+                logger.debug("Frame of %d bytes is larger than allowed", length)
+                self.send_frame(frames.goaway_frame(error=frames.error.FRAME_SIZE_ERROR))
+                self.recv_offset = len(self.recv_buffer)
+                break
+
             # Length is of payload only
-            if length > len(self.recv_buffer) - 9:
+            if length > len(self.recv_buffer) - offset - 9:
                 # We don't have the whole frame yet
-                logger.debug("Waiting on more bytes: have %d, need %d", len(self.recv_buffer) - 9, length)
+                logger.debug("Waiting on more bytes: have %d, need %d", len(self.recv_buffer) - offset - 9, length)
                 break
 
             # Have a whole frame, decode it
-            frame,read = frames.frame.decode_static(self.recv_buffer)
+            frame,read = frames.frame.decode_static(self.recv_buffer, offset)
 
-            if frame is None:
+            if frame is None and read == frames.decoding_error.INVALID_FRAME_TYPE:
+                # Frames of unknown types are ignored (RFC 7540 section 4.1)
+                self.recv_offset = offset + 9 + length
+                continue
+            elif frame is None and read in connection.decoding_errors:
+                # The frame doesn't fit its type, which leaves the connection
+                # in no state to go on (RFC 7540 section 4.2)
+                logger.debug("Malformed frame: %s", read)
+                self.send_frame(frames.goaway_frame(error=connection.decoding_errors[read]))
+                self.recv_offset = len(self.recv_buffer)
+                break
+            elif frame is None:
                 logger.debug("Error occured when decoding a frame: %s", read)
-                self.recv_buffer = bytearray()
+                self.recv_offset = len(self.recv_buffer)
                 break
 
-            self.recv_buffer = self.recv_buffer[read:]
+            self.recv_offset = offset + read
             logger.debug("Decoded frame: %s", frame)
-            logger.debug("Read %d bytes from recv_buffer, %d left", read, len(self.recv_buffer))
+            logger.debug("Read %d bytes from recv_buffer, %d left", read, len(self.recv_buffer) - self.recv_offset)
+
+            # A header block's CONTINUATION frames follow it with nothing in
+            # between, and nowhere else (RFC 7540 section 6.10)
+            if frame.frame_type == frames.frame_type.CONTINUATION:
+                header_block_open = frame.stream_id == self.header_block_stream
+            else:
+                header_block_open = self.header_block_stream is None
+            if not header_block_open:
+                logger.debug("%s frame on stream %d out of header block order", frame.frame_type.name, frame.stream_id)
+                self.send_frame(frames.goaway_frame(error=frames.error.PROTOCOL_ERROR))
+                self.recv_offset = len(self.recv_buffer)
+                break
+            if frame.frame_type in header_block_frame_types:
+                if frame.is_flag_set(frames.headers_flags.END_HEADERS):
+                    self.header_block_stream = None
+                else:
+                    self.header_block_stream = frame.stream_id
 
             self.process_frame(frame)
 
+        self.compact_recv_buffer()
+        return self.uncork()
+
+    def extend_recv_buffer(self, some_bytes):
+        try:
+            self.recv_buffer.extend(some_bytes)
+        except BufferError:
+            # Somebody is still holding a view into the buffer (say, the data
+            # of a frame), so it can't be resized; move to a new one instead
+            self.recv_buffer = self.recv_buffer[self.recv_offset:] + some_bytes
+            self.recv_offset = 0
+
+    def compact_recv_buffer(self):
+        # Decoded bytes are only dropped once everything has been decoded, or
+        # there's a good amount of them; this keeps processing a burst of
+        # frames linear in the number of bytes
+        if self.recv_offset < len(self.recv_buffer) and self.recv_offset < recv_buffer_compact_threshold:
+            return
+
+        try:
+            del self.recv_buffer[:self.recv_offset]
+        except BufferError:
+            self.recv_buffer = self.recv_buffer[self.recv_offset:]
+        self.recv_offset = 0
+
     def process_frame(self, frame):
         if self.waiting_for_preface:
-            if frame.frame_type is not frames.frame_type.SETTINGS:
+            if frame.frame_type != frames.frame_type.SETTINGS:
                 # send connection error
                 return
 
-            # Was this an acknowledgement to ours?
-            if frame.is_flag_set(frames.settings_flags.ACK):
-                logger.debug("Got connection preface")
-                self.waiting_for_preface = False
+            # The peer's preface is a SETTINGS frame; frames it sends after
+            # that (like WINDOW_UPDATE) can't wait for it to acknowledge ours
+            logger.debug("Got connection preface")
+            self.waiting_for_preface = False
 
-            # Either way, we need to apply the settings in the frame
-            self.handle_settings(frame)
-        else:
-            switcher = {
-                    frames.frame_type.PUSH_PROMISE: self.handle_push_promise,
-                    frames.frame_type.PING: self.handle_ping,
-                    frames.frame_type.GOAWAY: self.handle_goaway,
-                    frames.frame_type.SETTINGS: self.handle_settings,
-            }
-            handler = switcher.get(frame.frame_type, self.pass_frame_to_stream)
-            connection_error = handler(frame)
-            if connection_error is not frames.error.NO_ERROR:
-                logger.debug("connection error: %s", connection_error)
-                self.callbacks['send'](frames.goaway_frame(error=connection_error).encode())
+        connection_error = connection.frame_handlers[frame.frame_type](self, frame)
+        if connection_error is not frames.error.NO_ERROR:
+            logger.debug("connection error: %s", connection_error)
+            self.send_frame(frames.goaway_frame(error=connection_error))
+
+    def handle_priority(self, frame):
+        if frame.stream_id == 0:
+            return frames.error.PROTOCOL_ERROR
+
+        if frame.stream_dependency == frame.stream_id:
+            # A stream can't depend on itself (RFC 7540 section 5.3.1)
+            the_stream = self.streams.get(frame.stream_id)
+            if the_stream is None:
+                self.send_frame(frames.rst_stream_frame(frame.stream_id, frames.error.PROTOCOL_ERROR))
+            else:
+                the_stream.queue_stream_error()
+                self.flush_stream_send(the_stream)
+            return frames.error.NO_ERROR
+
+        # Priorities of streams that are closed, or not open yet, aren't kept
+        if frame.stream_id in self.priority:
+            self.priority.reprioritize(frame.stream_id, frame.stream_dependency,
+                    frame.weight + 1, frame.exclusive_dependency)
+        return frames.error.NO_ERROR
 
     def handle_push_promise(self, frame):
         logger.debug("Connection handling PUSH_PROMISE frame")
@@ -90,6 +346,12 @@ class connection:
 
     def handle_ping(self, frame):
         logger.debug("Connection handling PING frame")
+        if not frame.is_flag_set(frames.ping_flags.ACK):
+            ack_frame = frames.ping_frame(0x0, frame.data)
+            ack_frame.set_flag(frames.ping_flags.ACK)
+            self.send_frame(ack_frame)
+        elif frame.data == bdp_ping_data and self.bdp_ping_time is not None:
+            self.handle_bdp_ping_ack()
         return frames.error.NO_ERROR
 
     def handle_goaway(self, frame):
@@ -98,41 +360,363 @@ class connection:
 
     def handle_settings(self, frame):
         logger.debug("Connection handling SETTINGS frame")
+        if frame.is_flag_set(frames.settings_flags.ACK):
+            return frames.error.NO_ERROR
+
+        for identifier,value in frame.params.items():
+            connection_error = self.apply_setting(identifier, value)
+            if connection_error is not frames.error.NO_ERROR:
+                return connection_error
+
+        ack_frame = frames.settings_frame(0x0)
+        ack_frame.set_flag(frames.settings_flags.ACK)
+        self.send_frame(ack_frame)
+
+        self.flush_all_streams()
+        # MAX_CONCURRENT_STREAMS may have gone up
+        self.open_pending_requests()
+        return frames.error.NO_ERROR
+
+    def apply_setting(self, identifier, value):
+        if identifier not in default_settings:
+            # Unknown settings must be ignored
+            return frames.error.NO_ERROR
+
+        if identifier == frames.settings_identifiers.HEADERS_TABLE_SIZE:
+            # The encoder has to announce the new size at the start of the
+            # next header block
+            self.hpack_ctx.set_max_table_size_out(value)
+        elif identifier == frames.settings_identifiers.ENABLE_PUSH:
+            if value > 1:
+                return frames.error.PROTOCOL_ERROR
+        elif identifier == frames.settings_identifiers.INITIAL_WINDOW_SIZE:
+            if value > stream.max_window_size:
+                return frames.error.FLOW_CONTROL_ERROR
+
+            # A new initial window size applies to the streams already open
+            # too (RFC 7540 section 6.9.2)
+            delta = value - self.remote_settings[identifier]
+            for the_stream in self.streams.values():
+                the_stream.send_window += delta
+                if the_stream.send_window > stream.max_window_size:
+                    return frames.error.FLOW_CONTROL_ERROR
+        elif identifier == frames.settings_identifiers.MAX_FRAME_SIZE:
+            if value < default_settings[identifier] or value > max_frame_size_limit:
+                return frames.error.PROTOCOL_ERROR
+
+        logger.debug("Peer setting %s is now %d", frames.settings_identifiers(identifier).name, value)
+        self.remote_settings[identifier] = value
         return frames.error.NO_ERROR
 
+    def handle_window_update(self, frame):
+        if frame.stream_id != 0:
+            return self.pass_frame_to_stream(frame)
+
+        if frame.window_size_increment == 0:
+            return frames.error.PROTOCOL_ERROR
+
+        self.send_window += frame.window_size_increment
+        if self.send_window > stream.max_window_size:
+            return frames.error.FLOW_CONTROL_ERROR
+
+        # Streams may have been waiting on the connection window
+        self.flush_all_streams()
+        return frames.error.NO_ERROR
+
+    def handle_data(self, frame):
+        length = frame.flow_controlled_length()
+        if length > self.recv_window:
+            return frames.error.FLOW_CONTROL_ERROR
+        self.recv_window -= length
+
+        rc = self.pass_frame_to_stream(frame)
+
+        # Padding is never seen by the application, and buffered data is as
+        # good as consumed; credit those back straight away
+        if self.auto_acknowledge or not self.streaming:
+            self.acknowledge_data(frame.stream_id, length)
+        else:
+            self.acknowledge_data(frame.stream_id, length - len(frame.data))
+
+        if self.autotune_window:
+            self.sample_bdp(length)
+
+        return rc
+
+    def acknowledge_data(self, stream_identifier, length):
+        # Lets the peer send length more bytes on the connection and stream
+        self.recv_unacked += length
+        if self.recv_unacked >= self.recv_window_size // 2:
+            self.recv_window += self.recv_unacked
+            self.send_frame(frames.window_update_frame(0x0, self.recv_unacked))
+            self.recv_unacked = 0
+
+        # No point in updating the window of a stream the peer is done with
+        the_stream = self.streams.get(stream_identifier)
+        if the_stream is None or the_stream.remote_closed():
+            return
+
+        the_stream.recv_unacked += length
+        if the_stream.recv_unacked >= the_stream.recv_window_size // 2:
+            the_stream.recv_window += the_stream.recv_unacked
+            self.send_frame(frames.window_update_frame(stream_identifier, the_stream.recv_unacked))
+            the_stream.recv_unacked = 0
+
+    def sample_bdp(self, length):
+        # Counts the bytes received while a PING is outstanding, which is an
+        # estimate of the bandwidth-delay product
+        if self.bdp_ping_time is not None:
+            self.bdp_bytes += length
+        elif self.local_settings[frames.settings_identifiers.INITIAL_WINDOW_SIZE] < self.max_window_size:
+            self.bdp_ping_time = time.monotonic()
+            self.bdp_bytes = length
+            self.send_frame(frames.ping_frame(0x0, bdp_ping_data))
+
+    def handle_bdp_ping_ack(self):
+        self.rtt = time.monotonic() - self.bdp_ping_time
+        self.bdp_ping_time = None
+
+        # Grow the windows when the peer managed to fill most of a stream's
+        # window in one round trip, since it's then likely limited by it
+        initial_window_size = self.local_settings[frames.settings_identifiers.INITIAL_WINDOW_SIZE]
+        if self.bdp_bytes * 3 < initial_window_size * 2:
+            return
+        window_size = min(self.bdp_bytes * 2, self.max_window_size)
+        if window_size <= initial_window_size:
+            return
+
+        logger.debug("Autotuning window from %d to %d (rtt %f)", initial_window_size, window_size, self.rtt)
+
+        # A new initial window size grows the windows of open streams by the
+        # difference, on both ends
+        delta = window_size - initial_window_size
+        self.local_settings[frames.settings_identifiers.INITIAL_WINDOW_SIZE] = window_size
+        for the_stream in self.streams.values():
+            the_stream.recv_window += delta
+            the_stream.recv_window_size = window_size
+        settings_frame = frames.settings_frame(0x0)
+        settings_frame.set_param(frames.settings_identifiers.INITIAL_WINDOW_SIZE, window_size)
+        self.send_frame(settings_frame)
+
+        if window_size > self.recv_window_size:
+            self.recv_window += window_size - self.recv_window_size
+            self.send_frame(frames.window_update_frame(0x0, window_size - self.recv_window_size))
+            self.recv_window_size = window_size
+
     def pass_frame_to_stream(self, frame):
-        if frame.stream_identifier not in self.streams:
-            # new stream
-            # TODO: There are definitely qualifications on the stream id of a
-            # new stream
-            self.open_stream(frame.stream_identifier)
-        stream = self.streams[frame.stream_identifier]
+        stream = self.streams.get(frame.stream_id)
+        if stream is None:
+            return self.handle_frame_without_stream(frame)
+
+        if frame.frame_type == frames.frame_type.HEADERS and frame.has_priority():
+            # The weight on the wire is one less than the actual weight
+            self.priority.reprioritize(frame.stream_id, frame.stream_dependency,
+                    frame.weight + 1, frame.exclusive_dependency)
+
         rc = stream.handle_recv_frame(frame)
         self.flush_stream_send(stream)
         self.handle_stream_messages(stream)
         return rc
 
+    def handle_frame_without_stream(self, frame):
+        stream_identifier = frame.stream_id
+        if stream_identifier == 0:
+            return frames.error.PROTOCOL_ERROR
+
+        if (stream_identifier % 2 == 1) == self.is_client:
+            # One of ours, which we can't have opened yet, or closed
+            if stream_identifier >= self.next_stream_id:
+                return frames.error.PROTOCOL_ERROR
+            return self.handle_closed_stream_frame(frame)
+
+        if stream_identifier <= self.last_remote_stream_id:
+            return self.handle_closed_stream_frame(frame)
+
+        # The peer opens new streams with HEADERS (RFC 7540 section 5.1.1)
+        if frame.frame_type != frames.frame_type.HEADERS:
+            return frames.error.PROTOCOL_ERROR
+        self.last_remote_stream_id = stream_identifier
+        self.open_stream(stream_identifier)
+        return self.pass_frame_to_stream(frame)
+
+    def handle_closed_stream_frame(self, frame):
+        # WINDOW_UPDATE and RST_STREAM may have been sent before the peer knew
+        # the stream was closed, and are ignored
+        if frame.frame_type == frames.frame_type.WINDOW_UPDATE or frame.frame_type == frames.frame_type.RST_STREAM:
+            return frames.error.NO_ERROR
+
+        if frame.frame_type != frames.frame_type.DATA:
+            # The header block still has to be decoded, to keep the decoder's
+            # dynamic table in step with the peer's; one spread over
+            # CONTINUATION frames can't be followed any more
+            if not frame.is_flag_set(frames.headers_flags.END_HEADERS):
+                return frames.error.STREAM_CLOSED
+            if frame.frame_type == frames.frame_type.HEADERS:
+                try:
+                    # Nobody is going to look at the headers, so they're
+                    # only decoded as far as the dynamic table needs
+                    decoder = self.hpack_ctx.start_decode(self.local_settings[frames.settings_identifiers.MAX_HEADER_LIST_SIZE],
+                            lazy=True)
+                    decoder.feed(frame.header_block_fragment)
+                    decoder.finish()
+                except Exception as e:
+                    logger.debug("Couldn't decode header block: %s", e)
+                    return frames.error.COMPRESSION_ERROR
+
+        logger.debug("Frame on closed stream %d", frame.stream_id)
+        self.send_frame(frames.rst_stream_frame(frame.stream_id, frames.error.STREAM_CLOSED))
+        return frames.error.NO_ERROR
+
+    def retire_stream(self, stream):
+        # Closed streams are dropped; frames that still arrive for them are
+        # told apart by their ids
+        if stream.state is stream_state.CLOSED and stream.identifier in self.streams:
+            logger.debug("Retiring stream %d", stream.identifier)
+            del self.streams[stream.identifier]
+            self.priority.remove(stream.identifier)
+            if (stream.identifier % 2 == 1) == self.is_client:
+                self.local_stream_count -= 1
+                self.open_pending_requests()
+
+    def new_stream(self, stream_identifier):
+        return stream.stream(stream_identifier, self.hpack_ctx, self.streaming,
+                self.remote_settings[frames.settings_identifiers.INITIAL_WINDOW_SIZE],
+                self.local_settings[frames.settings_identifiers.INITIAL_WINDOW_SIZE],
+                self.local_settings[frames.settings_identifiers.MAX_HEADER_LIST_SIZE],
+                self.header_list)
+
     def open_stream(self, stream_identifier, reserved_state=stream.reserved.NONE):
-        self.streams[stream_identifier] = stream.stream(stream_identifier, reserved_state)
+        new_stream = self.new_stream(stream_identifier)
+        if reserved_state is stream.reserved.LOCAL:
+            new_stream.state = stream.stream_state.RESERVED_LOCAL
+        elif reserved_state is stream.reserved.REMOTE:
+            new_stream.state = stream.stream_state.RESERVED_REMOTE
+        self.streams[stream_identifier] = new_stream
+        self.priority.insert(stream_identifier)
+
+    # depends_on, weight (1 to 256) and exclusive set the priority of the
+    # request's stream, as described in RFC 7540 section 5.3. The body of a
+    # stream is sent ahead of the bodies of streams that depend on it, and
+    # streams that depend on the same stream share in proportion to their
+    # weights.
+    def send_request(self, headers, data=None, depends_on=0, weight=priority.default_weight, exclusive=False,
+            tag=None):
+        # Returns a request_handle, whose stream_id identifies the response
+        # in the callbacks, or None if the request was refused because too
+        # many are waiting to be sent already
+        handle = request_handle(tag)
+        request = (headers, data, depends_on, weight, exclusive, handle)
+        if len(self.pending_requests) == 0 and self.can_open_stream():
+            self.open_request_stream(*request)
+            return handle
+
+        if self.max_pending_requests is not None and len(self.pending_requests) >= self.max_pending_requests:
+            return None
+        logger.debug("Queueing request, %d streams open", self.local_stream_count)
+        self.pending_requests.append(request)
+        return handle
+
+    def can_open_stream(self):
+        max_streams = self.remote_settings[frames.settings_identifiers.MAX_CONCURRENT_STREAMS]
+        return max_streams is None or self.local_stream_count < max_streams
 
-    def send_request(self, headers, data=None):
-        new_stream = stream.stream(self.next_stream_id, self.hpack_ctx)
-        self.streams[self.next_stream_id] = new_stream
+    def open_pending_requests(self):
+        while len(self.pending_requests) > 0 and self.can_open_stream():
+            self.open_request_stream(*self.pending_requests.popleft())
+
+    def open_request_stream(self, headers, data, depends_on, weight, exclusive, handle):
+        stream_identifier = self.next_stream_id
+        handle.stream_id = stream_identifier
+        new_stream = self.new_stream(stream_identifier)
+        self.streams[stream_identifier] = new_stream
         self.next_stream_id += 2
+        self.local_stream_count += 1
+        self.priority.insert(stream_identifier, depends_on, weight, exclusive)
+
+        # Only a priority other than the default has to be sent
+        stream_priority = None
+        if depends_on != 0 or weight != priority.default_weight or exclusive:
+            stream_priority = (depends_on, weight, exclusive)
 
-        new_stream.handle_send_message(headers, data)
+        self.cork()
+        new_stream.handle_send_message(headers, data,
+                self.remote_settings[frames.settings_identifiers.MAX_FRAME_SIZE], stream_priority)
         self.flush_stream_send(new_stream)
+        self.uncork()
 
     def flush_stream_send(self, stream):
-        frames = stream.flush_send_queue()
-        if len(frames) > 0:
-            logger.debug("Sending frames %s on stream id %d", frames, stream.identifier)
-            encoded_frames = bytearray()
-            for frame in frames:
-                encoded_frames.extend(frame.encode())
-            self.callbacks['send'](encoded_frames)
+        # Sends what the stream queued, and lets the priority tree know
+        # whether the stream has DATA to send; that's sent when flushing
+        send_frames = stream.flush_send_queue()
+        if len(send_frames) > 0:
+            logger.debug("Sending frames %s on stream id %d", send_frames, stream.identifier)
+            for frame in send_frames:
+                self.queue_frame(frame)
+
+        self.update_ready(stream)
+        self.retire_stream(stream)
+        if self.corked == 0:
+            self.flush()
+
+    def update_ready(self, stream):
+        self.priority.set_ready(stream.identifier, stream.send_data is not None and stream.send_window > 0)
+
+    def flush_all_streams(self):
+        for the_stream in self.streams.values():
+            self.update_ready(the_stream)
+        if self.corked == 0:
+            self.flush()
+
+    def send_data_frames(self):
+        # Sends as much DATA as the connection window allows, a frame at a
+        # time from the stream the priority tree picks, in frames as large as
+        # the peer accepts
+        max_frame_size = self.remote_settings[frames.settings_identifiers.MAX_FRAME_SIZE]
+        while self.send_window > 0:
+            stream_identifier = self.priority.next_stream()
+            if stream_identifier is None:
+                break
+
+            the_stream = self.streams[stream_identifier]
+            data_frame = the_stream.next_data_frame(min(self.send_window, max_frame_size))
+            if data_frame is not None:
+                self.send_window -= len(data_frame.data)
+                self.queue_frame(data_frame)
+                self.priority.sent(stream_identifier, len(data_frame.data))
+
+            self.update_ready(the_stream)
+            self.retire_stream(the_stream)
 
     def handle_stream_messages(self, stream):
         messages = stream.flush_message_queue()
         for message in messages:
             self.callbacks['handle_message'](message)
+
+        for event,payload in stream.flush_event_queue():
+            if event is stream_event.HEADERS:
+                self.callbacks['handle_headers'](stream.identifier, payload)
+            elif event is stream_event.DATA:
+                self.callbacks['handle_data'](stream.identifier, payload)
+            else:
+                self.callbacks['handle_end'](stream.identifier, payload)
+
+    # Handler of each frame type, indexed by the type. Streams handle the
+    # frame types the connection doesn't.
+    frame_handlers = [
+            handle_data,            # DATA
+            pass_frame_to_stream,   # HEADERS
+            handle_priority,        # PRIORITY
+            pass_frame_to_stream,   # RST_STREAM
+            handle_settings,        # SETTINGS
+            handle_push_promise,    # PUSH_PROMISE
+            handle_ping,            # PING
+            handle_goaway,          # GOAWAY
+            handle_window_update,   # WINDOW_UPDATE
+            pass_frame_to_stream,   # CONTINUATION
+        ]
+
+    # Connection error to answer each kind of malformed frame with
+    decoding_errors = {
+            frames.decoding_error.FRAME_SIZE_ERROR: frames.error.FRAME_SIZE_ERROR,
+            frames.decoding_error.PROTOCOL_ERROR: frames.error.PROTOCOL_ERROR,
+        }
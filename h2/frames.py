@@ -1,10 +1,15 @@
 from enum import IntEnum
-from os import urandom
 import struct
 import logging
 
 logger = logging.getLogger('frame')
 
+# Fixed 9-byte frame header; the 24-bit length is split in two fields
+frame_header = struct.Struct("!BHBBI")
+
+# Largest stream identifier, which is 31 bits
+max_stream_id = 2**31 - 1
+
 class frame_type(IntEnum):
     UNSET = -1
     DATA = 0x0
@@ -21,43 +26,43 @@ class frame_type(IntEnum):
 class decoding_error(IntEnum):
     FRAME_TOO_SMALL = 1,
     INVALID_FRAME_TYPE = 2,
-    TEMPORARILY_UNSUPPORTED = 3
-
+    TEMPORARILY_UNSUPPORTED = 3,
+    # The payload length is wrong for the frame type
+    FRAME_SIZE_ERROR = 4,
+    # The payload is malformed, like padding longer than the payload
+    PROTOCOL_ERROR = 5
+
+# Frame objects are made for every frame sent and received, so they use
+# __slots__, and the frame type is a class attribute rather than being
+# converted from the encoded type byte on every decode.
 class frame:
+    __slots__ = ('stream_id', 'flags')
+    frame_type = frame_type.UNSET
+    # Frame class of each frame type, indexed by the type
     frame_map = None
 
-    def decode_static(encoded):
-        if frame.frame_map is None:
-            frame.frame_map = {
-                    frame_type.DATA: data_frame,
-                    frame_type.HEADERS: headers_frame,
-                    frame_type.PRIORITY: priority_frame,
-                    frame_type.RST_STREAM: rst_stream_frame,
-                    frame_type.SETTINGS: settings_frame,
-                    frame_type.PUSH_PROMISE: push_promise_frame,
-                    frame_type.PING: ping_frame,
-                    frame_type.GOAWAY: goaway_frame,
-                    frame_type.WINDOW_UPDATE: window_update_frame,
-                    frame_type.CONTINUATION: continuation_frame,
-                }
-
-        if len(encoded) < 4:
+    def decode_static(encoded, offset=0):
+        # Frames are decoded in place: payload fields like DATA's data are
+        # memoryviews into encoded, covering only this frame's payload, and
+        # only get copied if whoever handles the frame wants to keep them.
+        encoded = memoryview(encoded)
+        if len(encoded) < offset + 9:
             return None,decoding_error.FRAME_TOO_SMALL
-        elif encoded[3] in frame.frame_map:
-            frame_type_bit = frame_type(encoded[3])
-            new_frame_type = frame.frame_map[frame_type_bit]
+        elif encoded[offset+3] < len(frame.frame_map):
+            new_frame_type = frame.frame_map[encoded[offset+3]]
         else:
-            logger.debug("Unknown frame type %s", frame_type_bit)
+            logger.debug("Unknown frame type %d", encoded[offset+3])
             return None,decoding_error.INVALID_FRAME_TYPE
 
         the_frame = new_frame_type()
-        bytes_read = the_frame.decode(encoded)
+        bytes_read = the_frame.decode(encoded, offset)
+        if type(bytes_read) is decoding_error:
+            return None,bytes_read
         return the_frame, bytes_read
 
-    def __init__(self, stream_id = 0x0, frame_type = frame_type.UNSET):
+    def __init__(self, stream_id = 0x0):
         self.stream_id = stream_id
         self.flags = 0x0
-        self.frame_type = frame_type
 
     def set_flag(self, flag):
         self.flags = self.flags | flag
@@ -68,40 +73,64 @@ class frame:
     def is_flag_set (self, flag):
         return (self.flags & flag) > 0
 
-    def encode_payload(self):
+    def payload_length(self):
         raise NotImplementedError("Can't encode frame base class")
 
-    def encode(self):
+    def encode_payload_into(self, buf, offset):
+        # Writes the payload at offset in buf and returns the offset after it
+        raise NotImplementedError("Can't encode frame base class")
+
+    def encode_payload(self):
+        encoded = bytearray(self.payload_length())
+        self.encode_payload_into(encoded, 0)
+        return encoded
+
+    def header_bytes(self):
+        encoded = bytearray(9)
+        self.encode_header_into(encoded, 0, self.payload_length())
+        return encoded
+
+    def encode_header_into(self, buf, offset, length):
         if self.frame_type == frame_type.UNSET:
             raise Exception("Can't encode frame with frame_type unset")
-        elif self.stream_id < 0 or self.stream_id > 16834:
+        elif self.stream_id < 0 or self.stream_id > max_stream_id:
             raise Exception("Invalid stream identifier")
 
-        # Total length is length of frame header (9) + length of payload
-        payload_encoded = self.encode_payload()
-        plen = len(payload_encoded)
-        encoded = bytearray(9 + plen)
-        # 24-bit length
-        encoded[0:3] = plen.to_bytes(3, 'big')
-        # 8-bit type
-        encoded[3] = (self.frame_type & 0xff)
-        # 8-bit flags
-        encoded[4] = self.flags & 0xff
-        # 1-bit reserved flag and 31 bit stream identifier
-        encoded[5:9] = self.stream_id.to_bytes(4, 'big')
-        encoded[5] = encoded[5] & 0x7f
-
-        # payload_length Payload
-        encoded[9:] = payload_encoded
+        # 24-bit length, 8-bit type, 8-bit flags, 1-bit reserved flag and 31
+        # bit stream identifier
+        frame_header.pack_into(buf, offset, length >> 16, length & 0xffff,
+                self.frame_type, self.flags & 0xff, self.stream_id)
+
+    def encode_into(self, buf, offset=0):
+        # Writes the whole frame at offset in buf, which has to have room for
+        # 9 + payload_length() bytes, and returns the number of bytes written
+        length = self.payload_length()
+        self.encode_header_into(buf, offset, length)
+        self.encode_payload_into(buf, offset+9)
+        return length + 9
 
+    def encode(self):
+        encoded = bytearray(9 + self.payload_length())
+        self.encode_into(encoded, 0)
         return encoded
 
-    def decode(self, encoded):
-        length = int.from_bytes(encoded[0:3], 'big')
-        self.frame_type = frame_type(encoded[3])
-        self.flags = encoded[4]
-        self.stream_identifier = int.from_bytes(encoded[5:9], 'big')
-        self.decode_payload(encoded[9:], length)
+    def decode(self, encoded, offset=0):
+        # 24-bit length, 8-bit type, 8-bit flags, 1-bit reserved flag and
+        # 31-bit stream identifier
+        length_high, length_low, _, self.flags, stream_id = \
+                frame_header.unpack_from(encoded, offset)
+        length = (length_high << 16) | length_low
+        self.stream_id = stream_id & 0x7fffffff
+
+        end = offset + 9 + length
+        if end > len(encoded):
+            return decoding_error.FRAME_TOO_SMALL
+
+        # Hand over a view bounded to this frame's payload; payloads that
+        # don't fit their frame type come back as a decoding_error
+        error = self.decode_payload(memoryview(encoded)[offset+9:end], length)
+        if error is not None:
+            return error
         return length+9
 
 class data_flags(IntEnum):
@@ -117,6 +146,9 @@ class headers_flags(IntEnum):
 class settings_flags(IntEnum):
     ACK = 0x1
 
+class ping_flags(IntEnum):
+    ACK = 0x1
+
 class push_promise_flags(IntEnum):
     END_HEADERS = 0x4
     PADDED = 0x8
@@ -138,51 +170,65 @@ class error(IntEnum):
     HTTP_1_1_REQUIRED = 0xd
 
 class data_frame(frame):
+    __slots__ = ('pad_length', 'data')
+    frame_type = frame_type.DATA
+
     def __init__(self, stream_id = 0x0, data = None):
-        frame.__init__(self, stream_id, frame_type.DATA)
+        frame.__init__(self, stream_id)
         self.pad_length = 0
         self.data = data
 
     def has_padding(self):
         return self.is_flag_set(data_flags.PADDED)
 
-    def encode_payload(self):
-        encoded = bytearray(1+len(self.data)+self.pad_length)
-        cur_byte = 0
+    def flow_controlled_length(self):
+        # The whole payload counts against flow control windows, padding
+        # included (RFC 7540 section 6.9)
+        return len(self.data) + (self.pad_length + 1 if self.has_padding() else 0)
+
+    def payload_length(self):
+        return self.flow_controlled_length()
 
+    def encode_payload_into(self, buf, offset):
         # 8-bit Padding length field
         if self.has_padding():
-            encoded[cur_byte] = self.pad_length & 0xff
-            cur_byte = 1
+            buf[offset] = self.pad_length & 0xff
+            offset = offset + 1
 
         # Variable length data payload
-        encoded[cur_byte:] = self.data
-        cur_byte = cur_byte + len(self.data)
+        buf[offset:offset+len(self.data)] = self.data
+        offset = offset + len(self.data)
 
-        # Variable length padding
+        # Variable length padding, which must be zeroes
         if self.has_padding():
-            encoded[cur_byte:] = urandom(self.pad_length)
-            cur_byte = cur_byte + self.pad_length
+            buf[offset:offset+self.pad_length] = bytes(self.pad_length)
+            offset = offset + self.pad_length
 
-        return encoded
+        return offset
 
     def decode_payload(self, encoded, length):
         cur_byte = 0
 
         # 8-bit padding length
         if self.has_padding():
+            if length < 1:
+                return decoding_error.FRAME_SIZE_ERROR
             self.pad_length = encoded[cur_byte]
             cur_byte = cur_byte+1
+            if self.pad_length > length - cur_byte:
+                return decoding_error.PROTOCOL_ERROR
 
         # Variable length data payload
-        self.data = encoded[cur_byte:cur_byte+length-self.pad_length]
-        cur_byte = cur_byte + length - self.pad_length
+        self.data = encoded[cur_byte:length-self.pad_length]
         # The rest of the bytes are padding, we could verify the length but
         # we'll just ignore them
 
 class headers_frame(frame):
+    __slots__ = ('pad_length', 'exclusive_dependency', 'stream_dependency', 'weight', 'header_block_fragment')
+    frame_type = frame_type.HEADERS
+
     def __init__(self, stream_id = 0x0, header_block_fragment = None):
-        frame.__init__(self, stream_id, frame_type.HEADERS)
+        frame.__init__(self, stream_id)
         self.pad_length = 0
         self.exclusive_dependency = False
         self.stream_dependency = 0x0
@@ -195,41 +241,49 @@ class headers_frame(frame):
     def has_priority(self):
         return self.is_flag_set(headers_flags.PRIORITY)
 
-    def encode_payload(self):
-        encoded = bytearray(6 + len(self.header_block_fragment) + self.pad_length)
-        cur_byte = 0
+    def payload_length(self):
+        length = len(self.header_block_fragment)
+        if self.has_padding():
+            length = length + 1 + self.pad_length
+        if self.has_priority():
+            length = length + 5
+        return length
 
+    def encode_payload_into(self, buf, offset):
         # 8-bit padding length
         if self.has_padding():
-            encoded[cur_byte] = self.pad_length & 0xff
-            cur_byte = cur_byte + 1
+            buf[offset] = self.pad_length & 0xff
+            offset = offset + 1
 
         if self.has_priority():
             # 1-bit exclusive dependency flag and 31-bit stream dependency
-            encoded[cur_byte:cur_byte+4] = self.stream_dependency.to_bytes(4, 'big')
+            buf[offset:offset+4] = self.stream_dependency.to_bytes(4, 'big')
             if self.exclusive_dependency:
-                encoded[cur_byte] = encoded[cur_byte] | 0x80
+                buf[offset] = buf[offset] | 0x80
             else:
-                encoded[cur_byte] = encoded[cur_byte] & 0x7f
+                buf[offset] = buf[offset] & 0x7f
 
             # 8-bit frame weight
-            encoded[cur_byte+4] = self.weight & 0xff
-            cur_byte = cur_byte + 5
+            buf[offset+4] = self.weight & 0xff
+            offset = offset + 5
 
         # Variable-length header block fragment
-        encoded[cur_byte:] = self.header_block_fragment
-        cur_byte = cur_byte + len(self.header_block_fragment)
+        buf[offset:offset+len(self.header_block_fragment)] = self.header_block_fragment
+        offset = offset + len(self.header_block_fragment)
 
-        # Variable-length padding
+        # Variable-length padding, which must be zeroes
         if self.has_padding():
-            encoded[cur_byte:] = urandom(pad_length)
-            cur_byte = cur_byte + pad_length
+            buf[offset:offset+self.pad_length] = bytes(self.pad_length)
+            offset = offset + self.pad_length
 
-        return encoded
+        return offset
 
     def decode_payload(self, encoded, length):
         cur_byte = 0
 
+        if length < (1 if self.has_padding() else 0) + (5 if self.has_priority() else 0):
+            return decoding_error.FRAME_SIZE_ERROR
+
         # 8-bit padding length
         if self.has_padding():
             self.pad_length = encoded[cur_byte]
@@ -239,60 +293,74 @@ class headers_frame(frame):
             # 1-bit exclusive dependency flag
             self.exclusive_dependency = (encoded[cur_byte] & 0x80) > 0
             # 31-bit stream dependency
-            stream_dependency_bits = encoded[cur_byte:cur_byte+4]
-            stream_dependency_bits[0] = stream_dependency_bits[0] & 0x7f
-            self.stream_dependency = int.from_bytes(stream_dependency_bits, 'big')
+            self.stream_dependency = int.from_bytes(encoded[cur_byte:cur_byte+4], 'big') & 0x7fffffff
             # 8-bit weight
             self.weight = encoded[cur_byte+4]
             cur_byte = cur_byte + 5
 
+        if self.pad_length > length - cur_byte:
+            return decoding_error.PROTOCOL_ERROR
+
         # Variable-length header block fragment, must be decoded by an hpack ctx
-        self.header_block_fragment = encoded[cur_byte:cur_byte+length-self.pad_length]
-        cur_byte = cur_byte + length - self.pad_length
+        self.header_block_fragment = encoded[cur_byte:length-self.pad_length]
         # We can ignore the padding
 
 class priority_frame(frame):
+    __slots__ = ('exclusive_dependency', 'stream_dependency', 'weight')
+    frame_type = frame_type.PRIORITY
+
     def __init__(self, stream_id  = 0x0, exclusive_dependency = False, stream_dependency = 0x0, weight = 0):
-        frame.__init__(self, stream_id, frame_type.PRIORITY)
+        frame.__init__(self, stream_id)
         self.exclusive_dependency = exclusive_dependency
         self.stream_dependency = stream_dependency
         self.weight = weight
 
-    def encode_payload(self):
-        encoded = bytearray(5)
+    def payload_length(self):
+        return 5
 
+    def encode_payload_into(self, buf, offset):
         # 1-bit exclusive dependency flag and 31-bit stream dependency
-        encoded[0:4] = self.stream_dependency.to_bytes(4, 'big')
+        buf[offset:offset+4] = self.stream_dependency.to_bytes(4, 'big')
         if self.exclusive_dependency:
-            encoded[0] = encoded[0] | 0x80
+            buf[offset] = buf[offset] | 0x80
         else:
-            encoded[0] = encoded[0] & 0x7f
+            buf[offset] = buf[offset] & 0x7f
 
         # 8-bit frame weight
-        encoded[4] = self.weight & 0xff
+        buf[offset+4] = self.weight & 0xff
 
-        return encoded
+        return offset + 5
 
     def decode_payload(self, encoded, length):
+        if length != 5:
+            return decoding_error.FRAME_SIZE_ERROR
+
         # 1-bit exclusive dependency flag
         self.exclusive_dependency = (encoded[0] & 0x80) > 0
         # 31-bit stream dependency
-        stream_dependency_bits = encoded[0:4]
-        stream_dependency_bits[0] = stream_dependency_bits[0] & 0x7f
-        self.stream_dependency = int.from_bytes(stream_dependency_bits, 'big')
+        self.stream_dependency = int.from_bytes(encoded[0:4], 'big') & 0x7fffffff
         self.weight = encoded[4]
 
 
 class rst_stream_frame(frame):
+    __slots__ = ('error_code',)
+    frame_type = frame_type.RST_STREAM
+
     def __init__(self, stream_id = 0x0, error=error.NO_ERROR):
-        frame.__init__(self, stream_id, frame_type.RST_STREAM)
+        frame.__init__(self, stream_id)
         self.error_code = error
 
-    def encode_payload(self):
-        return self.error_code.to_bytes(4, 'big')
+    def payload_length(self):
+        return 4
+
+    def encode_payload_into(self, buf, offset):
+        buf[offset:offset+4] = self.error_code.to_bytes(4, 'big')
+        return offset + 4
 
     def decode_payload(self, encoded, length):
-        self.error_code = int.from_bytes(encoded[0:4])
+        if length != 4:
+            return decoding_error.FRAME_SIZE_ERROR
+        self.error_code = int.from_bytes(encoded[0:4], 'big')
 
 class settings_identifiers(IntEnum):
     HEADERS_TABLE_SIZE = 0x1
@@ -303,34 +371,38 @@ class settings_identifiers(IntEnum):
     MAX_HEADER_LIST_SIZE = 0x6
 
 class settings_frame(frame):
+    __slots__ = ('params',)
+    frame_type = frame_type.SETTINGS
+
     def __init__(self, stream_id = 0x0):
-        frame.__init__(self, stream_id, frame_type.SETTINGS)
+        frame.__init__(self, stream_id)
         self.params = {}
 
     def set_param(self, identifier, value):
-        if identifier not in settings_identifiers:
-            raise Exception("Invalid SETTINGS identifier {:d}", idx)
+        if identifier not in settings_identifiers.__members__.values():
+            raise Exception("Invalid SETTINGS identifier {:d}".format(identifier))
         self.params[identifier] = value
 
-    def encode_payload(self):
-        # Maximum size is 36 bytes (6 different identifiers, 2 bytes to store
-        # the identifier and 4 bytes to store the value)
-        encoded = bytearray(36)
-        cur_byte = 0
-
-        for idx,val in enumerate(self.params):
-            encoded[cur_byte:] = struct.pack("!HI", idx, val)
-            cur_byte = cur_byte + 6
+    def payload_length(self):
+        # 2 bytes to store each identifier and 4 bytes to store its value
+        return 6 * len(self.params)
 
-        if self.is_flag_set(settings_flags.ACK) and cur_byte > 0:
+    def encode_payload_into(self, buf, offset):
+        if self.is_flag_set(settings_flags.ACK) and len(self.params) > 0:
             raise Exception("Settings frame must not set ACK alongside parameters")
 
-        # Only return the bytes we used
-        return encoded[0:cur_byte]
+        for idx,val in self.params.items():
+            struct.pack_into("!HI", buf, offset, idx, val)
+            offset = offset + 6
+
+        return offset
 
     def decode_payload(self, encoded, length):
+        # Acknowledgements are empty, parameters take 6 bytes each
         if self.is_flag_set(settings_flags.ACK) and length > 0:
-            raise Exception("Settings frame must not set ACK alongside parameters")
+            return decoding_error.FRAME_SIZE_ERROR
+        if length % 6 != 0:
+            return decoding_error.FRAME_SIZE_ERROR
 
         cur_byte = 0
         while cur_byte < length:
@@ -339,8 +411,11 @@ class settings_frame(frame):
             cur_byte = cur_byte + 6
 
 class push_promise_frame(frame):
+    __slots__ = ('pad_length', 'promised_stream', 'header_block_fragment')
+    frame_type = frame_type.PUSH_PROMISE
+
     def __init__(self, stream_id = 0x0, promised_stream = 0x0, header_block_fragment = None):
-        frame.__init__(self, stream_id, frame_type.PUSH_PROMISE)
+        frame.__init__(self, stream_id)
         self.pad_length = 0
         self.promised_stream = promised_stream
         self.header_block_fragment = header_block_fragment
@@ -351,96 +426,153 @@ class push_promise_frame(frame):
     def has_priority(self):
         return self.is_flag_set(headers_flags.PRIORITY)
 
-    def encode_payload(self):
-        encoded = bytearray(5 + len(self.header_block_fragment) + self.pad_length)
-        cur_byte = 0
+    def payload_length(self):
+        length = 4 + len(self.header_block_fragment)
+        if self.has_padding():
+            length = length + 1 + self.pad_length
+        return length
 
+    def encode_payload_into(self, buf, offset):
         # 8-bit padding length
         if self.has_padding():
-            encoded[cur_byte] = self.pad_length & 0xff
-            cur_byte = cur_byte + 1
+            buf[offset] = self.pad_length & 0xff
+            offset = offset + 1
 
         # 1-bit reserved flag and 31-bit promised stream id
-        encoded[cur_byte:cur_byte+4] = self.promised_stream.to_bytes(4, 'big')
-        encoded[cur_byte] = encoded[cur_byte] & 0x7f
+        buf[offset:offset+4] = (self.promised_stream & 0x7fffffff).to_bytes(4, 'big')
+        offset = offset + 4
 
         # Variable-length header block fragment
-        encoded[cur_byte:] = self.header_block_fragment
-        cur_byte = cur_byte + len(self.header_block_fragment)
+        buf[offset:offset+len(self.header_block_fragment)] = self.header_block_fragment
+        offset = offset + len(self.header_block_fragment)
 
-        # Variable-length padding
+        # Variable-length padding, which must be zeroes
         if self.has_padding():
-            encoded[cur_byte:] = urandom(pad_length)
-            cur_byte = cur_byte + pad_length
+            buf[offset:offset+self.pad_length] = bytes(self.pad_length)
+            offset = offset + self.pad_length
 
-        return encoded
+        return offset
 
     def decode_payload(self, encoded, length):
         cur_byte = 0
 
+        if length < (1 if self.has_padding() else 0) + 4:
+            return decoding_error.FRAME_SIZE_ERROR
+
         # 8-bit padding length
         if self.has_padding():
             self.pad_length = encoded[cur_byte]
             cur_byte = cur_byte + 1
 
-        # 1-bit reserved flag and 31-bit stream dependency
-        promised_stream_bits = encoded[cur_byte:cur_byte+4]
-        promised_stream_bits[0] = stream_dependency_bits[0] & 0x7f
-        self.promised_stream = int.from_bytes(promised_stream_bits, 'big')
+        # 1-bit reserved flag and 31-bit promised stream id
+        self.promised_stream = int.from_bytes(encoded[cur_byte:cur_byte+4], 'big') & 0x7fffffff
+        cur_byte = cur_byte + 4
+
+        if self.pad_length > length - cur_byte:
+            return decoding_error.PROTOCOL_ERROR
 
         # Variable-length header block fragment, must be decoded by an hpack ctx
-        self.header_block_fragment = encoded[cur_byte:cur_byte+length-self.pad_length]
-        cur_byte = cur_byte + length - self.pad_length
+        self.header_block_fragment = encoded[cur_byte:length-self.pad_length]
         # We can ignore the padding
 
 class ping_frame(frame):
+    __slots__ = ('data',)
+    frame_type = frame_type.PING
+
     def __init__(self, stream_id = 0x0, data = None):
-        frame.__init__(self, stream_id, frame_type.PING)
+        frame.__init__(self, stream_id)
         self.data = data
 
-    def encode_payload(self):
-        return data[:8]
+    def payload_length(self):
+        return 8
+
+    def encode_payload_into(self, buf, offset):
+        buf[offset:offset+8] = self.data[:8]
+        return offset + 8
 
     def decode_payload(self, encoded, length):
-        self.data = encoded[:8]
+        if length != 8:
+            return decoding_error.FRAME_SIZE_ERROR
+        # Copied, since it has to be echoed back in the acknowledgement
+        self.data = bytes(encoded[:8])
 
 class window_update_frame(frame):
+    __slots__ = ('window_size_increment',)
+    frame_type = frame_type.WINDOW_UPDATE
+
     def __init__(self, stream_id = 0x0, window_size_increment = 0):
-        frame.__init__(self, stream_id, frame_type.PING)
+        frame.__init__(self, stream_id)
         self.window_size_increment = window_size_increment
 
-    def encode_payload(self):
-        return self.window_size_increment.to_bytes(4, 'big') & 0x7fffffff
+    def payload_length(self):
+        return 4
+
+    def encode_payload_into(self, buf, offset):
+        # 1-bit reserved flag and 31-bit window size increment
+        buf[offset:offset+4] = (self.window_size_increment & 0x7fffffff).to_bytes(4, 'big')
+        return offset + 4
 
     def decode_payload(self, encoded, length):
-        self.window_size_increment = encoded[:4] & 0x7fffffff
+        if length != 4:
+            return decoding_error.FRAME_SIZE_ERROR
+        self.window_size_increment = int.from_bytes(encoded[0:4], 'big') & 0x7fffffff
 
 class goaway_frame(frame):
+    __slots__ = ('last_stream_id', 'error_code', 'debug_data')
+    frame_type = frame_type.GOAWAY
+
     def __init__(self, stream_id = 0x0, error = error.NO_ERROR, debug_data = None):
-        frame.__init__(self, stream_id, frame_type.GOAWAY)
+        frame.__init__(self, stream_id)
         self.last_stream_id = 0
         self.error_code = error
         self.debug_data = debug_data
 
-    def encode_payload(self):
-        encoded = struct.pack("!HH", self.last_stream_id, self.error_code)
-        # First bit is reserved
-        encoded[0] = encoded[0] & 0x7f
-        encoded.append(self.debug_data)
-        return encoded
+    def payload_length(self):
+        return 8 + (len(self.debug_data) if self.debug_data is not None else 0)
+
+    def encode_payload_into(self, buf, offset):
+        # 1-bit reserved flag and 31-bit last stream id, 32-bit error code
+        struct.pack_into("!II", buf, offset, self.last_stream_id & 0x7fffffff, self.error_code)
+        offset = offset + 8
+        if self.debug_data is not None:
+            buf[offset:offset+len(self.debug_data)] = self.debug_data
+            offset = offset + len(self.debug_data)
+        return offset
 
     def decode_payload(self, encoded, length):
-        self.last_stream_id = encoded[0:4]
-        self.error_code = encoded[4:8]
-        self.debug_data = encoded[8:]
+        if length < 8:
+            return decoding_error.FRAME_SIZE_ERROR
+        self.last_stream_id = int.from_bytes(encoded[0:4], 'big') & 0x7fffffff
+        self.error_code = int.from_bytes(encoded[4:8], 'big')
+        self.debug_data = bytes(encoded[8:])
 
 class continuation_frame(frame):
+    __slots__ = ('header_block_fragment',)
+    frame_type = frame_type.CONTINUATION
+
     def __init__(self, stream_id = 0x0, header_block_fragment = None):
-        frame.__init__(self, stream_id, frame_type.CONTINUATION)
+        frame.__init__(self, stream_id)
         self.header_block_fragment = header_block_fragment
 
-    def encode_payload(self):
-        return self.header_block_fragment
+    def payload_length(self):
+        return len(self.header_block_fragment)
+
+    def encode_payload_into(self, buf, offset):
+        buf[offset:offset+len(self.header_block_fragment)] = self.header_block_fragment
+        return offset + len(self.header_block_fragment)
 
     def decode_payload(self, encoded, length):
         self.header_block_fragment = encoded
+
+frame.frame_map = [
+        data_frame,
+        headers_frame,
+        priority_frame,
+        rst_stream_frame,
+        settings_frame,
+        push_promise_frame,
+        ping_frame,
+        goaway_frame,
+        window_update_frame,
+        continuation_frame,
+    ]
@@ -0,0 +1,198 @@
+import heapq
+import itertools
+import logging
+
+logger = logging.getLogger('priority')
+
+# Weight of streams nobody gave a priority (RFC 7540 section 5.3.5)
+default_weight = 16
+
+class priority_node:
+    __slots__ = ('stream_id', 'parent', 'weight', 'children', 'ready', 'active_count',
+            'pass_value', 'vtime', 'queue', 'queue_order')
+
+    def __init__(self, stream_id, weight = default_weight):
+        self.stream_id = stream_id
+        self.parent = None
+        self.weight = weight
+        self.children = []
+        # Whether the stream has DATA it's allowed to send, and how many
+        # ready streams there are in this subtree, this one included
+        self.ready = False
+        self.active_count = 0
+        # Position in the weighted round robin among siblings: it advances by
+        # the bytes sent divided by the weight, and the sibling that is least
+        # far along goes next. vtime is the position of the children of this
+        # node, which children that become ready start from.
+        self.pass_value = 0
+        self.vtime = 0
+        # Heap of (pass_value, order, child) for the children with ready
+        # streams in their subtree. Entries are left in place when they go
+        # out of date, and skipped when they come up; only the entry with the
+        # order in the child's queue_order is current.
+        self.queue = []
+        self.queue_order = None
+
+# Dependency tree of streams (RFC 7540 section 5.3) that picks the stream to
+# send the next DATA frame from. A stream only gets to send when none of the
+# streams it depends on are ready; siblings share in proportion to their
+# weights.
+class priority_tree:
+    def __init__(self):
+        self.root = priority_node(0)
+        self.nodes = {0: self.root}
+        self.order = itertools.count()
+
+    def __contains__(self, stream_id):
+        return stream_id in self.nodes
+
+    def insert(self, stream_id, depends_on = 0, weight = default_weight, exclusive = False):
+        node = priority_node(stream_id)
+        self.nodes[stream_id] = node
+        self.set_parent(node, depends_on, weight, exclusive)
+
+    def reprioritize(self, stream_id, depends_on = 0, weight = default_weight, exclusive = False):
+        node = self.nodes.get(stream_id)
+        if node is None:
+            self.insert(stream_id, depends_on, weight, exclusive)
+            return
+        if depends_on == stream_id:
+            return
+        logger.debug("Stream %d now depends on %d with weight %d", stream_id, depends_on, weight)
+
+        # A stream moved below one of its own dependents first puts that
+        # dependent in its place (RFC 7540 section 5.3.3)
+        new_parent = self.nodes.get(depends_on)
+        if new_parent is not None and self.is_descendant(new_parent, node):
+            self.detach(new_parent)
+            self.attach(new_parent, node.parent, False)
+
+        self.detach(node)
+        self.set_parent(node, depends_on, weight, exclusive)
+
+    def remove(self, stream_id):
+        node = self.nodes.pop(stream_id, None)
+        if node is None:
+            return
+
+        # The dependents of a removed stream take its place and share its
+        # weight (RFC 7540 section 5.3.4)
+        parent = node.parent
+        self.detach(node)
+        total_weight = sum(child.weight for child in node.children)
+        for child in list(node.children):
+            self.detach(child)
+            child.weight = max(1, node.weight * child.weight // total_weight)
+            self.attach(child, parent, False)
+
+    def set_ready(self, stream_id, ready):
+        node = self.nodes.get(stream_id)
+        if node is None or node.ready == ready:
+            return
+        node.ready = ready
+        self.add_active(node, 1 if ready else -1)
+
+    def next_stream(self):
+        # Returns the id of the stream that should send next, or None if
+        # none is ready
+        node = self.root
+        while node.active_count > 0:
+            if node.ready:
+                return node.stream_id
+
+            queue = node.queue
+            while True:
+                _, order, child = queue[0]
+                if order == child.queue_order and child.parent is node and child.active_count > 0:
+                    break
+                heapq.heappop(queue)
+            node = child
+        return None
+
+    def sent(self, stream_id, length):
+        # Accounts for length bytes sent by the stream, at every level of the
+        # tree above it
+        node = self.nodes.get(stream_id)
+        while node is not None and node.parent is not None:
+            node.parent.vtime = node.pass_value
+            node.pass_value += (max(length, 1) << 8) // node.weight
+            if node.active_count > 0:
+                self.schedule(node)
+            node = node.parent
+
+    def set_parent(self, node, depends_on, weight, exclusive):
+        parent = self.nodes.get(depends_on)
+        if parent is None:
+            # Dependencies on streams that aren't in the tree get the default
+            # priority (RFC 7540 section 5.3.1)
+            parent = self.root
+            weight = default_weight
+            exclusive = False
+        node.weight = weight
+        self.attach(node, parent, exclusive)
+
+    def attach(self, node, parent, exclusive):
+        active_count = node.active_count
+        if exclusive:
+            # The new node becomes the sole dependent of its parent, and the
+            # others depend on it instead; they stay in the same subtree, so
+            # only the counts of the new node change
+            for child in parent.children:
+                child.parent = node
+                node.children.append(child)
+                node.active_count += child.active_count
+                if child.active_count > 0:
+                    self.schedule(child)
+            parent.children = []
+
+        node.parent = parent
+        parent.children.append(node)
+        node.pass_value = max(node.pass_value, parent.vtime)
+        node.queue_order = None
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor.active_count == 0 and active_count > 0 and ancestor.parent is not None:
+                self.schedule(ancestor)
+            ancestor.active_count += active_count
+            ancestor = ancestor.parent
+        if node.active_count > 0:
+            self.schedule(node)
+
+    def detach(self, node):
+        parent = node.parent
+        parent.children.remove(node)
+        node.parent = None
+        ancestor = parent
+        while ancestor is not None:
+            ancestor.active_count -= node.active_count
+            ancestor = ancestor.parent
+
+    def add_active(self, node, delta):
+        while node is not None:
+            node.active_count += delta
+            if node.active_count == delta and delta > 0 and node.parent is not None:
+                # Coming back from idle doesn't earn a stream a burst
+                node.pass_value = max(node.pass_value, node.parent.vtime)
+                self.schedule(node)
+            node = node.parent
+
+    def schedule(self, node):
+        parent = node.parent
+        node.queue_order = next(self.order)
+        heapq.heappush(parent.queue, (node.pass_value, node.queue_order, node))
+
+        # Out of date entries may never come up, if they're behind the ones
+        # of children that are added later, so they're thrown out once they
+        # make up most of the heap
+        if len(parent.queue) > 2 * len(parent.children) + 16:
+            parent.queue = [(child.pass_value, child.queue_order, child) for child in parent.children
+                    if child.active_count > 0 and child.queue_order is not None]
+            heapq.heapify(parent.queue)
+
+    def is_descendant(self, node, ancestor):
+        node = node.parent
+        while node is not None:
+            if node is ancestor:
+                return True
+            node = node.parent
+        return False
@@ -4,6 +4,9 @@ import logging
 
 logger = logging.getLogger('stream')
 
+# Largest flow control window allowed (RFC 7540 section 6.9.1)
+max_window_size = 2**31 - 1
+
 class stream_state(IntEnum):
     IDLE = 0
     RESERVED_LOCAL = 1
@@ -18,8 +21,8 @@ class http_state(IntEnum):
     CONTINUATION = 1
     DATA = 2
     TRAILERS = 3
-    TRAILERS_CONTINUATION = 3
-    DONE = 4
+    TRAILERS_CONTINUATION = 4
+    DONE = 5
 
 class reserved(IntEnum):
     NONE = 0
@@ -30,26 +33,70 @@ class message_type(IntEnum):
     REQUEST = 0
     RESPONSE = 1
 
+# Events produced by a stream in streaming mode, in place of a whole message
+class stream_event(IntEnum):
+    HEADERS = 0
+    DATA = 1
+    END = 2
+
 class http_message:
-    def __init__(self, headers, data = None, message_type = message_type.RESPONSE):
+    __slots__ = ('headers', 'data', 'message_type', 'trailers')
+
+    def __init__(self, headers, data = None, message_type = message_type.RESPONSE, trailers = None):
         self.headers = headers
         self.data = data
-        self.message_type = message_type.RESPONSE
+        self.message_type = message_type
+        self.trailers = trailers
 
 # Stream essentially represents one request/response pair
 class stream:
-    def __init__(self, identifier, hpack_ctx):
+    __slots__ = ('identifier', 'http_state', 'hpack_ctx', 'header_decoder', 'end_stream_pending',
+            'max_header_list_size', 'header_list',
+            'data_bytes', 'headers', 'trailers', 'state', 'send_queue', 'message_queue', 'streaming',
+            'event_queue', 'send_window', 'recv_window', 'recv_window_size', 'recv_unacked',
+            'send_data', 'send_offset')
+
+    def __init__(self, identifier, hpack_ctx, streaming=False, send_window=65535, recv_window=65535,
+            max_header_list_size=None, header_list=False):
         self.identifier = identifier
         self.http_state = http_state.HEADERS
         self.hpack_ctx = hpack_ctx
-        self.header_bytes = bytearray()
+        # Header blocks are decoded fragment by fragment as they arrive, and
+        # rejected once they're larger than max_header_list_size
+        self.header_decoder = None
+        # Whether the header block being received ends the stream
+        self.end_stream_pending = False
+        self.max_header_list_size = max_header_list_size
+        # Whether headers are decoded to a hpack header_list instead of a dict
+        self.header_list = header_list
         self.data_bytes = bytearray()
+        self.headers = None
+        self.trailers = None
         self.state = stream_state.IDLE
         self.send_queue = []
         self.message_queue = []
+        # In streaming mode the body isn't accumulated; instead the stream
+        # queues (stream_event, payload) pairs as soon as each part arrives
+        self.streaming = streaming
+        self.event_queue = []
+        # Flow control windows (RFC 7540 section 6.9). send_window is how much
+        # DATA the peer lets us send, recv_window how much we let it send.
+        # Received bytes are credited back to the peer once recv_unacked
+        # reaches half of recv_window_size.
+        self.send_window = send_window
+        self.recv_window = recv_window
+        self.recv_window_size = recv_window
+        self.recv_unacked = 0
+        # Body of the outgoing message not sent yet, because of flow control
+        self.send_data = None
+        self.send_offset = 0
 
     def queue_stream_error(self, error=frames.error.PROTOCOL_ERROR):
+        # Resetting the stream closes it straight away
         self.send_queue.append(frames.rst_stream_frame(self.identifier, error))
+        self.state = stream_state.CLOSED
+        self.http_state = http_state.DONE
+        self.send_data = None
 
     def handle_recv_frame(self, frame):
         # Normal request processing is HEADERS, followed by CONTINUATION,
@@ -59,24 +106,15 @@ class stream:
 
         logger.debug("Stream id %d handling %s frame", self.identifier, frame.frame_type)
 
-        switcher = {
-                frames.frame_type.HEADERS: self.handle_headers,
-                frames.frame_type.CONTINUATION: self.handle_continuation,
-                frames.frame_type.DATA: self.handle_data,
-                frames.frame_type.RST_STREAM: self.handle_rst_stream,
-        }
-        handler = switcher.get(frame.frame_type, self.handle_invalid_frame_type)
-        return handler(frame)
+        return stream.frame_handlers[frame.frame_type](self, frame)
 
     def handle_headers(self, frame):
         if self.http_state is http_state.DATA:
             # There's no flag for end of data
             self.http_state = http_state.TRAILERS
 
-        if self.http_state is http_state.HEADERS:
-            self.header_bytes = frame.header_block_fragment
-        elif self.http_state is http_state.TRAILERS:
-            self.header_bytes.extend(frame.header_block_fragment)
+        if self.http_state is http_state.HEADERS or self.http_state is http_state.TRAILERS:
+            self.header_decoder = self.hpack_ctx.start_decode(self.max_header_list_size, self.header_list)
         else:
             self.queue_stream_error()
             self.http_state = http_state.DONE
@@ -88,36 +126,77 @@ class stream:
         if self.state is stream_state.RESERVED_REMOTE:
             self.close_local()
 
-        if frame.is_flag_set(frames.headers_flags.END_STREAM):
-            self.close_remote()
+        # END_STREAM only takes effect once the header block is complete, so
+        # the stream isn't closed, and retired, while CONTINUATION frames are
+        # still to come (RFC 7540 section 8.1)
+        self.end_stream_pending = frame.is_flag_set(frames.headers_flags.END_STREAM)
+
+        # Header blocks have to be decoded in the order they arrive on the
+        # connection, since they share the decoder's dynamic table; nothing
+        # can come between a HEADERS frame and its CONTINUATION frames, so
+        # each fragment can be decoded straight away
+        try:
+            self.header_decoder.feed(frame.header_block_fragment)
+        except Exception as e:
+            return self.handle_compression_error(e)
 
         if frame.is_flag_set(frames.headers_flags.END_HEADERS):
-            # We process the headers lazily
-            if self.remote_closed():
-                self.http_state = http_state.DONE
-                self.process_message()
-            else:
-                self.http_state = http_state.DATA
+            return self.end_headers()
+        elif self.http_state is http_state.HEADERS:
+            self.http_state = http_state.CONTINUATION
+        else:
+            self.http_state = http_state.TRAILERS_CONTINUATION
 
         return frames.error.NO_ERROR
 
     def handle_continuation(self, frame):
-        if self.http_state is http_state.CONTINUATION:
-            self.header_bytes.extend(frame.header_block_fragment)
-        elif self.http_state is http_state.TRAILERS_CONTINUATION:
-            self.header_bytes.extend(frame.header_block_fragment)
-        else:
+        if self.http_state is not http_state.CONTINUATION and self.http_state is not http_state.TRAILERS_CONTINUATION:
             self.queue_stream_error()
             self.http_state = http_state.DONE
             return frames.error.NO_ERROR
 
+        try:
+            self.header_decoder.feed(frame.header_block_fragment)
+        except Exception as e:
+            return self.handle_compression_error(e)
+
         if frame.is_flag_set(frames.headers_flags.END_HEADERS):
-            # We process the headers lazily
-            if self.remote_closed():
-                self.http_state = http_state.DONE
-                self.process_message()
-            else:
-                self.http_state = http_state.DATA
+            return self.end_headers()
+
+        return frames.error.NO_ERROR
+
+    def handle_compression_error(self, e):
+        # The decoder is out of step with the peer's encoder now, which the
+        # connection can't recover from
+        logger.debug("Stream id %d couldn't decode header block: %s", self.identifier, e)
+        self.header_decoder = None
+        self.close_remote()
+        self.close_local()
+        self.http_state = http_state.DONE
+        return frames.error.COMPRESSION_ERROR
+
+    def end_headers(self):
+        try:
+            headers = self.header_decoder.finish()
+        except Exception as e:
+            return self.handle_compression_error(e)
+        self.header_decoder = None
+        if self.end_stream_pending:
+            self.end_stream_pending = False
+            self.close_remote()
+
+        if self.http_state is http_state.HEADERS or self.http_state is http_state.CONTINUATION:
+            self.headers = headers
+            if self.streaming:
+                self.event_queue.append((stream_event.HEADERS, headers))
+        else:
+            self.trailers = headers
+
+        if self.remote_closed():
+            self.http_state = http_state.DONE
+            self.process_message()
+        else:
+            self.http_state = http_state.DATA
 
         return frames.error.NO_ERROR
 
@@ -127,7 +206,21 @@ class stream:
             self.http_state = http_state.DONE
             return frames.error.NO_ERROR
 
-        self.data_bytes.extend(frame.data)
+        self.recv_window -= frame.flow_controlled_length()
+        if self.recv_window < 0:
+            self.queue_stream_error(frames.error.FLOW_CONTROL_ERROR)
+            self.close_remote()
+            self.close_local()
+            self.http_state = http_state.DONE
+            return frames.error.NO_ERROR
+
+        if self.streaming:
+            # Handed over without copying; the data is a view into the
+            # connection's receive buffer, only valid during the callback
+            if len(frame.data) > 0:
+                self.event_queue.append((stream_event.DATA, frame.data))
+        else:
+            self.data_bytes.extend(frame.data)
 
         if frame.is_flag_set(frames.data_flags.END_STREAM):
             self.close_remote()
@@ -142,38 +235,86 @@ class stream:
         self.http_state = http_state.DONE
         return frames.error.NO_ERROR
 
+    def handle_window_update(self, frame):
+        if frame.window_size_increment == 0:
+            self.queue_stream_error()
+            return frames.error.NO_ERROR
+
+        self.send_window += frame.window_size_increment
+        if self.send_window > max_window_size:
+            self.queue_stream_error(frames.error.FLOW_CONTROL_ERROR)
+            self.close_remote()
+            self.close_local()
+            self.send_data = None
+        return frames.error.NO_ERROR
+
     def handle_invalid_frame_type(self, frame):
         self.close_remote()
         self.close_local()
         self.http_state = http_state.DONE
         return frames.error.PROTOCOL_ERROR
 
-    def handle_send_message(self, headers, data=None):
-        self.close_local()
-
+    # priority is None, or the (stream dependency, weight, exclusive) to
+    # send along with the headers
+    def handle_send_message(self, headers, data=None, max_frame_size=16384, priority=None):
         self.hpack_ctx.start_encode()
         self.hpack_ctx.encode_header_dict(headers)
-        header_block = self.hpack_ctx.end_encode()
-
-        # Later, this may need to be fragmented according to
-        # the MAX_FRAME_SIZE setting
-        headers_frame = frames.headers_frame(self.identifier, header_block)
-        headers_frame.set_flag(frames.headers_flags.END_HEADERS)
-        if data is None or len(data) is 0:
+        header_block = memoryview(self.hpack_ctx.end_encode())
+
+        # A header block larger than a frame continues in CONTINUATION
+        # frames, the last of which ends the headers
+        first_length = max_frame_size if priority is None else max_frame_size - 5
+        headers_frame = frames.headers_frame(self.identifier, header_block[:first_length])
+        if priority is not None:
+            headers_frame.set_flag(frames.headers_flags.PRIORITY)
+            headers_frame.stream_dependency, weight, headers_frame.exclusive_dependency = priority
+            # The weight on the wire is one less than the actual weight
+            headers_frame.weight = weight - 1
+        if data is None or len(data) == 0:
             headers_frame.set_flag(frames.headers_flags.END_STREAM)
-
         self.send_queue.append(headers_frame)
 
-        if data is None or len(data) is 0:
+        last_frame = headers_frame
+        for offset in range(first_length, len(header_block), max_frame_size):
+            last_frame = frames.continuation_frame(self.identifier, header_block[offset:offset+max_frame_size])
+            self.send_queue.append(last_frame)
+        last_frame.set_flag(frames.headers_flags.END_HEADERS)
+        if self.state is stream_state.IDLE:
+            self.state = stream_state.OPEN
+
+        if data is None or len(data) == 0:
+            self.close_local()
             return
 
-        data_frame = frames.data_frame(data, self.identifier)
-        data_frame.set_flag(frames.data_flags.END_STREAM)
-        self.send_queue.append(data_frame)
+        # The body goes out in DATA frames as flow control allows; see
+        # next_data_frame
+        self.send_data = memoryview(data)
+        self.send_offset = 0
+
+    def next_data_frame(self, max_length):
+        # Returns the next DATA frame of the outgoing body, of at most
+        # max_length bytes, or None if the stream's send window is exhausted
+        length = min(len(self.send_data) - self.send_offset, max_length, self.send_window)
+        if length <= 0:
+            return None
+
+        data_frame = frames.data_frame(self.identifier, self.send_data[self.send_offset:self.send_offset+length])
+        self.send_offset += length
+        self.send_window -= length
+
+        if self.send_offset == len(self.send_data):
+            data_frame.set_flag(frames.data_flags.END_STREAM)
+            self.send_data = None
+            self.close_local()
+
+        return data_frame
 
     def process_message(self):
-        message = http_message(self.hpack_ctx.decode_headers(self.header_bytes), self.data_bytes)
-        self.header_bytes = bytearray()
+        if self.streaming:
+            self.event_queue.append((stream_event.END, self.trailers))
+            return
+
+        message = http_message(self.headers, self.data_bytes, trailers=self.trailers)
         self.data_bytes = bytearray()
         self.message_queue.append(message)
 
@@ -204,3 +345,22 @@ class stream:
         message_queue = self.message_queue
         self.message_queue = []
         return message_queue
+
+    def flush_event_queue(self):
+        event_queue = self.event_queue
+        self.event_queue = []
+        return event_queue
+
+    # Handler of each frame type, indexed by the type
+    frame_handlers = [
+            handle_data,                # DATA
+            handle_headers,             # HEADERS
+            handle_invalid_frame_type,  # PRIORITY
+            handle_rst_stream,          # RST_STREAM
+            handle_invalid_frame_type,  # SETTINGS
+            handle_invalid_frame_type,  # PUSH_PROMISE
+            handle_invalid_frame_type,  # PING
+            handle_invalid_frame_type,  # GOAWAY
+            handle_window_update,       # WINDOW_UPDATE
+            handle_continuation,        # CONTINUATION
+        ]
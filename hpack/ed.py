@@ -42,180 +42,242 @@ huffman_encode_table = [
        (0x7ffffeb,27), (0xffffffe,28), (0x7ffffec,27), (0x7ffffed,27), (0x7ffffee,27), (0x7ffffef,27), (0x7fffff0,27), (0x3ffffee,26),
        (0x3fffffff,30),
     ]
-huffman_decode_table = {}
-for idx,val in enumerate(huffman_encode_table):
-    huffman_decode_table[val] = idx
+
+def build_huffman_decode_states():
+    # Build the huffman code tree. Internal nodes are numbered in order of
+    # creation (the root is 0); a leaf is stored in its parent as ~symbol.
+    children = [[None, None]]
+    for symbol,(code,code_bits) in enumerate(huffman_encode_table):
+        node = 0
+        for bit_idx in range(code_bits-1, 0, -1):
+            bit = (code >> bit_idx) & 1
+            if children[node][bit] is None:
+                children[node][bit] = len(children)
+                children.append([None, None])
+            node = children[node][bit]
+        children[node][code & 1] = ~symbol
+
+    # One extra state past the internal nodes is the failure state; every
+    # transition out of it leads back into it.
+    fail_state = len(children)
+
+    # A string may only end at the root, or within the first 7 bits of the
+    # EOS code (which is all ones); see RFC 7541 section 5.2.
+    accepting = [False] * (fail_state + 1)
+    node = 0
+    for _ in range(8):
+        accepting[node] = True
+        node = children[node][1]
+
+    # First walk the tree four bits at a time. No code is shorter than five
+    # bits, so a nibble completes at most one symbol.
+    nibble_states = []
+    for state in range(fail_state + 1):
+        for nibble in range(16):
+            node = state
+            emitted = b''
+            for bit_idx in (3, 2, 1, 0):
+                if node == fail_state:
+                    break
+                child = children[node][(nibble >> bit_idx) & 1]
+                if child >= 0:
+                    node = child
+                elif ~child == 256:
+                    # Decoding EOS is an error
+                    node = fail_state
+                    emitted = b''
+                else:
+                    node = 0
+                    emitted = bytes((~child,))
+            nibble_states.append((node, emitted))
+
+    # Then compose pairs of nibble transitions into byte transitions, each of
+    # which emits zero, one or two symbols.
+    byte_states = []
+    for state in range(fail_state + 1):
+        for byte in range(256):
+            high_state,high_emitted = nibble_states[(state << 4) | (byte >> 4)]
+            low_state,low_emitted = nibble_states[(high_state << 4) | (byte & 0xf)]
+            byte_states.append((low_state, high_emitted + low_emitted))
+
+    return byte_states, accepting
+
+# The tables derived from huffman_encode_table are built the first time
+# they're needed rather than on import, which takes most of the time of
+# importing the package otherwise. Once built they're shared by everything.
+#
+# huffman_decode_states[(state << 8) | byte] is the (next state, decoded
+# bytes) pair for feeding one byte of huffman encoded input to the decoder
+huffman_decode_states = None
+huffman_accepting_states = None
+
+# Per-byte encoding tables: code lengths in a form usable by bytes.translate,
+# and codes as strings of '0' and '1' characters
+huffman_code_lengths = None
+huffman_code_strings = None
+
+def build_huffman_decode_tables():
+    global huffman_decode_states, huffman_accepting_states
+    if huffman_decode_states is None:
+        huffman_decode_states, huffman_accepting_states = build_huffman_decode_states()
+    return huffman_decode_states
+
+def build_huffman_encode_tables():
+    global huffman_code_lengths, huffman_code_strings
+    if huffman_code_lengths is None:
+        huffman_code_strings = [format(code, '0{:d}b'.format(code_bits))
+                for code,code_bits in huffman_encode_table[:256]]
+        huffman_code_lengths = bytes(code_bits for _,code_bits in huffman_encode_table[:256])
+    return huffman_code_lengths
+
+# prefix_masks[prefix] is the largest value a prefix of that many bits holds
+prefix_masks = [(1 << prefix) - 1 for prefix in range(9)]
 
 def encode_integer(integer, prefix):
+    encoded = bytearray()
+    encode_integer_into(encoded, integer, prefix)
+    return encoded
+
+def encode_integer_into(buf, integer, prefix, flags=0):
+    # Appends integer to buf, with flags in the bits of the first byte above
+    # the prefix
     # Make sure we don't get invalid prefix values
     if prefix > 8 or prefix <= 0:
         raise Exception("Invalid prefix {:d} passed to encode_integer".format(prefix))
 
-    encoded = bytearray()
-    prefix_max = pow(2,prefix) - 1
+    prefix_max = prefix_masks[prefix]
+    if integer < prefix_max:
+        buf.append(flags | integer)
+        return
 
     # The rest of this is a translation of the pseudocode from the RFC
+    integer -= prefix_max
+    buf.append(flags | prefix_max)
+    while integer >= 128:
+        buf.append((integer & 0x7f) | 0x80)
+        integer >>= 7
+    buf.append(integer)
+
+def integer_length(integer, prefix):
+    # Number of bytes encode_integer takes for integer
+    prefix_max = prefix_masks[prefix]
     if integer < prefix_max:
-        encoded.append(integer & 0xFF)
-        return encoded
- 
+        return 1
     integer -= prefix_max
-    encoded.append(0 | prefix_max)
+    length = 2
     while integer >= 128:
-        encoded.append(integer % 128 + 128)
-        integer = integer // 128
-    encoded.append(integer)
-        
-    return encoded
+        integer >>= 7
+        length += 1
+    return length
+
+# Largest integer decode_integer accepts. Nothing in a header block needs
+# more, and it stops a peer from making us build huge integers out of
+# endless continuation bytes.
+max_integer = 2**32 - 1
 
 def decode_integer(encoded, start, prefix):
     # Make sure we don't get an invalid prefix value
-    if prefix > 8 and prefix <= 0:
-        raise Exception("Invalid prefix {:d} passed to encode_integer".format(prefix))
+    if prefix > 8 or prefix <= 0:
+        raise Exception("Invalid prefix {:d} passed to decode_integer".format(prefix))
 
-    prefix_max = pow(2,prefix) - 1
+    prefix_max = prefix_masks[prefix]
     integer = encoded[start] & prefix_max
 
     if integer < prefix_max:
         return integer,1
- 
+
     # The rest of this is a translation of the pseudocode from the RFC
-    exp = 0
-    cont_bit = 1
+    shift = 0
     bytes_read = 1
-    while cont_bit != 0:
+    while True:
         byte = encoded[start+bytes_read]
-        integer = integer + (byte & 0x7f) * pow(2, exp)
-        exp = exp + 7
-        cont_bit = byte & 0x80
-        bytes_read = bytes_read + 1
-        
-    return integer,bytes_read
+        bytes_read += 1
+        integer += (byte & 0x7f) << shift
+        if integer > max_integer:
+            raise Exception("Integer is larger than {:d}".format(max_integer))
+        if byte & 0x80 == 0:
+            return integer,bytes_read
+        shift += 7
+        if shift > 28:
+            # Only zeroes could follow without overflowing
+            raise Exception("Integer is larger than {:d}".format(max_integer))
 
 def encode_string_literal(string, huffman=False):
-    # Encode the string
-    encoded_string = string.encode('ascii')
-    if huffman is True:
-        encoded_string = encode_huffman_string(encoded_string)
+    encoded = bytearray()
+    encode_string_literal_into(encoded, string.encode('ascii'), huffman)
+    return encoded
 
-    encoded = encode_integer(len(encoded_string), 7)
-    encoded.extend(encoded_string)
+def encode_string_literal_into(buf, string, huffman=False):
+    # Appends the literal for string, which is already ascii encoded, to buf
+    if huffman is True:
+        string = encode_huffman_string(string)
     # Set the "huffman encoding" bit
-    encoded[0] = (encoded[0] & 0x7f) | (0x80 if huffman else 0x0)
+    encode_integer_into(buf, len(string), 7, 0x80 if huffman else 0x0)
+    buf.extend(string)
 
-    return encoded
-
-def decode_string_literal(encoded, start):
+def decode_string_literal(encoded, start, as_bytes=False):
+    # Returns the literal as a str, or as bytes with as_bytes set
     length, bytes_read = decode_integer(encoded, start, 7)
     if (encoded[start] & 0x80) > 1:
-        string = decode_huffman_string(encoded, start+bytes_read, length)
+        string = decode_huffman_bytes(encoded, start+bytes_read, length)
     else:
-        string = encoded[start + bytes_read:start + bytes_read + length].decode('ascii')
-    return string, bytes_read+length
+        string = bytes(encoded[start + bytes_read:start + bytes_read + length])
+    return (string if as_bytes else str(string, 'ascii')), bytes_read+length
 
-def rshift(val, n):
-    # Unsigned right shift
-    return val>>n if val >= 0 else (val+0x100000000)>>n
+def huffman_encoded_length(string):
+    # Exact length in bytes of the huffman encoding of string, without
+    # encoding it
+    code_lengths = huffman_code_lengths
+    if code_lengths is None:
+        code_lengths = build_huffman_encode_tables()
+    return (sum(string.translate(code_lengths)) + 7) // 8
 
 def encode_huffman_string(string):
-    encoded = bytearray(len(string))
-    encoded_bit = 0
-    idx = 0
-    encoding_bit = 0
-
-    logger.debug(" --- Huffman encoding start ---")
-
-    while idx < len(string):
-        logger.debug("Encoding byte %d (%c)", string[idx], chr(string[idx]))
-
-        # Grab the encoding for the current character from the huffman encoding table
-        char_encoding_tuple = huffman_encode_table[string[idx]]
-        char_encoding = char_encoding_tuple[0]
-        char_encoding_bits = char_encoding_tuple[1]
-
-        logger.debug("Got encoding: 0x%s, %d bits, truncating at %d",
-                '{:x}'.format(char_encoding), char_encoding_bits, encoding_bit)
-
-        # Get only the bits we haven't packed yet from the encoding
-        char_encoding_bits -= encoding_bit
-        bitmask = (1 << char_encoding_bits) - 1
-        char_encoding = char_encoding & bitmask
-
-        logger.debug("Truncated encoding: 0x%s, %d bits", '{:x}'.format(char_encoding), char_encoding_bits)
-
-        # Get the next byte and bit index we want to pack into
-        byte_idx = encoded_bit // 8
-        bit_idx = encoded_bit % 8
-        bits_left = 8 - bit_idx
-
-        pack_bits = 0
-        # Move the current character encoding into the right position within
-        # the byte we're packing into
-        if char_encoding_bits >= bits_left:
-            # We have more bits we need to pack than bits to pack into;
-            # truncate the encoding
-            pack_bits = rshift(char_encoding, char_encoding_bits - bits_left)
-            encoded_bit = (byte_idx+1)*8
-            encoding_bit += bits_left
-        else:
-            # We have less bits we need to pack than bits to pack into;
-            # just move the bits into the right position within the byte
-            pack_bits = char_encoding << bits_left - char_encoding_bits
-            encoded_bit = byte_idx*8 + bit_idx + char_encoding_bits
-            encoding_bit = encoding_bit + char_encoding_bits
-
-        logger.debug("Packing 0x%s into byte %d at bit %d with %d bits left",
-                '{:x}'.format(pack_bits), byte_idx, bit_idx, bits_left)
-
-        # Add more bytes if we need to 
-        if len(encoded) < byte_idx:
-            encoded.append(0x0)
-
-        # Pack the bits
-        encoded[byte_idx] = encoded[byte_idx] | pack_bits
-
-        if encoding_bit >= char_encoding_bits:
-            encoding_bit = 0
-            idx = idx+1
-
-    # The last bits have to be the beginning of the EOF encoding
-    if encoded_bit%8 != 0:
-        logger.debug("Filling last bits with EOF")
-        eof = huffman_encode_table[256]
-        eof_encoding = rshift(eof[0], eof[1] - (8 - (encoded_bit % 8)))
-        encoded[encoded_bit//8] |= eof_encoding
-
-    encoded = encoded[:encoded_bit//8 + (1 if encoded_bit%8 > 0 else 0)]
-    logger.debug("Got huffman encoding of bit length %d: %s", encoded_bit, encoded)
-    logger.debug(" --- Huffman encoding end ---")
-    return encoded
+    # Concatenate the code of every byte as a string of bits and convert the
+    # whole thing in one go; in CPython this is much cheaper than shifting
+    # each code into an accumulator
+    if huffman_code_strings is None:
+        build_huffman_encode_tables()
+    bits = ''.join(map(huffman_code_strings.__getitem__, string))
+    length = (len(bits) + 7) // 8
+    if length == 0:
+        return b''
+
+    # The last bits have to be the beginning of the EOS encoding, which is
+    # all ones
+    padding_bits = length*8 - len(bits)
+    encoded = (int(bits, 2) << padding_bits) | ((1 << padding_bits) - 1)
+    return encoded.to_bytes(length, 'big')
 
 def decode_huffman_string(encoded, start, length):
-    decoded = bytearray()
-    decode_index = 0
-    decoded_bits = 0
-    total_decoded_bits = 0
-    for byte in encoded[start:]:
-        logger.debug("Decoding byte %s", '{:02x}'.format(byte))
-        for bit_idx in range(8):
-            logger.debug("Currently at bit %d, total decoded: %d", decoded_bits, total_decoded_bits)
-            bit = rshift(byte & (1 << (7-bit_idx)), 7-bit_idx)
-            decode_index = (decode_index << 1) | bit
-
-            decoded_bits = decoded_bits + 1
-            total_decoded_bits = total_decoded_bits + 1
-            byte_tuple = (decode_index, decoded_bits)
-
-            logger.debug("New decode sequence: %s with %d bits", '{:02x}'.format(decode_index), decoded_bits)
-
-            if byte_tuple in huffman_decode_table:
-                decoded.append(huffman_decode_table[byte_tuple])
-                logger.debug("Decoded one character: %s, current: %s", huffman_decode_table[byte_tuple], decoded.decode('ascii'))
-                decoded_bits = 0
-                decode_index = 0
-            if total_decoded_bits >= length*8:
-                break
-        if total_decoded_bits >= length*8:
-            break
-
-    return decoded.decode('ascii')
+    return decode_huffman_bytes(encoded, start, length).decode('ascii')
+
+def decode_huffman_bytes(encoded, start, length):
+    states = huffman_decode_states
+    if states is None:
+        states = build_huffman_decode_tables()
+    decoded = []
+    state = 0
+    for byte in encoded[start:start+length]:
+        state,emitted = states[(state << 8) | byte]
+        decoded.append(emitted)
+
+    if not huffman_accepting_states[state]:
+        raise Exception("Invalid huffman encoded string (bad padding or EOS)")
+
+    return b''.join(decoded)
+
+def check_huffman_bytes(encoded, start, length, ascii_only=False):
+    # Raises whatever decode_huffman_bytes would, or if ascii_only is set and
+    # the string isn't ascii, without building the decoded string
+    states = huffman_decode_states
+    if states is None:
+        states = build_huffman_decode_tables()
+    state = 0
+    for byte in encoded[start:start+length]:
+        state,emitted = states[(state << 8) | byte]
+        if ascii_only and not emitted.isascii():
+            raise Exception("Huffman encoded string isn't ascii")
+
+    if not huffman_accepting_states[state]:
+        raise Exception("Invalid huffman encoded string (bad padding or EOS)")
@@ -0,0 +1,91 @@
+# Decoded header block that keeps every header field in order, duplicates
+# included, and only decodes literals when they're first looked at.
+
+from . import ed
+
+# A string literal as it was encoded in the header block
+class encoded_literal:
+    __slots__ = ('data', 'huffman')
+
+    def __init__(self, data, huffman):
+        self.data = data
+        self.huffman = huffman
+
+    def decode(self, as_bytes):
+        if self.huffman:
+            decoded = ed.decode_huffman_bytes(self.data, 0, len(self.data))
+        else:
+            decoded = self.data
+        return decoded if as_bytes else str(decoded, 'ascii')
+
+class header_list:
+    __slots__ = ('fields', 'as_bytes')
+
+    # Names and values are str, or bytes with as_bytes set
+    def __init__(self, as_bytes=False):
+        # Names and values alternate; either may still be an encoded_literal
+        self.fields = []
+        self.as_bytes = as_bytes
+
+    def append(self, name, value):
+        self.fields.append(name)
+        self.fields.append(value)
+
+    def __len__(self):
+        return len(self.fields) // 2
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("Header index out of range")
+        return self.field(2 * index), self.field(2 * index + 1)
+
+    def __iter__(self):
+        for index in range(0, len(self.fields), 2):
+            yield self.field(index), self.field(index + 1)
+
+    def __contains__(self, name):
+        return self.find(name, 0) is not None
+
+    def __repr__(self):
+        return "header_list({!r})".format(list(self))
+
+    def name(self, index):
+        return self.field(2 * index)
+
+    def value(self, index):
+        return self.field(2 * index + 1)
+
+    def get(self, name, default=None):
+        # Value of the first header with the name
+        index = self.find(name, 0)
+        return default if index is None else self.field(index + 1)
+
+    def get_all(self, name):
+        # Values of every header with the name, in order
+        values = []
+        index = self.find(name, 0)
+        while index is not None:
+            values.append(self.field(index + 1))
+            index = self.find(name, index + 2)
+        return values
+
+    def to_dict(self):
+        # Like hpack.ctx.decode_headers, later duplicates replace earlier ones
+        return dict(self)
+
+    def find(self, name, start):
+        # Position in fields of the first name from start on that matches
+        fields = self.fields
+        for index in range(start, len(fields), 2):
+            if self.field(index) == name:
+                return index
+        return None
+
+    def field(self, index):
+        item = self.fields[index]
+        if type(item) is encoded_literal:
+            item = item.decode(self.as_bytes)
+            self.fields[index] = item
+        return item
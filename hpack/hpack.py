@@ -1,7 +1,10 @@
 import logging
+from collections import OrderedDict
 from enum import Enum
 from . import ed
 from . import table
+from . import header_list
+from .stats import coder_stats
 
 logger = logging.getLogger('hpack')
 
@@ -13,28 +16,237 @@ class index_opts(Enum):
     MAX_SIZE_UPDATE = 5
     UNKNOWN = 6
 
+class huffman_opts(Enum):
+    # Never huffman encode literals
+    NEVER = 1
+    # Always huffman encode literals, even if it makes them longer
+    ALWAYS = 2
+    # Huffman encode a literal only if that makes it shorter
+    SHORTEST = 3
+    # Like SHORTEST, but never huffman encode literals longer than
+    # huffman_max_size
+    FAST = 4
+
+def build_representations():
+    # The representation of a header field (RFC 7541 section 6) follows from
+    # the bits set at the top of its first byte
+    table = []
+    for byte in range(256):
+        if byte & 0x80 > 0:
+            index_opt, index_bits = index_opts.ALREADY_INDEXED, 7
+        elif byte & 0x40 > 0:
+            index_opt, index_bits = index_opts.INCREMENTAL, 6
+        elif byte & 0x20 > 0:
+            index_opt, index_bits = index_opts.MAX_SIZE_UPDATE, 5
+        elif byte & 0x10 > 0:
+            index_opt, index_bits = index_opts.NEVER, 4
+        else:
+            index_opt, index_bits = index_opts.WITHOUT, 4
+        table.append((index_opt, index_bits, ed.prefix_masks[index_bits]))
+    return table
+
+# representations[byte] is the (index_opt, prefix bits, prefix mask) of the
+# header field representation that starts with byte
+representations = build_representations()
+
+# Literals longer than this aren't kept in the literal cache
+literal_cache_max_length = 1024
+
 class ctx:
-    def __init__(self, max_table_size_in=4096, max_table_size_out=4096, huffman_encoding=True):
-        self.table_decode = table.header_table(max_table_size_in)
+    # With decode_bytes set, decoded header names and values are bytes rather
+    # than str
+    #
+    # The encodings of the last literal_cache_size literals are kept, so that
+    # values sent over and over aren't huffman encoded every time
+    #
+    # Headers encoded without an index_opt get the one index_policy picks for
+    # them (see policy.index_policy), or are indexed if there is none
+    #
+    # With stats set, the encoder and decoder count how well they compress;
+    # see stats_snapshot
+    def __init__(self, max_table_size_in=4096, max_table_size_out=4096, huffman_encoding=True,
+            huffman_max_size=256, decode_bytes=False, literal_cache_size=256, index_policy=None,
+            stats=False):
+        self.table_decode = table.header_table(max_table_size_in, decode_bytes)
+        self.decode_bytes = decode_bytes
+        # Largest table size the peer may switch the decoding table to
+        self.max_table_size_in = max_table_size_in
         self.table_encode = table.header_table(max_table_size_out)
         self.header_bytes = None
         self.headers_out = {}
-        self.use_huffman_encoding = huffman_encoding
+        # True and False are kept as shorthands for ALWAYS and NEVER
+        if huffman_encoding is True:
+            huffman_encoding = huffman_opts.ALWAYS
+        elif huffman_encoding is False:
+            huffman_encoding = huffman_opts.NEVER
+        self.huffman_encoding = huffman_encoding
+        self.huffman_max_size = huffman_max_size
+        # Sizes the encoding table was set to since the last header block,
+        # which the next one has to start by announcing
+        self.table_size_updates = []
+        # Maps literals to their encoding, least recently used first. The
+        # encodings depend on huffman_encoding, so the cache has to be
+        # cleared if that changes.
+        self.literal_cache = OrderedDict()
+        self.literal_cache_size = literal_cache_size
+        self.index_policy = index_policy
+        # None unless stats are kept, so that not keeping them costs a
+        # comparison per header
+        self.encode_stats = coder_stats(self.table_encode) if stats else None
+        self.decode_stats = coder_stats(self.table_decode) if stats else None
+
+    def stats_snapshot(self):
+        # Returns the counters of the encoder and decoder, or None if they
+        # aren't kept
+        if self.encode_stats is None:
+            return None
+        return {
+                "encoder": self.encode_stats.snapshot(self.table_encode),
+                "decoder": self.decode_stats.snapshot(self.table_decode),
+            }
+
+    def reset_stats(self):
+        if self.encode_stats is not None:
+            self.encode_stats.reset(self.table_encode)
+            self.decode_stats.reset(self.table_decode)
+
+    def use_huffman_encoding(self, string):
+        if self.huffman_encoding is huffman_opts.ALWAYS:
+            return True
+        elif self.huffman_encoding is huffman_opts.NEVER:
+            return False
+        elif self.huffman_encoding is huffman_opts.FAST and len(string) > self.huffman_max_size:
+            return False
+
+        # Callers that have the string ascii encoded already can pass that
+        encoded_string = string.encode('ascii') if type(string) is str else string
+        return ed.huffman_encoded_length(encoded_string) < len(encoded_string)
+
+    def set_max_table_size_out(self, max_size):
+        self.table_encode.set_max_size(max_size)
+        self.table_size_updates.append(max_size)
 
     def start_encode(self):
         self.header_bytes = bytearray()
 
-    def encode_header_dict(self, header_dict, index_opt=index_opts.INCREMENTAL):
+        # Announce changes to the encoding table size with dynamic table size
+        # updates. When there was more than one, the smallest has to be
+        # announced as well as the final one (RFC 7541 section 4.2).
+        if len(self.table_size_updates) > 0:
+            smallest = min(self.table_size_updates)
+            final = self.table_size_updates[-1]
+            for max_size in ([smallest, final] if smallest < final else [final]):
+                ed.encode_integer_into(self.header_bytes, max_size, 5, 0x20)
+            self.table_size_updates = []
+
+    def encode_literal(self, string):
+        encoded = bytearray()
+        self.encode_literal_into(encoded, string)
+        return bytes(encoded)
+
+    def encode_literal_into(self, buf, string):
+        encoded = self.literal_cache.get(string)
+        if encoded is not None:
+            self.literal_cache.move_to_end(string)
+            buf.extend(encoded)
+            if self.encode_stats is not None and encoded[0] & 0x80:
+                self.encode_stats.huffman_saved += len(string) + ed.integer_length(len(string), 7) - len(encoded)
+            return
+
+        encoded_string = string.encode('ascii')
+        huffman = self.use_huffman_encoding(encoded_string)
+        start = len(buf)
+        ed.encode_string_literal_into(buf, encoded_string, huffman)
+        if self.literal_cache_size > 0 and len(string) <= literal_cache_max_length:
+            self.literal_cache[string] = bytes(buf[start:])
+            if len(self.literal_cache) > self.literal_cache_size:
+                self.literal_cache.popitem(last=False)
+        if self.encode_stats is not None and huffman:
+            self.encode_stats.huffman_saved += len(string) + ed.integer_length(len(string), 7) - (len(buf) - start)
+
+    def compile_headers(self, header_list, index_opt=None):
+        # Returns a header_template for the headers, which encode_template
+        # adds to a header block like encode_header_list would
+        return header_template(self, header_list, index_opt)
+
+    def encode_template(self, template):
+        if self.header_bytes is None:
+            raise Exception("Must call start_encode before encode_template")
+        if template.ctx is not self:
+            raise Exception("Header template was compiled for another context")
+
+        header_bytes = self.header_bytes
+        table_encode = self.table_encode
+        field_index = table_encode.field_index
+        name_index = table_encode.name_index
+        encode_stats = self.encode_stats
+        for entry in template.fields:
+            encoded, name, value, index_opt, insertion = entry
+            if encoded is not None and not encoded[0] & 0x80 and \
+                    ((name, value if len(value) > 0 else None) in field_index or
+                    (not encoded[0] & 0x0f and name in name_index)):
+                # A header that isn't indexed, but has been put in the
+                # dynamic table since, or its name has, by something else
+                self.encode_field(header_bytes, name, value, index_opt)
+            elif encoded is not None:
+                header_bytes.extend(encoded)
+                if encode_stats is not None:
+                    self.count_template_field(encode_stats, encoded, name, value)
+            elif insertion is not None and insertion >= table_encode.evict_count:
+                # The header is still in the dynamic table, where its index
+                # follows from the insertion number
+                ed.encode_integer_into(header_bytes, table_encode.index_from_insertion(insertion), 7, 0x80)
+                if encode_stats is not None:
+                    self.count_template_field(encode_stats, b'\x80', name, value)
+            else:
+                # Not indexed yet, or evicted since
+                self.encode_field(header_bytes, name, value, index_opt)
+                entry[4] = table_encode.field_index.get((name, value if len(value) > 0 else None))
+
+    def count_template_field(self, encode_stats, encoded, name, value):
+        # How a header from a template was encoded shows in its first byte
+        encode_stats.headers += 1
+        encode_stats.header_bytes += len(name) + len(value)
+        if encoded[0] & 0x80:
+            encode_stats.indexed += 1
+        elif encoded[0] & 0x0f:
+            encode_stats.name_indexed += 1
+        else:
+            encode_stats.literal += 1
+
+    def encode_header_dict(self, header_dict, index_opt=None):
+        if self.header_bytes is None:
+            raise Exception("Must call start_encode before encode_header_dict")
+        header_bytes = self.header_bytes
         for name in header_dict:
-            self.encode_header(name, header_dict[name], index_opt)
+            self.encode_field(header_bytes, name, header_dict[name], index_opt)
 
-    def encode_header_list(self, header_list, index_opt=index_opts.INCREMENTAL):
+    def encode_header_list(self, header_list, index_opt=None):
+        if self.header_bytes is None:
+            raise Exception("Must call start_encode before encode_header_list")
+        header_bytes = self.header_bytes
         for header in header_list:
-            self.encode_header(header[0], header[1], index_opt)
+            self.encode_field(header_bytes, header[0], header[1], index_opt)
 
-    def encode_header(self, name, value, index_opt=index_opts.INCREMENTAL):
+    def encode_header(self, name, value, index_opt=None):
         if self.header_bytes is None:
             raise Exception("Must call start_encode before encode_header")
+        self.encode_field(self.header_bytes, name, value, index_opt)
+
+    def choose_index_opt(self, name, value):
+        if self.index_policy is None:
+            return index_opts.INCREMENTAL
+        return self.index_policy.index_opt(name, value, self.table_encode)
+
+    def encode_field(self, header_bytes, name, value, index_opt):
+        # Everything is written straight into header_bytes, so that encoding
+        # a header doesn't create any buffers of its own
+        if index_opt is None:
+            index_opt = self.choose_index_opt(name, value)
+        encode_stats = self.encode_stats
+        if encode_stats is not None:
+            encode_stats.headers += 1
+            encode_stats.header_bytes += len(name) + len(value)
         if len(value) == 0:
             value = None
 
@@ -49,130 +261,345 @@ class ctx:
                 logger.debug("Found header name and value in table")
                 # Both name and value are indexed, just pull the index and
                 # encode that
-                encoded = ed.encode_integer(index, 7)
-                encoded[0] = (encoded[0] & 0x7f) | 0x80
+                ed.encode_integer_into(header_bytes, index, 7, 0x80)
+                if encode_stats is not None:
+                    encode_stats.indexed += 1
             else:
                 logger.debug("Found header name, but not value, in table")
+                if encode_stats is not None:
+                    encode_stats.name_indexed += 1
                 # Just the name is indexed
                 if index_opt is index_opts.INCREMENTAL:
                     # Index now
-                    encoded = ed.encode_integer(index, 6)
-                    encoded[0] = (encoded[0] & 0x3f) | 0x40
+                    ed.encode_integer_into(header_bytes, index, 6, 0x40)
                     logger.debug("Indexing header")
                     self.table_encode.new_header(name, value)
                 elif index_opt is index_opts.WITHOUT:
                     # Don't index now
-                    encoded = ed.encode_integer(index, 4)
-                    encoded[0] = encoded[0] & 0x0f
+                    ed.encode_integer_into(header_bytes, index, 4, 0x00)
                 else:
                     # Never index this
-                    encoded = ed.encode_integer(index, 4)
-                    encoded[0] = (encoded[0] & 0x0f) | 0x10
+                    ed.encode_integer_into(header_bytes, index, 4, 0x10)
                 # Encode the value
-                encoded.extend(ed.encode_string_literal(value, self.use_huffman_encoding))
+                self.encode_literal_into(header_bytes, value)
         else:
             logger.debug("Did not find header in table")
+            if encode_stats is not None:
+                encode_stats.literal += 1
             # Neither the name or value is indexed
-            encoded = bytearray()
-            encoded.append(0)
             if index_opt is index_opts.INCREMENTAL:
                 # Index now
-                encoded[0] = (encoded[0] & 0x3f) | 0x40
+                header_bytes.append(0x40)
                 # Index the header field
                 logger.debug("Indexing header")
                 self.table_encode.new_header(name, value)
             elif index_opt is index_opts.WITHOUT:
                 # Don't index
-                encoded[0] = encoded[0] & 0x0f
+                header_bytes.append(0x00)
             else:
                 # Never index
-                encoded[0] = (encoded[0] & 0x0f) | 0x10
+                header_bytes.append(0x10)
             # Encode the name and value
-            encoded.extend(ed.encode_string_literal(name, self.use_huffman_encoding))
-            encoded.extend(ed.encode_string_literal(value, self.use_huffman_encoding))
-
-        self.header_bytes.extend(encoded)
+            self.encode_literal_into(header_bytes, name)
+            self.encode_literal_into(header_bytes, value)
 
     def end_encode(self):
         header_bytes = self.header_bytes
         self.header_bytes = None
+        if self.encode_stats is not None:
+            self.encode_stats.encoded_bytes += len(header_bytes)
         return header_bytes
 
     def get_index_opt_from_byte(self, byte):
-        if byte & 0x80 > 0:
-            return index_opts.ALREADY_INDEXED
-        elif byte & 0x40 > 0:
-            return index_opts.INCREMENTAL
-        elif byte & 0x20 > 0:
-            return index_opts.MAX_SIZE_UPDATE
-        elif byte & 0x10 > 0:
-            return index_opts.NEVER
-        elif byte & 0xf0 == 0:
-            return index_opts.WITHOUT
-        else:
-            print("Found unknown index_opt", byte)
-            return index_opts.UNKNOWN
+        return representations[byte][0]
 
     def decode_headers(self, encoded):
-        decoded_headers = {}
+        decoder = self.start_decode()
+        decoder.feed(encoded)
+        return decoder.finish()
+
+    def decode_header_list(self, encoded):
+        # Like decode_headers, but returns a header_list
+        decoder = self.start_decode(lazy=True)
+        decoder.feed(encoded)
+        return decoder.finish()
+
+    def start_decode(self, max_header_list_size=None, lazy=False):
+        # Header blocks arriving in fragments are fed to the decoder as they
+        # come; see header_block_decoder
+        return header_block_decoder(self, max_header_list_size, lazy)
+
+# Headers encoded ahead of time, for headers that go into many header blocks.
+# Headers in the static table are encoded once and for all, and so are those
+# that aren't indexed, for as long as neither they nor, for those with a
+# literal name, their names turn up in the dynamic table. Others are encoded
+# normally the first time, and then referred to by the insertion number of
+# their dynamic table entry for as long as it lasts. Either way a template
+# encodes to the same bytes as encode_header_list would with the same
+# index_opts.
+#
+# Without an index_opt, the index policy is asked about each header once,
+# when the template is compiled; what it learns afterwards doesn't change
+# how templates compiled earlier encode their headers.
+class header_template:
+    __slots__ = ('ctx', 'fields')
+
+    def __init__(self, ctx, header_list, index_opt=None):
+        self.ctx = ctx
+        # [encoding, name, value, index_opt, insertion number] for every
+        # header, with an encoding only if it never changes
+        self.fields = []
+        for name,value in header_list:
+            encoded = None
+            field_index_opt = index_opt if index_opt is not None else ctx.choose_index_opt(name, value)
+            field_value = value if len(value) > 0 else None
+            index = table.header_table.static_table_rev.get(table.header_table.header_field(name, field_value))
+            if index is not None:
+                encoded = ed.encode_integer(index, 7)
+                encoded[0] = encoded[0] | 0x80
+            elif field_index_opt is not index_opts.INCREMENTAL:
+                flags = 0x00 if field_index_opt is index_opts.WITHOUT else 0x10
+                encoded = bytearray()
+                index = table.header_table.static_name_index.get(name)
+                if index is not None:
+                    ed.encode_integer_into(encoded, index, 4, flags)
+                else:
+                    encoded.append(flags)
+                    ctx.encode_literal_into(encoded, name)
+                ctx.encode_literal_into(encoded, value)
+            self.fields.append([None if encoded is None else bytes(encoded), name, value, field_index_opt, None])
+
+# Decodes a header block a fragment at a time. Every header field that is
+# complete is decoded as soon as it arrives; only the start of one split
+# between fragments is kept until the rest comes in. With
+# max_header_list_size set, a block whose header list (RFC 7540 section
+# 6.5.2) grows past it is rejected as soon as the length of the field that
+# does so is known.
+#
+# Malformed blocks raise an exception. The decoding table is then out of step
+# with the encoder's, so the connection can't go on (RFC 7540 section 4.3).
+#
+# The block decodes to a dict, or with lazy set to a header_list. Literals
+# that don't go into the dynamic table are then only copied, and decoded
+# when the header_list is asked for them. Their size counts towards
+# max_header_list_size as the size of the encoded literal, since the size
+# of a huffman encoded one isn't known until it's decoded.
+class header_block_decoder:
+    def __init__(self, ctx, max_header_list_size=None, lazy=False):
+        self.ctx = ctx
+        self.max_header_list_size = max_header_list_size
+        self.lazy = lazy
+        if lazy:
+            self.headers = header_list.header_list(ctx.decode_bytes)
+        else:
+            self.headers = {}
+        self.header_list_size = 0
+        # Start of a field that continues in the next fragment, and how many
+        # bytes it needs at least before it's worth decoding again; large
+        # literals would otherwise be decoded again with every fragment
+        self.pending = bytearray()
+        self.pending_needed = 0
+        # Where the literal that stopped decode_field would end
+        self.literal_end = 0
+        # Table size updates are only allowed before the first header field
+        self.seen_field = False
+        self.stats = ctx.decode_stats
+        # What huffman encoding saved on the literals of the field being
+        # decoded; only counted once the whole field has been
+        self.huffman_saved = 0
+
+    def feed(self, fragment):
+        if self.stats is not None:
+            self.stats.encoded_bytes += len(fragment)
+        pending = self.pending
+        if len(pending) > 0:
+            pending.extend(fragment)
+            if len(pending) < self.pending_needed:
+                return
+            encoded = memoryview(pending)
+        else:
+            encoded = memoryview(fragment)
+
         cur_byte = 0
-        bytes_read = 0
-
-        while cur_byte < len(encoded):
-            # Look at the next header type
-            index_opt = self.get_index_opt_from_byte(encoded[cur_byte])
-            if index_opt == index_opts.ALREADY_INDEXED:
-                # This header is indexed and we should just find it in the
-                # table
-                index, bytes_read = ed.decode_integer(encoded, cur_byte, 7)
-                header_field = self.table_decode.find_field_by_index(index)
+        length = len(encoded)
+        self.literal_end = 0
+        while cur_byte < length:
+            next_byte = self.decode_field(encoded, cur_byte)
+            if next_byte is None:
+                # The rest of this field is in the next fragment
+                break
+            cur_byte = next_byte
+        encoded.release()
+
+        # The decoded bytes are trimmed in place, rather than copying what's
+        # left, which makes a large field arriving in many fragments
+        # quadratic
+        if len(pending) > 0:
+            del pending[:cur_byte]
+        else:
+            pending.extend(fragment[cur_byte:])
+        self.pending_needed = self.literal_end - cur_byte
+
+    def finish(self):
+        if len(self.pending) > 0:
+            raise Exception("Header block ends in the middle of a header field")
+        return self.headers
+
+    def decode_field(self, encoded, cur_byte):
+        # Decodes the header field or table size update at cur_byte, and
+        # returns where the next one starts, or None if it isn't complete
+        table_decode = self.ctx.table_decode
+        first_byte = encoded[cur_byte]
+        index_opt, index_bits, index_mask = representations[first_byte]
+
+        # Most indexes fit in the first byte
+        index = first_byte & index_mask
+        if index < index_mask:
+            cur_byte = cur_byte + 1
+        else:
+            index, bytes_read = decode_integer(encoded, cur_byte, index_bits)
+            if bytes_read == 0:
+                return None
+            cur_byte = cur_byte + bytes_read
+
+        if index_opt is index_opts.ALREADY_INDEXED:
+            # This header is indexed and we should just find it in the table
+            if 0 < index < table.header_table.st_len:
+                header_field = table_decode.static_table[index]
+            elif index == 0:
+                raise Exception("Index 0 doesn't refer to a header field")
+            else:
+                header_field = table_decode.find_field_by_index(index)
+            if header_field is None:
+                raise Exception("Couldn't find index {:d} in decode table".format(index))
+            name,value = header_field
+            if value is None:
+                # Static entries without a value stand for an empty one
+                value = b'' if self.ctx.decode_bytes else ''
+            name_size = len(name)
+            value_size = len(value)
+            if self.max_header_list_size is not None:
+                self.check_list_size(name_size + value_size + 32)
+            if self.stats is not None:
+                self.stats.indexed += 1
+        elif index_opt is index_opts.MAX_SIZE_UPDATE:
+            if self.seen_field:
+                raise Exception("Dynamic table size update after a header field")
+            elif index > self.ctx.max_table_size_in:
+                raise Exception("Dynamic table size update to {:d} is larger than allowed".format(index))
+            table_decode.set_max_size(index)
+            logger.debug("Max decode dynamic table size updated to %d", index)
+            return cur_byte
+        else:
+            # Literals going into the table are needed decoded straight away
+            keep_encoded = self.lazy and index_opt is not index_opts.INCREMENTAL
+            # A field split across fragments is decoded again from the start
+            self.huffman_saved = 0
+            if index > 0:
+                # Name is contained within the table
+                header_field = table_decode.find_field_by_index(index)
                 if header_field is None:
-                    # Protocol error
-                    logger.warning("Protocol Error: Couldn't find index %d in decode table", index)
-                    logger.debug("Decode dynamic table: %s", self.table_decode.dynamic_table)
-                    return None
-                name,value = header_field
+                    raise Exception("Couldn't find index {:d} in decode table".format(index))
+                name = header_field.name
+                name_size = len(name)
             else:
-                # Figure out how many bits the index takes up
-                if index_opt == index_opts.INCREMENTAL:
-                    index_bits = 6
-                elif index_opt == index_opts.WITHOUT:
-                    index_bits = 4
-                elif index_opt == index_opts.NEVER:
-                    index_bits = 4
-                elif index_opt == index_opts.MAX_SIZE_UPDATE:
-                    index_bits = 5
-
-                # Decode the header name and value
-                index,bytes_read = ed.decode_integer(encoded, cur_byte, index_bits)
-                cur_byte = cur_byte + bytes_read
-
-                if index_opt == index_opts.MAX_SIZE_UPDATE:
-                    # Special path - just update the max table size
-                    self.table_decode.set_max_size(index)
-                    logger.debug("Max decode dynamic table size updated to %d", index)
-                    continue
+                # Name is explicit
+                name, name_size, cur_byte = self.decode_string_literal(encoded, cur_byte, 32, keep_encoded)
+                if name is None:
+                    return None
 
+            # Value is always explicit if not in ALREADY_INDEXED mode
+            value, value_size, cur_byte = self.decode_string_literal(encoded, cur_byte, name_size + 32,
+                    keep_encoded)
+            if value is None:
+                return None
+
+            if index_opt is index_opts.INCREMENTAL:
+                # Incremental; add to the table
+                table_decode.new_header(name, value)
+                logger.debug("New header added to the decoder dynamic table, size now %d",
+                        table_decode.cur_size)
+
+        logger.debug("Read header '%s: %s' (index type: %s)", name, value, index_opt)
+        if self.stats is not None:
+            self.stats.headers += 1
+            self.stats.header_bytes += name_size + value_size
+            if index_opt is not index_opts.ALREADY_INDEXED:
+                self.stats.huffman_saved += self.huffman_saved
                 if index > 0:
-                    # Name is contained within the table
-                    header_field = self.table_decode.find_field_by_index(index)
-                    name = header_field.name
+                    self.stats.name_indexed += 1
                 else:
-                    # Name is explicit
-                    name,bytes_read = ed.decode_string_literal(encoded, cur_byte)
-                    cur_byte = cur_byte + bytes_read
+                    self.stats.literal += 1
+        self.seen_field = True
+        self.header_list_size = self.header_list_size + name_size + value_size + 32
+        if self.lazy:
+            self.headers.append(name, value)
+        else:
+            self.headers[name] = value
+        return cur_byte
 
-                # Value is always explicit if not in ALREADY_INDEXED mode
-                value,bytes_read = ed.decode_string_literal(encoded, cur_byte)
+    def decode_string_literal(self, encoded, cur_byte, field_size, keep_encoded=False):
+        # Returns the string literal at cur_byte, its size and where it ends,
+        # or None if it isn't complete. field_size is the size the header
+        # field adds to the header list without this literal. With
+        # keep_encoded set, the literal is returned as an encoded_literal.
+        encoded_length = len(encoded)
+        if cur_byte >= encoded_length:
+            return None, 0, cur_byte
+        first_byte = encoded[cur_byte]
+        length = first_byte & 0x7f
+        if length < 0x7f:
+            start = cur_byte + 1
+        else:
+            length, bytes_read = decode_integer(encoded, cur_byte, 7)
+            if bytes_read == 0:
+                return None, 0, cur_byte
+            start = cur_byte + bytes_read
 
-                if index_opt == index_opts.INCREMENTAL:
-                    # Incremental; add to the table
-                    self.table_decode.new_header(name, value)
-                    logger.debug("New header added to the decoder dynamic table: %s", self.table_decode.dynamic_table)
+        # Each huffman code is at most 30 bits long, which bounds how short
+        # the decoded literal can be
+        huffman = first_byte & 0x80 > 0
+        if self.max_header_list_size is not None:
+            self.check_list_size(field_size + (length * 8 // 30 if huffman else length))
 
-            logger.debug("Read header '%s: %s' (index type: %s)", name, value, index_opt.name)
+        end = start + length
+        if end > encoded_length:
+            self.literal_end = end
+            return None, 0, cur_byte
+        if keep_encoded:
+            # encoded may be a view of a buffer that gets reused. The literal
+            # is checked now, so that a malformed one is a compression error
+            # rather than failing whenever the header_list is looked at;
+            # only building the string is put off.
+            data = bytes(encoded[start:end])
+            if huffman:
+                ed.check_huffman_bytes(data, 0, length, not self.ctx.decode_bytes)
+            elif not self.ctx.decode_bytes and not data.isascii():
+                raise Exception("Header field literal isn't ascii")
+            return header_list.encoded_literal(data, huffman), length, end
 
-            decoded_headers[name] = value
-            cur_byte = cur_byte + bytes_read
+        # encoded is a memoryview, so raw literals are decoded without
+        # copying them first
+        if huffman:
+            string = ed.decode_huffman_bytes(encoded, start, length)
+            if self.stats is not None:
+                self.huffman_saved += len(string) + ed.integer_length(len(string), 7) - (end - cur_byte)
+        else:
+            string = encoded[start:end]
+        if self.ctx.decode_bytes:
+            string = bytes(string)
+        else:
+            string = str(string, 'ascii')
+        return string, len(string), end
+
+    def check_list_size(self, field_size):
+        if self.max_header_list_size is not None and self.header_list_size + field_size > self.max_header_list_size:
+            raise Exception("Header list is larger than {:d} bytes".format(self.max_header_list_size))
 
-        return decoded_headers
+def decode_integer(encoded, start, prefix):
+    # Like ed.decode_integer, but returns 0 bytes read if encoded ends
+    # before the integer does
+    try:
+        return ed.decode_integer(encoded, start, prefix)
+    except IndexError:
+        return 0, 0
@@ -0,0 +1,91 @@
+# Indexing policies, which decide how headers that aren't in the table yet
+# get encoded. Headers whose values hardly ever repeat only push the ones
+# that do out of the dynamic table, so they're better off not indexed.
+
+import logging
+from .hpack import index_opts
+
+logger = logging.getLogger('hpack')
+
+# Headers that carry credentials are never indexed, so that intermediaries
+# don't index them either (RFC 7541 section 7.1.3). The others are different
+# on almost every message.
+default_rules = {
+        "authorization": index_opts.NEVER,
+        "proxy-authorization": index_opts.NEVER,
+        "content-length": index_opts.WITHOUT,
+        "date": index_opts.WITHOUT,
+        "etag": index_opts.WITHOUT,
+        "last-modified": index_opts.WITHOUT,
+        "if-modified-since": index_opts.WITHOUT,
+        "if-none-match": index_opts.WITHOUT,
+        "age": index_opts.WITHOUT,
+        "expires": index_opts.WITHOUT,
+        "x-request-id": index_opts.WITHOUT,
+    }
+
+# Decides by header name from fixed rules, then by size, and then, with learn
+# set, from how often the values of the name have repeated. Headers that none
+# of these apply to are indexed.
+#
+# rules maps names to the index_opts to encode them with. Headers whose table
+# entry would take up more than max_entry_fraction of the table aren't
+# indexed. Learning keeps the last few values of up to max_names names, and
+# stops indexing a name once fewer than min_repeat_ratio of its values have
+# been repeats, after at least learn_after of them.
+class index_policy:
+    def __init__(self, rules=default_rules, max_entry_fraction=0.25, learn=True, learn_after=8,
+            min_repeat_ratio=0.25, max_names=256, recent_values=4):
+        self.rules = dict(rules) if rules is not None else {}
+        self.max_entry_fraction = max_entry_fraction
+        self.learn = learn
+        self.learn_after = learn_after
+        self.min_repeat_ratio = min_repeat_ratio
+        self.max_names = max_names
+        self.recent_values = recent_values
+        # Maps names to [values seen, repeats among them, recent values]
+        self.names = {}
+
+    def index_opt(self, name, value, table):
+        index_opt = self.rules.get(name)
+        if index_opt is not None:
+            return index_opt
+
+        if self.max_entry_fraction is not None and \
+                len(name) + len(value) + 32 > table.max_size * self.max_entry_fraction:
+            return index_opts.WITHOUT
+
+        if self.learn and not self.repeats_often(name, value):
+            return index_opts.WITHOUT
+        return index_opts.INCREMENTAL
+
+    def repeats_often(self, name, value):
+        stats = self.names.get(name)
+        if stats is None:
+            if len(self.names) >= self.max_names:
+                # Names past the limit aren't learned about
+                return True
+            stats = [0, 0, []]
+            self.names[name] = stats
+
+        recent = stats[2]
+        stats[0] += 1
+        if value in recent:
+            stats[1] += 1
+        else:
+            recent.append(value)
+            if len(recent) > self.recent_values:
+                del recent[0]
+
+        # Old history counts for less and less, so that a name can change
+        # its mind
+        if stats[0] >= 256:
+            stats[0] //= 2
+            stats[1] //= 2
+
+        if stats[0] < self.learn_after:
+            return True
+        repeats_often = stats[1] >= stats[0] * self.min_repeat_ratio
+        if not repeats_often and stats[0] == self.learn_after:
+            logger.debug("Header '%s' rarely repeats, no longer indexing it", name)
+        return repeats_often
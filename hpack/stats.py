@@ -0,0 +1,43 @@
+# Counters of how well a hpack context compresses, for contexts created with
+# stats=True. The encoder and the decoder each have their own.
+
+class coder_stats:
+    __slots__ = ('headers', 'header_bytes', 'encoded_bytes', 'indexed', 'name_indexed', 'literal',
+            'huffman_saved', 'insertions_base', 'evictions_base')
+
+    def __init__(self, table):
+        self.reset(table)
+
+    def reset(self, table):
+        # Headers, and the bytes of their names and values
+        self.headers = 0
+        self.header_bytes = 0
+        # Bytes of the header blocks they went into
+        self.encoded_bytes = 0
+        # Headers found in the table, headers whose name only was found, and
+        # headers with a literal name
+        self.indexed = 0
+        self.name_indexed = 0
+        self.literal = 0
+        # Bytes huffman encoding saved over plain literals
+        self.huffman_saved = 0
+        # The table counts insertions and evictions already
+        self.insertions_base = table.insert_count
+        self.evictions_base = table.evict_count
+        table.peak_size = table.cur_size
+
+    def snapshot(self, table):
+        return {
+                "headers": self.headers,
+                "header_bytes": self.header_bytes,
+                "encoded_bytes": self.encoded_bytes,
+                "indexed": self.indexed,
+                "name_indexed": self.name_indexed,
+                "literal": self.literal,
+                "huffman_saved": self.huffman_saved,
+                "insertions": table.insert_count - self.insertions_base,
+                "evictions": table.evict_count - self.evictions_base,
+                "table_entries": table.insert_count - table.evict_count,
+                "table_size": table.cur_size,
+                "table_peak_size": table.peak_size,
+            }
@@ -7,7 +7,8 @@ logger = logging.getLogger('hpack')
 
 class header_table:
     header_field = namedtuple("header_field", ["name", "value"])
-    static_table = [
+    # Shared by every table, so it mustn't change
+    static_table = (
                 header_field(None, None),
                 header_field(":authority",None),
                 header_field(":method","GET"),
@@ -70,56 +71,154 @@ class header_table:
                 header_field("vary",None),
                 header_field("via",None),
                 header_field("www-authenticate",None),
-            ]
+            )
     st_len = len(static_table)
-    static_table_rev = {}
-    for index,field in enumerate(static_table):
-        static_table_rev[field] = index
+    # Maps from a full field to its index, and from a name to the lowest
+    # index with that name, and the static table for decoders that produce
+    # bytes. They're built along with the first table, by
+    # build_static_indexes, and shared by all of them.
+    static_table_rev = None
+    static_name_index = None
+    static_table_bytes = None
 
-    def __init__(self, max_size):
+    # With as_bytes set, find_field_by_index returns fields of bytes, and
+    # new_header is passed bytes. Only decoders use this.
+    def __init__(self, max_size, as_bytes=False):
+        if header_table.static_table_rev is None:
+            build_static_indexes()
+        self.static_table = header_table.static_table_bytes if as_bytes else header_table.static_table
         self.cur_size = 0
+        # Every header inserted into the dynamic table is identified by an
+        # insertion number, which unlike its index doesn't change when newer
+        # headers are inserted. Live entries are insertions evict_count up to
+        # insert_count - 1, stored in a ring buffer at insertion % capacity, so
+        # neither inserting nor evicting moves any other entry.
         self.dynamic_table = []
+        self.insert_count = 0
+        self.evict_count = 0
+        # The indexes below map a name or a full field to the insertion number
+        # of the newest entry having it, so they only need touching on
+        # insertion and eviction.
+        self.name_index = {}
+        self.field_index = {}
+        # Largest cur_size has been, since the stats were last reset
+        self.peak_size = 0
+        self.max_size = 0
         self.set_max_size(max_size)
 
     def set_max_size(self, max_size):
+        # A smaller maximum size takes effect immediately (RFC 7541 section 4.3)
         self.max_size = max_size
+        while self.cur_size > self.max_size:
+            self.evict()
+
+        # Every entry takes at least 32 bytes, which bounds how many fit in
+        # the table. Storage grows on demand up to that bound, but is given
+        # back straight away when the bound shrinks.
+        max_entries = max(max_size // 32, 1)
+        if len(self.dynamic_table) > max_entries:
+            self.resize(max_entries)
+
+    def resize(self, capacity):
+        dynamic_table = [None] * capacity
+        for insertion in range(self.evict_count, self.insert_count):
+            dynamic_table[insertion % capacity] = self.dynamic_table[insertion % len(self.dynamic_table)]
+        self.dynamic_table = dynamic_table
 
     def length(self):
-        return header_table.st_len + len(self.dynamic_table)
+        return header_table.st_len + self.insert_count - self.evict_count
 
     def dynamic_size(self):
         return self.cur_size
 
+    def index_from_insertion(self, insertion):
+        return header_table.st_len + self.insert_count - 1 - insertion
+
     def find_field_by_index(self, index):
         if index < header_table.st_len:
-            return header_table.static_table[index]
-        elif index < header_table.st_len + len(self.dynamic_table):
-            return self.dynamic_table[index - self.st_len]
+            return self.static_table[index]
+
+        insertion = self.insert_count - 1 - (index - header_table.st_len)
+        if insertion >= self.evict_count:
+            return self.dynamic_table[insertion % len(self.dynamic_table)]
         else:
             return None
 
     def find_index_by_field(self, name, value):
-        hfield = header_table.header_field(name, value)
-        prelim_idx = None
+        # A plain tuple finds header_fields as well, without the cost of
+        # making one
+        hfield = (name, value)
         # Find the entire field if possible; otherwise, just find the name
-        if hfield in header_table.static_table_rev:
-            return header_table.static_table_rev[hfield]
-        else:
-            prelim_idx = next((idx for idx,header in enumerate(header_table.static_table) if header.name == name), None)
+        index = header_table.static_table_rev.get(hfield)
+        if index is not None:
+            return index
+
+        insertion = self.field_index.get(hfield)
+        if insertion is not None:
+            return self.index_from_insertion(insertion)
+
+        index = header_table.static_name_index.get(name)
+        if index is not None:
+            return index
 
-        for idx,val in enumerate(self.dynamic_table):
-            if val == hfield:
-                return idx + header_table.st_len
-            elif val.name == name and prelim_idx is None:
-                prelim_idx = idx + header_table.st_len
-        return prelim_idx
+        insertion = self.name_index.get(name)
+        if insertion is not None:
+            return self.index_from_insertion(insertion)
+        return None
 
     def new_header(self, name, value):
-        self.dynamic_table.insert(0, header_table.header_field(name, value))
-        self.cur_size = self.cur_size + len(name) + len(value) + 32
-        while self.cur_size > self.max_size:
-            elem = self.dynamic_table.pop()
-            elem_size = len(elem.name) + len(elem.value) + 32
-            logger.debug("Dynamic table size %d exceeds maximum, evicting %s (size %d)",
-                    self.cur_size, elem, elem_size)
-            self.cur_size = self.cur_size - elem_size 
+        entry_size = len(name) + len(value) + 32
+
+        # Make room for the new entry first. An entry larger than the whole
+        # table empties it and isn't added (RFC 7541 section 4.4).
+        while self.insert_count > self.evict_count and self.cur_size + entry_size > self.max_size:
+            self.evict()
+        if entry_size > self.max_size:
+            logger.debug("Header %s: %s (size %d) is larger than the dynamic table", name, value, entry_size)
+            return
+
+        if self.insert_count - self.evict_count == len(self.dynamic_table):
+            self.resize(max(2 * len(self.dynamic_table), 16))
+
+        hfield = header_table.header_field(name, value)
+        self.dynamic_table[self.insert_count % len(self.dynamic_table)] = hfield
+        self.name_index[name] = self.insert_count
+        self.field_index[hfield] = self.insert_count
+        self.insert_count = self.insert_count + 1
+        self.cur_size = self.cur_size + entry_size
+        if self.cur_size > self.peak_size:
+            self.peak_size = self.cur_size
+
+    def evict(self):
+        # The oldest entry is the one with the lowest insertion number
+        insertion = self.evict_count
+        slot = insertion % len(self.dynamic_table)
+        elem = self.dynamic_table[slot]
+        self.dynamic_table[slot] = None
+        self.evict_count = self.evict_count + 1
+
+        elem_size = len(elem.name) + len(elem.value) + 32
+        logger.debug("Dynamic table size %d exceeds maximum, evicting %s (size %d)",
+                self.cur_size, elem, elem_size)
+        self.cur_size = self.cur_size - elem_size
+        # Only drop index entries that still refer to this entry, rather than
+        # a newer one with the same name or field
+        if self.name_index.get(elem.name) == insertion:
+            del self.name_index[elem.name]
+        if self.field_index.get(elem) == insertion:
+            del self.field_index[elem]
+
+def build_static_indexes():
+    static_table_rev = {}
+    static_name_index = {}
+    static_table_bytes = []
+    for index,field in enumerate(header_table.static_table):
+        static_table_rev[field] = index
+        static_name_index.setdefault(field.name, index)
+        static_table_bytes.append(header_table.header_field(
+                None if field.name is None else field.name.encode('ascii'),
+                None if field.value is None else field.value.encode('ascii')))
+    header_table.static_name_index = static_name_index
+    header_table.static_table_bytes = tuple(static_table_bytes)
+    # Set last, since it tells whether the others are built
+    header_table.static_table_rev = static_table_rev
@@ -1 +1 @@
-__all__ = ["hpack"]
+__all__ = ["hpack", "h2"]
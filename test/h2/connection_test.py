@@ -0,0 +1,776 @@
+import gc
+import unittest
+import struct
+import tracemalloc
+from h2 import connection
+from h2 import frames
+
+def raw_frame(frame_type, flags, stream_id, payload):
+    return struct.pack("!BHBBI", len(payload) >> 16, len(payload) & 0xffff,
+            frame_type, flags, stream_id) + payload
+
+class Peer():
+    # Stands in for the application and the transport of a client connection
+    def __init__(self, **kwargs):
+        self.sent = bytearray()
+        self.messages = []
+        self.events = []
+        callbacks = {
+            "send": self.send,
+            "handle_message": self.messages.append,
+            "handle_headers": lambda stream_id, headers: self.events.append(("headers", stream_id, headers)),
+            "handle_data": lambda stream_id, data: self.events.append(("data", stream_id, bytes(data))),
+            "handle_end": lambda stream_id, trailers: self.events.append(("end", stream_id, trailers)),
+        }
+        self.connection = connection.connection(callbacks, **kwargs)
+        self.connection.initiate()
+        # Server's SETTINGS acknowledgement ends the preface
+        self.connection.process_bytes(raw_frame(frames.frame_type.SETTINGS, 0x1, 0, b''))
+
+    def send(self, data):
+        self.sent.extend(data)
+        return 0
+
+    def sent_frames(self):
+        # Decodes and forgets everything sent after the connection preface
+        encoded = bytes(self.sent[len(connection.connection_preface):]) if self.sent.startswith(connection.connection_preface) else bytes(self.sent)
+        self.sent = bytearray()
+        decoded = []
+        offset = 0
+        while offset < len(encoded):
+            frame, read = frames.frame.decode_static(encoded, offset)
+            decoded.append(frame)
+            offset += read
+        return decoded
+
+    def request(self, data=None):
+        self.connection.send_request({":method": "POST", ":scheme": "https", ":path": "/", ":authority": "localhost"}, data)
+
+class TestConnection(unittest.TestCase):
+
+    def response_bytes(self, stream_id, body, frame_size):
+        # ':status: 200' is static table index 8
+        encoded = [raw_frame(frames.frame_type.HEADERS, 0x4, stream_id, b'\x88')]
+        for idx in range(0, len(body), frame_size):
+            chunk = body[idx:idx+frame_size]
+            end_stream = 0x1 if idx + frame_size >= len(body) else 0x0
+            encoded.append(raw_frame(frames.frame_type.DATA, end_stream, stream_id, chunk))
+        return b''.join(encoded)
+
+    def test_process_bytes_in_pieces(self):
+        peer = Peer()
+        peer.connection.send_request({":method": "GET", ":scheme": "https", ":path": "/", ":authority": "localhost"})
+
+        body = bytes(range(256)) * 16
+        encoded = self.response_bytes(1, body, 100)
+        # Feed the response in awkwardly sized pieces, which split frame
+        # headers and payloads
+        for idx in range(0, len(encoded), 7):
+            peer.connection.process_bytes(encoded[idx:idx+7])
+
+        self.assertEqual(len(peer.messages), 1)
+        self.assertEqual(peer.messages[0].headers, {":status": "200"})
+        self.assertEqual(peer.messages[0].data, body)
+        self.assertEqual(len(peer.connection.recv_buffer), 0)
+
+    def test_process_large_burst(self):
+        peer = Peer()
+        peer.connection.send_request({":method": "GET", ":scheme": "https", ":path": "/", ":authority": "localhost"})
+
+        body = b'x' * (1 << 20)
+        encoded = self.response_bytes(1, body, 64)
+        peer.connection.process_bytes(encoded[:-5])
+        # Decoded bytes were compacted away as the burst was processed
+        self.assertLess(peer.connection.recv_offset, connection.recv_buffer_compact_threshold)
+        self.assertLess(len(peer.connection.recv_buffer), connection.recv_buffer_compact_threshold + 100)
+        peer.connection.process_bytes(encoded[-5:])
+
+        self.assertEqual(len(peer.messages), 1)
+        self.assertEqual(peer.messages[0].data, body)
+
+    def test_process_bytes_with_held_view(self):
+        peer = Peer()
+        encoded = raw_frame(frames.frame_type.PING, 0x0, 0, b'12345678')
+        peer.connection.process_bytes(encoded[:5])
+
+        # A view into the receive buffer kept elsewhere mustn't stop it from
+        # taking more bytes
+        view = memoryview(peer.connection.recv_buffer)
+        peer.connection.process_bytes(encoded[5:])
+        self.assertEqual(view, encoded[:5])
+        self.assertEqual(len(peer.connection.recv_buffer), 0)
+
+    def test_streaming(self):
+        peer = Peer(streaming=True)
+        peer.connection.send_request({":method": "GET", ":scheme": "https", ":path": "/", ":authority": "localhost"})
+
+        body = b'0123456789' * 10
+        encoded = self.response_bytes(1, body, 40)
+        peer.connection.process_bytes(encoded[:-45])
+        # Headers and each chunk are delivered as they arrive, without
+        # waiting for the end of the stream
+        self.assertEqual(peer.events, [
+                ("headers", 1, {":status": "200"}),
+                ("data", 1, body[:40]),
+            ])
+        self.assertEqual(len(peer.connection.streams[1].data_bytes), 0)
+
+        peer.connection.process_bytes(encoded[-45:])
+        self.assertEqual(peer.events[2:], [
+                ("data", 1, body[40:80]),
+                ("data", 1, body[80:]),
+                ("end", 1, None),
+            ])
+        self.assertEqual(peer.messages, [])
+
+    def test_trailers(self):
+        for streaming in [False, True]:
+            peer = Peer(streaming=streaming)
+            peer.connection.send_request({":method": "GET", ":scheme": "https", ":path": "/", ":authority": "localhost"})
+
+            # Response headers split over HEADERS and CONTINUATION, then a
+            # body, then trailers ('grpc-status: 0', literal without indexing)
+            peer.connection.process_bytes(
+                    raw_frame(frames.frame_type.HEADERS, 0x0, 1, b'') +
+                    raw_frame(frames.frame_type.CONTINUATION, 0x4, 1, b'\x88') +
+                    raw_frame(frames.frame_type.DATA, 0x0, 1, b'body') +
+                    raw_frame(frames.frame_type.HEADERS, 0x5, 1, b'\x00\x0bgrpc-status\x010'))
+
+            if streaming:
+                self.assertEqual(peer.events, [
+                        ("headers", 1, {":status": "200"}),
+                        ("data", 1, b'body'),
+                        ("end", 1, {"grpc-status": "0"}),
+                    ])
+            else:
+                self.assertEqual(len(peer.messages), 1)
+                self.assertEqual(peer.messages[0].headers, {":status": "200"})
+                self.assertEqual(peer.messages[0].data, b'body')
+                self.assertEqual(peer.messages[0].trailers, {"grpc-status": "0"})
+
+    def test_end_stream_before_continuation(self):
+        # END_STREAM on a HEADERS frame only closes the stream once its
+        # CONTINUATION frames have ended the header block
+        peer = Peer()
+        peer.request()
+        peer.request()
+        peer.sent_frames()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x1, 1, b'\x88'))
+        peer.connection.process_bytes(raw_frame(frames.frame_type.CONTINUATION, 0x4, 1,
+                b'\x40\x0acustom-key\x0dcustom-header'))
+        self.assertEqual(len(peer.messages), 1)
+        self.assertEqual(peer.messages[0].headers, {":status": "200", "custom-key": "custom-header"})
+
+        # Trailers too
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x4, 3, b'\x88\xbe') +
+                raw_frame(frames.frame_type.DATA, 0x0, 3, b'body') +
+                raw_frame(frames.frame_type.HEADERS, 0x1, 3, b'\x00\x0bgrpc-status') +
+                raw_frame(frames.frame_type.CONTINUATION, 0x4, 3, b'\x010'))
+        self.assertEqual(peer.sent_frames(), [])
+        self.assertEqual(len(peer.messages), 2)
+        self.assertEqual(peer.messages[1].headers, {":status": "200", "custom-key": "custom-header"})
+        self.assertEqual(peer.messages[1].data, b'body')
+        self.assertEqual(peer.messages[1].trailers, {"grpc-status": "0"})
+
+    def test_empty_header_value(self):
+        peer = Peer()
+        peer.request()
+        peer.sent_frames()
+        # ':status: 200', then 'accept' from the static table, which has no value
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x5, 1, b'\x88\x93'))
+        self.assertEqual(peer.messages[0].headers, {":status": "200", "accept": ""})
+        self.assertEqual(peer.sent_frames(), [])
+
+    def test_header_list(self):
+        peer = Peer(header_list=True)
+        peer.request()
+
+        # ':status: 200', then 'set-cookie' twice as literals without indexing
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x5, 1,
+                b'\x88\x0f\x28\x03a=1\x0f\x28\x03b=2'))
+        headers = peer.messages[0].headers
+        self.assertEqual(list(headers), [(":status", "200"), ("set-cookie", "a=1"), ("set-cookie", "b=2")])
+
+        peer = Peer(header_list=True, decode_bytes=True)
+        peer.request()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x5, 1, b'\x88'))
+        self.assertEqual(peer.messages[0].headers.get(b':status'), b'200')
+
+        # Malformed literals are a compression error straight away, not when
+        # the application gets to them
+        peer = Peer(header_list=True)
+        peer.request()
+        peer.sent_frames()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x5, 1, b'\x88\x00\x01x\x81\x00'))
+        sent = peer.sent_frames()
+        self.assertEqual(sent[-1].frame_type, frames.frame_type.GOAWAY)
+        self.assertEqual(sent[-1].error_code, frames.error.COMPRESSION_ERROR)
+        self.assertEqual(peer.messages, [])
+
+    def test_unknown_and_priority_frames(self):
+        peer = Peer()
+        peer.connection.send_request({":method": "GET", ":scheme": "https", ":path": "/", ":authority": "localhost"})
+        peer.sent_frames()
+
+        # Frames of unknown types are skipped, and PRIORITY frames don't
+        # disturb the stream
+        peer.connection.process_bytes(
+                raw_frame(0xfa, 0x0, 1, b'extension') +
+                raw_frame(frames.frame_type.PRIORITY, 0x0, 1, b'\x00\x00\x00\x00\x0f') +
+                self.response_bytes(1, b'body', 16))
+        self.assertEqual(peer.sent_frames(), [])
+        self.assertEqual(len(peer.messages), 1)
+        self.assertEqual(peer.messages[0].data, b'body')
+
+class TestFlowControl(unittest.TestCase):
+
+    def window_update(self, stream_id, increment):
+        return raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, stream_id, increment.to_bytes(4, 'big'))
+
+    def test_send_respects_windows(self):
+        peer = Peer()
+        peer.sent_frames()
+        body = bytes(range(256)) * 1024
+        peer.request(body)
+
+        # Only the default 65535 byte window's worth of DATA goes out
+        sent = peer.sent_frames()
+        self.assertEqual(sent[0].frame_type, frames.frame_type.HEADERS)
+        data = b''.join(bytes(frame.data) for frame in sent[1:])
+        self.assertEqual(data, body[:65535])
+        self.assertTrue(all(len(frame.data) <= 16384 for frame in sent[1:]))
+        self.assertEqual(peer.connection.send_window, 0)
+
+        # Opening up the stream window alone isn't enough
+        peer.connection.process_bytes(self.window_update(1, 100000))
+        self.assertEqual(peer.sent_frames(), [])
+
+        peer.connection.process_bytes(self.window_update(0, 1000))
+        sent = peer.sent_frames()
+        self.assertEqual(b''.join(bytes(frame.data) for frame in sent), body[65535:66535])
+        data += body[65535:66535]
+
+        peer.connection.process_bytes(self.window_update(0, 1 << 20))
+        sent = peer.sent_frames()
+        data += b''.join(bytes(frame.data) for frame in sent)
+        # The stream window ran out before the end
+        self.assertEqual(len(data), 165535)
+        self.assertFalse(sent[-1].is_flag_set(frames.data_flags.END_STREAM))
+
+        peer.connection.process_bytes(self.window_update(1, 1 << 20))
+        sent = peer.sent_frames()
+        data += b''.join(bytes(frame.data) for frame in sent)
+        self.assertEqual(data, body)
+        self.assertTrue(sent[-1].is_flag_set(frames.data_flags.END_STREAM))
+
+    def test_initial_window_size_setting(self):
+        peer = Peer()
+        peer.request(b'x' * 100)
+        peer.connection.process_bytes(self.window_update(0, 1 << 20))
+
+        # Shrinking the initial window shrinks the window of open streams
+        # too; the SETTINGS frame gets acknowledged
+        peer.request(b'x' * 1000)
+        peer.sent_frames()
+        settings = struct.pack("!HI", frames.settings_identifiers.INITIAL_WINDOW_SIZE, 10)
+        peer.connection.process_bytes(raw_frame(frames.frame_type.SETTINGS, 0x0, 0, settings))
+        self.assertEqual(peer.connection.streams[3].send_window, 10 - 1000)
+        sent = peer.sent_frames()
+        self.assertEqual(len(sent), 1)
+        self.assertTrue(sent[0].is_flag_set(frames.settings_flags.ACK))
+
+        peer.request(b'x' * 1000)
+        sent = peer.sent_frames()
+        self.assertEqual(len(sent[1].data), 10)
+
+        # Too large a window is a connection error
+        settings = struct.pack("!HI", frames.settings_identifiers.INITIAL_WINDOW_SIZE, 1 << 31)
+        peer.connection.process_bytes(raw_frame(frames.frame_type.SETTINGS, 0x0, 0, settings))
+        sent = peer.sent_frames()
+        self.assertEqual(sent[-1].frame_type, frames.frame_type.GOAWAY)
+        self.assertEqual(sent[-1].error_code, frames.error.FLOW_CONTROL_ERROR)
+
+    def test_receive_window_updates(self):
+        peer = Peer()
+        peer.request()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x4, 1, b'\x88'))
+        peer.sent_frames()
+
+        chunk = b'x' * 16384
+        peer.connection.process_bytes(raw_frame(frames.frame_type.DATA, 0x0, 1, chunk))
+        self.assertEqual(peer.sent_frames(), [])
+        self.assertEqual(peer.connection.recv_window, 65535 - 16384)
+
+        # Half the window consumed, credit it back on both levels
+        peer.connection.process_bytes(raw_frame(frames.frame_type.DATA, 0x0, 1, chunk))
+        sent = peer.sent_frames()
+        self.assertEqual([(frame.stream_id, frame.window_size_increment) for frame in sent],
+                [(0, 32768), (1, 32768)])
+        self.assertEqual(peer.connection.recv_window, 65535)
+        self.assertEqual(peer.connection.streams[1].recv_window, 65535)
+
+    def test_receive_window_exceeded(self):
+        peer = Peer(streaming=True, auto_acknowledge=False)
+        peer.request()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x4, 1, b'\x88'))
+        peer.sent_frames()
+
+        chunk = b'x' * 16384
+        peer.connection.process_bytes(raw_frame(frames.frame_type.DATA, 0x0, 1, chunk) * 5)
+        sent = peer.sent_frames()
+        self.assertEqual(sent[-1].frame_type, frames.frame_type.GOAWAY)
+        self.assertEqual(sent[-1].error_code, frames.error.FLOW_CONTROL_ERROR)
+
+    def test_manual_acknowledge(self):
+        peer = Peer(streaming=True, auto_acknowledge=False, initial_window_size=1 << 20,
+                connection_window_size=1 << 20)
+        sent = peer.sent_frames()
+        self.assertEqual(sent[0].params, {frames.settings_identifiers.INITIAL_WINDOW_SIZE: 1 << 20})
+        self.assertEqual(sent[1].window_size_increment, (1 << 20) - 65535)
+
+        peer.request()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x4, 1, b'\x88'))
+        peer.sent_frames()
+        for _ in range(40):
+            peer.connection.process_bytes(raw_frame(frames.frame_type.DATA, 0x0, 1, b'x' * 16384))
+        # Nothing is credited back until the application says so
+        self.assertEqual(peer.sent_frames(), [])
+
+        peer.connection.acknowledge_data(1, 40 * 16384)
+        sent = peer.sent_frames()
+        self.assertEqual([(frame.stream_id, frame.window_size_increment) for frame in sent],
+                [(0, 40 * 16384), (1, 40 * 16384)])
+
+    def test_ping(self):
+        peer = Peer()
+        peer.sent_frames()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.PING, 0x0, 0, b'pingpong'))
+        sent = peer.sent_frames()
+        self.assertEqual(len(sent), 1)
+        self.assertTrue(sent[0].is_flag_set(frames.ping_flags.ACK))
+        self.assertEqual(sent[0].data, b'pingpong')
+
+    def test_autotune(self):
+        peer = Peer(autotune_window=True)
+        peer.request()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x4, 1, b'\x88'))
+        peer.sent_frames()
+
+        # The first DATA frame starts a round trip measurement
+        peer.connection.process_bytes(raw_frame(frames.frame_type.DATA, 0x0, 1, b'x' * 16384))
+        sent = peer.sent_frames()
+        self.assertEqual(sent[0].frame_type, frames.frame_type.PING)
+        self.assertEqual(sent[0].data, connection.bdp_ping_data)
+
+        # Most of the window arrived within the round trip, so the windows
+        # are doubled
+        for _ in range(3):
+            peer.connection.process_bytes(raw_frame(frames.frame_type.DATA, 0x0, 1, b'x' * 16384))
+        peer.sent_frames()
+        ping_ack = raw_frame(frames.frame_type.PING, 0x1, 0, connection.bdp_ping_data)
+        peer.connection.process_bytes(ping_ack)
+        sent = peer.sent_frames()
+        self.assertEqual(sent[0].params, {frames.settings_identifiers.INITIAL_WINDOW_SIZE: 4 * 16384 * 2})
+        self.assertEqual(sent[1].stream_id, 0)
+        self.assertEqual(sent[1].window_size_increment, 4 * 16384 * 2 - 65535)
+        self.assertEqual(peer.connection.local_settings[frames.settings_identifiers.INITIAL_WINDOW_SIZE], 4 * 16384 * 2)
+        self.assertIsNotNone(peer.connection.rtt)
+
+if __name__ == '__main__':
+    unittest.main()
+
+class TestSettings(unittest.TestCase):
+
+    def settings(self, identifier, value):
+        return raw_frame(frames.frame_type.SETTINGS, 0x0, 0, struct.pack("!HI", identifier, value))
+
+    def test_max_frame_size(self):
+        peer = Peer()
+        peer.connection.process_bytes(self.settings(frames.settings_identifiers.MAX_FRAME_SIZE, 1 << 20))
+        peer.connection.process_bytes(raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, 0, (4 << 20).to_bytes(4, 'big')))
+        peer.connection.process_bytes(self.settings(frames.settings_identifiers.INITIAL_WINDOW_SIZE, 4 << 20))
+        peer.sent_frames()
+
+        # DATA goes out in frames as large as the peer allows
+        body = b'x' * (3 << 20)
+        peer.request(body)
+        sent = peer.sent_frames()
+        self.assertEqual([len(frame.data) for frame in sent[1:]], [1 << 20] * 3)
+
+    def test_header_block_continuation(self):
+        peer = Peer()
+        peer.sent_frames()
+        headers = {":method": "GET", ":scheme": "https", ":path": "/", ":authority": "localhost",
+                "x-large": "x" * 40000}
+        peer.connection.send_request(headers)
+
+        # The header block is split over CONTINUATION frames, and only the
+        # last one ends the headers
+        sent = peer.sent_frames()
+        self.assertEqual([frame.frame_type for frame in sent],
+                [frames.frame_type.HEADERS, frames.frame_type.CONTINUATION, frames.frame_type.CONTINUATION])
+        self.assertTrue(sent[0].is_flag_set(frames.headers_flags.END_STREAM))
+        self.assertFalse(sent[0].is_flag_set(frames.headers_flags.END_HEADERS))
+        self.assertFalse(sent[1].is_flag_set(frames.headers_flags.END_HEADERS))
+        self.assertTrue(sent[2].is_flag_set(frames.headers_flags.END_HEADERS))
+
+        header_block = b''.join(bytes(frame.header_block_fragment) for frame in sent)
+        self.assertEqual(len(sent[0].header_block_fragment), 16384)
+        self.assertEqual(connection.hpack.hpack.ctx().decode_headers(header_block), headers)
+
+    def test_continuation_sequence(self):
+        for interloper in [raw_frame(frames.frame_type.PING, 0x0, 0, b'12345678'),
+                raw_frame(frames.frame_type.DATA, 0x0, 1, b'data'),
+                raw_frame(frames.frame_type.CONTINUATION, 0x4, 3, b'\x88')]:
+            peer = Peer()
+            peer.request()
+            peer.request()
+            peer.sent_frames()
+            # ':status: 200' is static table index 8, 'accept' index 19
+            peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x0, 1, b'\x88'))
+            peer.connection.process_bytes(interloper + raw_frame(frames.frame_type.CONTINUATION, 0x5, 1, b'\x93'))
+            sent = peer.sent_frames()
+            self.assertEqual([frame.frame_type for frame in sent], [frames.frame_type.GOAWAY])
+            self.assertEqual(sent[0].error_code, frames.error.PROTOCOL_ERROR)
+            self.assertEqual(peer.messages, [])
+
+        # CONTINUATION frames without a header block to continue
+        peer = Peer()
+        peer.request()
+        peer.sent_frames()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x4, 1, b'\x88'))
+        peer.connection.process_bytes(raw_frame(frames.frame_type.CONTINUATION, 0x4, 1, b'\x93'))
+        sent = peer.sent_frames()
+        self.assertEqual(sent[-1].frame_type, frames.frame_type.GOAWAY)
+        self.assertEqual(sent[-1].error_code, frames.error.PROTOCOL_ERROR)
+
+        # Frames after the block ends are fine
+        peer = Peer()
+        peer.request()
+        peer.sent_frames()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x0, 1, b'\x88')
+                + raw_frame(frames.frame_type.CONTINUATION, 0x4, 1, b'\x93')
+                + raw_frame(frames.frame_type.PING, 0x0, 0, b'12345678')
+                + raw_frame(frames.frame_type.DATA, 0x1, 1, b'data'))
+        sent = peer.sent_frames()
+        self.assertNotIn(frames.frame_type.GOAWAY, [frame.frame_type for frame in sent])
+        self.assertEqual(len(peer.messages), 1)
+        self.assertEqual(peer.messages[0].headers, {":status": "200", "accept": ""})
+        self.assertEqual(peer.messages[0].data, b'data')
+
+    def test_header_table_size(self):
+        peer = Peer()
+        peer.connection.send_request({":method": "GET", ":scheme": "https", ":path": "/", ":authority": "localhost"})
+        peer.connection.process_bytes(self.settings(frames.settings_identifiers.HEADERS_TABLE_SIZE, 0))
+        peer.sent_frames()
+
+        # The next header block announces the new size, and nothing gets
+        # indexed any more
+        peer.connection.send_request({":method": "GET", ":scheme": "https", ":path": "/", ":authority": "localhost"})
+        sent = peer.sent_frames()
+        self.assertEqual(bytes(sent[0].header_block_fragment[:1]), b'\x20')
+        self.assertEqual(peer.connection.hpack_ctx.table_encode.dynamic_size(), 0)
+
+    def test_invalid_settings(self):
+        for identifier,value in [(frames.settings_identifiers.MAX_FRAME_SIZE, 1000),
+                (frames.settings_identifiers.MAX_FRAME_SIZE, 1 << 24),
+                (frames.settings_identifiers.ENABLE_PUSH, 2)]:
+            peer = Peer()
+            peer.sent_frames()
+            peer.connection.process_bytes(self.settings(identifier, value))
+            sent = peer.sent_frames()
+            self.assertEqual(sent[-1].frame_type, frames.frame_type.GOAWAY)
+            self.assertEqual(sent[-1].error_code, frames.error.PROTOCOL_ERROR)
+
+    def test_unknown_setting_ignored(self):
+        peer = Peer()
+        peer.sent_frames()
+        peer.connection.process_bytes(self.settings(0x99, 1))
+        sent = peer.sent_frames()
+        self.assertEqual(len(sent), 1)
+        self.assertTrue(sent[0].is_flag_set(frames.settings_flags.ACK))
+
+    def test_frame_too_large(self):
+        peer = Peer()
+        peer.sent_frames()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.PING, 0x0, 0, b'x' * 16385))
+        sent = peer.sent_frames()
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0].error_code, frames.error.FRAME_SIZE_ERROR)
+
+        # A larger limit is advertised to the peer
+        peer = Peer(max_frame_size=1 << 16)
+        self.assertEqual(peer.connection.local_settings[frames.settings_identifiers.MAX_FRAME_SIZE], 1 << 16)
+
+    def test_malformed_frames(self):
+        for encoded, error in [
+                (raw_frame(frames.frame_type.PRIORITY, 0x0, 1, b'\x00'), frames.error.FRAME_SIZE_ERROR),
+                (raw_frame(frames.frame_type.HEADERS, 0x20 | 0x4, 1, b'\x88'), frames.error.FRAME_SIZE_ERROR),
+                (raw_frame(frames.frame_type.SETTINGS, 0x0, 0, b'\x00\x04\x00'), frames.error.FRAME_SIZE_ERROR),
+                (raw_frame(frames.frame_type.SETTINGS, 0x1, 0, b'\x00\x00\x00\x00\x00\x00'), frames.error.FRAME_SIZE_ERROR),
+                (raw_frame(frames.frame_type.DATA, 0x8, 1, b'\x10data'), frames.error.PROTOCOL_ERROR)]:
+            peer = Peer()
+            peer.request()
+            peer.sent_frames()
+            recv_window = peer.connection.recv_window
+            peer.connection.process_bytes(encoded)
+            sent = peer.sent_frames()
+            self.assertEqual(len(sent), 1)
+            self.assertEqual(sent[0].frame_type, frames.frame_type.GOAWAY)
+            self.assertEqual(sent[0].error_code, error)
+            # Nothing of the frame was processed
+            self.assertEqual(peer.connection.recv_window, recv_window)
+            self.assertEqual(peer.messages, [])
+
+    def test_max_header_list_size(self):
+        peer = Peer(max_header_list_size=100)
+        self.assertEqual(peer.connection.local_settings[frames.settings_identifiers.MAX_HEADER_LIST_SIZE], 100)
+        peer.request()
+        peer.sent_frames()
+
+        # The response's header block is refused while it's still coming in,
+        # which leaves the decoder out of step for good
+        block = b'\x88\x40\x07x-large\x7f\x81\x07' + b'x' * 1000
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x0, 1, block[:8]))
+        peer.connection.process_bytes(raw_frame(frames.frame_type.CONTINUATION, 0x0, 1, block[8:500]))
+        sent = peer.sent_frames()
+        self.assertEqual(sent[-1].frame_type, frames.frame_type.GOAWAY)
+        self.assertEqual(sent[-1].error_code, frames.error.COMPRESSION_ERROR)
+        self.assertEqual(peer.messages, [])
+
+    def test_malformed_header_block(self):
+        peer = Peer()
+        peer.request()
+        peer.sent_frames()
+        # Index 70 isn't in either table
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x4, 1, b'\xc6'))
+        sent = peer.sent_frames()
+        self.assertEqual(sent[-1].frame_type, frames.frame_type.GOAWAY)
+        self.assertEqual(sent[-1].error_code, frames.error.COMPRESSION_ERROR)
+
+class TestWrites(unittest.TestCase):
+
+    def blocked_streams(self, peer, count):
+        for _ in range(count):
+            peer.request(b'x' * 4096)
+        return raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, 0, (count * 4096).to_bytes(4, 'big'))
+
+    def test_writes_coalesced(self):
+        writes = []
+        peer = Peer()
+        peer.connection.callbacks['send'] = lambda data: writes.append(bytes(data)) or 0
+        window_update = self.blocked_streams(peer, 64)
+        self.assertEqual(len(writes), 64)
+
+        # Every stream the window update unblocks sends its body, and the
+        # settings get acknowledged, all in a single write
+        del writes[:]
+        settings = raw_frame(frames.frame_type.SETTINGS, 0x0, 0, b'')
+        peer.connection.process_bytes(settings + window_update)
+        self.assertEqual(len(writes), 1)
+        peer.sent = bytearray(writes[0])
+        sent = peer.sent_frames()
+        self.assertTrue(sent[0].is_flag_set(frames.settings_flags.ACK))
+        self.assertEqual(sum(len(frame.data) for frame in sent[1:]), 64 * 4096 - 65535)
+
+    def test_send_buffers(self):
+        buffers = []
+        peer = Peer()
+        peer.connection.callbacks['send_buffers'] = lambda data: buffers.append(data) or 0
+        body = bytearray(b'x' * 100)
+        peer.request(body)
+        self.assertEqual(len(buffers), 1)
+        peer.sent = bytearray(b''.join(buffers[0]))
+        self.assertEqual([frame.frame_type for frame in peer.sent_frames()],
+                [frames.frame_type.HEADERS, frames.frame_type.DATA])
+
+        # The body is passed on without being copied
+        self.assertEqual(len(buffers[0]), 3)
+        self.assertIs(buffers[0][2].obj, body)
+
+    def test_cork(self):
+        peer = Peer()
+        peer.sent_frames()
+        peer.connection.cork()
+        peer.request()
+        peer.request()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.PING, 0x0, 0, b'12345678'))
+        self.assertEqual(peer.sent_frames(), [])
+
+        peer.connection.uncork()
+        self.assertEqual([frame.frame_type for frame in peer.sent_frames()],
+                [frames.frame_type.HEADERS, frames.frame_type.HEADERS, frames.frame_type.PING])
+
+class TestStreamLifetime(unittest.TestCase):
+
+    def get(self, peer):
+        peer.connection.send_request({":method": "GET", ":scheme": "https", ":path": "/", ":authority": "localhost"})
+
+    def test_closed_streams_retired(self):
+        peer = Peer()
+        self.get(peer)
+        self.get(peer)
+        self.assertEqual(sorted(peer.connection.streams), [1, 3])
+
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x5, 1, b'\x88'))
+        self.assertEqual(len(peer.messages), 1)
+        self.assertEqual(sorted(peer.connection.streams), [3])
+
+        # A reset stream is retired as well
+        peer.connection.process_bytes(raw_frame(frames.frame_type.RST_STREAM, 0x0, 3, b'\x00\x00\x00\x08'))
+        self.assertEqual(peer.connection.streams, {})
+
+    def test_frames_on_closed_streams(self):
+        peer = Peer()
+        self.get(peer)
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x5, 1, b'\x88'))
+        peer.sent_frames()
+
+        # Late WINDOW_UPDATE and RST_STREAM frames are ignored
+        peer.connection.process_bytes(
+                raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, 1, b'\x00\x00\x01\x00') +
+                raw_frame(frames.frame_type.RST_STREAM, 0x0, 1, b'\x00\x00\x00\x08'))
+        self.assertEqual(peer.sent_frames(), [])
+
+        # DATA and HEADERS get the stream reset, and the header block is
+        # still decoded ('custom-key: custom-header', incremental indexing)
+        peer.connection.process_bytes(
+                raw_frame(frames.frame_type.DATA, 0x1, 1, b'late') +
+                raw_frame(frames.frame_type.HEADERS, 0x5, 1, b'\x40\x0acustom-key\x0dcustom-header'))
+        sent = peer.sent_frames()
+        self.assertEqual([(frame.frame_type, frame.stream_id, frame.error_code) for frame in sent], [
+                (frames.frame_type.RST_STREAM, 1, frames.error.STREAM_CLOSED),
+                (frames.frame_type.RST_STREAM, 1, frames.error.STREAM_CLOSED),
+            ])
+        self.assertEqual(peer.connection.hpack_ctx.table_decode.find_field_by_index(62).name, 'custom-key')
+        self.assertEqual(peer.messages[1:], [])
+
+    def test_frames_on_idle_streams(self):
+        for encoded in [raw_frame(frames.frame_type.DATA, 0x0, 3, b'data'),
+                raw_frame(frames.frame_type.DATA, 0x0, 2, b'data'),
+                raw_frame(frames.frame_type.HEADERS, 0x5, 0, b'\x88')]:
+            peer = Peer()
+            self.get(peer)
+            peer.sent_frames()
+            peer.connection.process_bytes(encoded)
+            sent = peer.sent_frames()
+            self.assertEqual(sent[-1].frame_type, frames.frame_type.GOAWAY)
+            self.assertEqual(sent[-1].error_code, frames.error.PROTOCOL_ERROR)
+
+    def test_max_concurrent_streams(self):
+        peer = Peer(max_pending_requests=3)
+        settings = struct.pack("!HI", frames.settings_identifiers.MAX_CONCURRENT_STREAMS, 2)
+        peer.connection.process_bytes(raw_frame(frames.frame_type.SETTINGS, 0x0, 0, settings))
+        peer.sent_frames()
+
+        # Requests past the limit wait, up to max_pending_requests of them
+        handles = [peer.connection.send_request({":method": "GET", ":scheme": "https", ":path": "/{:d}".format(idx), ":authority": "localhost"},
+                tag=idx) for idx in range(6)]
+        self.assertIsNone(handles[5])
+        self.assertEqual([handle.tag for handle in handles[:5]], [0, 1, 2, 3, 4])
+        self.assertEqual([handle.stream_id for handle in handles[:5]], [1, 3, None, None, None])
+        self.assertEqual([frame.stream_id for frame in peer.sent_frames()], [1, 3])
+        self.assertEqual(len(peer.connection.pending_requests), 3)
+
+        # Each stream that closes lets the next request go out, in order,
+        # and its handle learns the stream's id
+        peer.connection.process_bytes(raw_frame(frames.frame_type.HEADERS, 0x5, 1, b'\x88'))
+        sent = peer.sent_frames()
+        self.assertEqual([frame.stream_id for frame in sent], [5])
+        self.assertEqual([handle.stream_id for handle in handles[:5]], [1, 3, 5, None, None])
+        self.assertEqual([request[0][":path"] for request in peer.connection.pending_requests], ["/3", "/4"])
+
+        # So does raising the limit
+        settings = struct.pack("!HI", frames.settings_identifiers.MAX_CONCURRENT_STREAMS, 10)
+        peer.connection.process_bytes(raw_frame(frames.frame_type.SETTINGS, 0x0, 0, settings))
+        self.assertEqual([frame.stream_id for frame in peer.sent_frames()[1:]], [7, 9])
+        self.assertEqual([handle.stream_id for handle in handles[:5]], [1, 3, 5, 7, 9])
+        self.assertEqual(len(peer.connection.pending_requests), 0)
+        self.assertEqual(peer.connection.local_stream_count, 4)
+
+    def test_soak(self):
+        peer = Peer()
+        response = b'\x88'
+
+        def exchange(count):
+            for _ in range(count):
+                stream_id = peer.connection.next_stream_id
+                peer.request(b'x' * 100)
+                peer.connection.process_bytes(raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, 0, b'\x00\x00\x00\x64') +
+                        raw_frame(frames.frame_type.HEADERS, 0x4, stream_id, response) +
+                        raw_frame(frames.frame_type.DATA, 0x1, stream_id, b'y' * 100))
+                peer.sent_frames()
+            del peer.messages[:]
+
+        # Memory stays flat however many requests the connection carries
+        exchange(1000)
+        tracemalloc.start()
+        exchange(100)
+        gc.collect()
+        before = tracemalloc.get_traced_memory()[0]
+        exchange(2000)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        self.assertEqual(peer.connection.streams, {})
+        # Keeping a stream per request would be 2000 of them
+        self.assertLess(after - before, 65536)
+
+class TestPriority(unittest.TestCase):
+
+    def open_windows(self, peer):
+        settings = struct.pack("!HI", frames.settings_identifiers.INITIAL_WINDOW_SIZE, 1 << 24)
+        peer.connection.process_bytes(raw_frame(frames.frame_type.SETTINGS, 0x0, 0, settings))
+
+    def test_interleaving(self):
+        peer = Peer()
+        self.open_windows(peer)
+
+        # Both bodies are held back by the connection window, then go out
+        # together
+        peer.request(b'x' * 65535)
+        peer.connection.send_request({":method": "POST", ":scheme": "https", ":path": "/large", ":authority": "localhost"}, b'l' * (1 << 20))
+        peer.connection.send_request({":method": "POST", ":scheme": "https", ":path": "/small", ":authority": "localhost"}, b's' * 65536, weight=64)
+        peer.sent_frames()
+        peer.connection.process_bytes(raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, 0, (2 << 20).to_bytes(4, 'big')))
+
+        # With four times the weight, the small request gets four frames for
+        # every one of the large one's, and is done long before it
+        order = [frame.stream_id for frame in peer.sent_frames()]
+        self.assertEqual(order[:6], [3, 5, 5, 5, 5, 3])
+        self.assertEqual(order.count(5), 4)
+        self.assertEqual(order.count(3), 64)
+
+    def test_priority_sent(self):
+        peer = Peer()
+        peer.sent_frames()
+        peer.request()
+        peer.connection.send_request({":method": "GET", ":scheme": "https", ":path": "/", ":authority": "localhost"},
+                depends_on=1, weight=256, exclusive=True)
+        sent = peer.sent_frames()
+        self.assertFalse(sent[0].has_priority())
+        self.assertTrue(sent[1].has_priority())
+        self.assertEqual((sent[1].stream_dependency, sent[1].weight, sent[1].exclusive_dependency), (1, 255, True))
+        self.assertEqual(peer.connection.priority.nodes[3].parent.stream_id, 1)
+        self.assertEqual(peer.connection.priority.nodes[3].weight, 256)
+
+    def test_priority_frames(self):
+        peer = Peer()
+        peer.request()
+        peer.request()
+        peer.sent_frames()
+
+        # Stream 1 is made to depend on stream 3, with weight 32
+        peer.connection.process_bytes(raw_frame(frames.frame_type.PRIORITY, 0x0, 1, b'\x00\x00\x00\x03\x1f'))
+        self.assertEqual(peer.connection.priority.nodes[1].parent.stream_id, 3)
+        self.assertEqual(peer.connection.priority.nodes[1].weight, 32)
+        self.assertEqual(peer.sent_frames(), [])
+
+        # A stream can't depend on itself
+        peer.connection.process_bytes(raw_frame(frames.frame_type.PRIORITY, 0x0, 3, b'\x00\x00\x00\x03\x1f'))
+        sent = peer.sent_frames()
+        self.assertEqual([(frame.frame_type, frame.stream_id, frame.error_code) for frame in sent],
+                [(frames.frame_type.RST_STREAM, 3, frames.error.PROTOCOL_ERROR)])
+        self.assertNotIn(3, peer.connection.streams)
+        self.assertEqual(peer.connection.priority.nodes[1].parent.stream_id, 0)
+
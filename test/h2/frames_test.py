@@ -0,0 +1,147 @@
+import unittest
+import struct
+from h2 import frames
+
+def raw_frame(frame_type, flags, stream_id, payload):
+    return struct.pack("!BHBBI", len(payload) >> 16, len(payload) & 0xffff,
+            frame_type, flags, stream_id) + payload
+
+class TestFrames(unittest.TestCase):
+
+    def test_decode_data_frame_is_view(self):
+        encoded = bytearray(raw_frame(frames.frame_type.DATA, 0x1, 3, b'hello') + raw_frame(frames.frame_type.DATA, 0x0, 3, b'world'))
+
+        frame, bytes_read = frames.frame.decode_static(encoded)
+        self.assertEqual(bytes_read, 14)
+        self.assertEqual(frame.frame_type, frames.frame_type.DATA)
+        self.assertEqual(frame.stream_id, 3)
+        self.assertTrue(frame.is_flag_set(frames.data_flags.END_STREAM))
+        # The payload is a view bounded to this frame, not a copy of the rest
+        # of the buffer
+        self.assertIsInstance(frame.data, memoryview)
+        self.assertEqual(frame.data, b'hello')
+        encoded[9] = ord('j')
+        self.assertEqual(frame.data, b'jello')
+        frame.data.release()
+
+        frame, bytes_read = frames.frame.decode_static(encoded, 14)
+        self.assertEqual(bytes_read, 14)
+        self.assertEqual(frame.data, b'world')
+
+    def test_decode_padded_frames(self):
+        encoded = raw_frame(frames.frame_type.DATA, 0x8, 1, b'\x03data\x00\x00\x00')
+        frame, bytes_read = frames.frame.decode_static(encoded)
+        self.assertEqual(bytes_read, len(encoded))
+        self.assertEqual(frame.data, b'data')
+
+        encoded = raw_frame(frames.frame_type.HEADERS, 0x4 | 0x8 | 0x20, 1,
+                b'\x02\x80\x00\x00\x05\x0f\x82\x84\x00\x00')
+        frame, bytes_read = frames.frame.decode_static(encoded)
+        self.assertTrue(frame.exclusive_dependency)
+        self.assertEqual(frame.stream_dependency, 5)
+        self.assertEqual(frame.weight, 15)
+        self.assertEqual(frame.header_block_fragment, b'\x82\x84')
+
+    def test_decode_incomplete_frame(self):
+        encoded = raw_frame(frames.frame_type.DATA, 0x0, 1, b'data')
+        frame, error = frames.frame.decode_static(encoded[:-1])
+        self.assertIsNone(frame)
+        self.assertEqual(error, frames.decoding_error.FRAME_TOO_SMALL)
+
+        frame, error = frames.frame.decode_static(encoded[:5])
+        self.assertIsNone(frame)
+        self.assertEqual(error, frames.decoding_error.FRAME_TOO_SMALL)
+
+    def test_decode_control_frames(self):
+        encoded = raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, 0, b'\x80\x00\x10\x00')
+        frame, _ = frames.frame.decode_static(encoded)
+        self.assertEqual(frame.window_size_increment, 0x1000)
+
+        encoded = raw_frame(frames.frame_type.GOAWAY, 0x0, 0, b'\x00\x00\x00\x07\x00\x00\x00\x01bye')
+        frame, _ = frames.frame.decode_static(encoded)
+        self.assertEqual(frame.last_stream_id, 7)
+        self.assertEqual(frame.error_code, frames.error.PROTOCOL_ERROR)
+        self.assertEqual(frame.debug_data, b'bye')
+
+        encoded = raw_frame(frames.frame_type.PUSH_PROMISE, 0x4, 1, b'\x00\x00\x00\x02\x82')
+        frame, _ = frames.frame.decode_static(encoded)
+        self.assertEqual(frame.promised_stream, 2)
+        self.assertEqual(frame.header_block_fragment, b'\x82')
+
+    def test_decode_malformed_frames(self):
+        size_error = frames.decoding_error.FRAME_SIZE_ERROR
+        protocol_error = frames.decoding_error.PROTOCOL_ERROR
+        for encoded, expected in [
+                (raw_frame(frames.frame_type.PRIORITY, 0x0, 1, b'\x00\x00\x00'), size_error),
+                (raw_frame(frames.frame_type.HEADERS, 0x20, 1, b'\x82'), size_error),
+                (raw_frame(frames.frame_type.HEADERS, 0x8, 1, b''), size_error),
+                (raw_frame(frames.frame_type.SETTINGS, 0x0, 0, b'\x00\x04\x00\x00\x00'), size_error),
+                (raw_frame(frames.frame_type.SETTINGS, 0x1, 0, b'\x00\x04\x00\x00\x00\x01'), size_error),
+                (raw_frame(frames.frame_type.RST_STREAM, 0x0, 1, b'\x00'), size_error),
+                (raw_frame(frames.frame_type.PING, 0x0, 0, b'1234'), size_error),
+                (raw_frame(frames.frame_type.WINDOW_UPDATE, 0x0, 0, b'\x00\x00\x01'), size_error),
+                (raw_frame(frames.frame_type.GOAWAY, 0x0, 0, b'\x00\x00\x00\x00'), size_error),
+                (raw_frame(frames.frame_type.PUSH_PROMISE, 0x4, 1, b'\x00\x02'), size_error),
+                (raw_frame(frames.frame_type.DATA, 0x8, 1, b''), size_error),
+                (raw_frame(frames.frame_type.DATA, 0x8, 1, b'\x05data'), protocol_error),
+                (raw_frame(frames.frame_type.HEADERS, 0x8 | 0x20, 1, b'\x01\x00\x00\x00\x03\x0f'), protocol_error),
+                (raw_frame(frames.frame_type.PUSH_PROMISE, 0x8, 1, b'\x02\x00\x00\x00\x02\x82'), protocol_error)]:
+            frame, error = frames.frame.decode_static(encoded)
+            self.assertIsNone(frame)
+            self.assertEqual(error, expected)
+
+        # Padding can take up everything after the padding length
+        frame, _ = frames.frame.decode_static(raw_frame(frames.frame_type.DATA, 0x8, 1, b'\x04data'))
+        self.assertEqual(frame.data, b'')
+
+    def test_encode_into(self):
+        encoded = bytearray(64)
+        frame = frames.data_frame(3, b'hello')
+        frame.set_flag(frames.data_flags.END_STREAM)
+        self.assertEqual(frame.encode_into(encoded, 10), 14)
+        self.assertEqual(encoded[10:24], raw_frame(frames.frame_type.DATA, 0x1, 3, b'hello'))
+        self.assertEqual(frame.header_bytes(), raw_frame(frames.frame_type.DATA, 0x1, 3, b'hello')[:9])
+        self.assertEqual(frame.encode(), raw_frame(frames.frame_type.DATA, 0x1, 3, b'hello'))
+
+    def test_encode_round_trip(self):
+        padded = frames.data_frame(1 << 20, b'data')
+        padded.set_flag(frames.data_flags.PADDED)
+        padded.pad_length = 3
+        headers = frames.headers_frame(5, b'\x82\x84')
+        headers.set_flag(frames.headers_flags.PADDED | frames.headers_flags.PRIORITY | frames.headers_flags.END_HEADERS)
+        headers.pad_length = 2
+        headers.exclusive_dependency = True
+        headers.stream_dependency = 3
+        headers.weight = 15
+        push_promise = frames.push_promise_frame(1, 2, b'\x82')
+        push_promise.set_flag(frames.push_promise_flags.PADDED)
+        push_promise.pad_length = 1
+        settings = frames.settings_frame()
+        settings.set_param(frames.settings_identifiers.MAX_FRAME_SIZE, 1 << 20)
+        goaway = frames.goaway_frame(error=frames.error.PROTOCOL_ERROR, debug_data=b'bye')
+
+        for frame in [padded, headers, push_promise, settings, goaway,
+                frames.ping_frame(0, b'12345678'), frames.window_update_frame(1, 100),
+                frames.rst_stream_frame(1, frames.error.CANCEL), frames.priority_frame(1, True, 3, 15),
+                frames.continuation_frame(1, b'\x82')]:
+            encoded = frame.encode()
+            self.assertEqual(len(encoded), 9 + frame.payload_length())
+            decoded, bytes_read = frames.frame.decode_static(encoded)
+            self.assertEqual(bytes_read, len(encoded))
+            self.assertEqual(decoded.frame_type, frame.frame_type)
+            self.assertEqual(decoded.stream_id, frame.stream_id)
+            self.assertEqual(decoded.encode(), encoded)
+
+        self.assertEqual(padded.encode()[-3:], b'\x00\x00\x00')
+        decoded, _ = frames.frame.decode_static(push_promise.encode())
+        self.assertEqual(decoded.promised_stream, 2)
+        self.assertEqual(decoded.header_block_fragment, b'\x82')
+
+    def test_frames_have_slots(self):
+        for frame_class in frames.frame.frame_map:
+            frame = frame_class()
+            self.assertFalse(hasattr(frame, '__dict__'))
+            self.assertEqual(frames.frame.frame_map[frame.frame_type], frame_class)
+
+if __name__ == '__main__':
+    unittest.main()
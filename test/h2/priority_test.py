@@ -0,0 +1,89 @@
+import unittest
+from h2 import priority
+
+class TestPriority(unittest.TestCase):
+
+    def schedule(self, tree, count, length=1000):
+        # Sends count frames and returns how many each stream got
+        sent = {}
+        for _ in range(count):
+            stream_id = tree.next_stream()
+            sent[stream_id] = sent.get(stream_id, 0) + 1
+            tree.sent(stream_id, length)
+        return sent
+
+    def test_weights(self):
+        tree = priority.priority_tree()
+        tree.insert(1, weight=64)
+        tree.insert(3, weight=192)
+        tree.insert(5, weight=256)
+        self.assertIsNone(tree.next_stream())
+        tree.set_ready(1, True)
+        tree.set_ready(3, True)
+        self.assertEqual(self.schedule(tree, 400), {1: 100, 3: 300})
+
+        # A stream that becomes ready later doesn't get to catch up
+        tree.set_ready(5, True)
+        self.assertEqual(self.schedule(tree, 512), {1: 64, 3: 192, 5: 256})
+
+    def test_dependencies(self):
+        tree = priority.priority_tree()
+        tree.insert(1)
+        tree.insert(3, depends_on=1)
+        tree.insert(5, depends_on=1)
+        for stream_id in [1, 3, 5]:
+            tree.set_ready(stream_id, True)
+
+        # Dependents only send while the stream they depend on can't
+        self.assertEqual(self.schedule(tree, 10), {1: 10})
+        tree.set_ready(1, False)
+        self.assertEqual(self.schedule(tree, 10), {3: 5, 5: 5})
+
+        # Their weights are shared out when it goes away
+        tree.insert(7, depends_on=1, weight=32)
+        tree.remove(1)
+        self.assertEqual([(node.stream_id, node.weight) for node in tree.root.children], [(3, 4), (5, 4), (7, 8)])
+        tree.set_ready(7, True)
+        self.assertEqual(self.schedule(tree, 40), {3: 10, 5: 10, 7: 20})
+
+    def test_exclusive(self):
+        tree = priority.priority_tree()
+        tree.insert(1)
+        tree.insert(3)
+        tree.set_ready(1, True)
+        tree.insert(5, exclusive=True)
+        tree.set_ready(5, True)
+        self.assertEqual([node.stream_id for node in tree.root.children], [5])
+        self.assertEqual([node.stream_id for node in tree.nodes[5].children], [1, 3])
+        self.assertEqual(self.schedule(tree, 3), {5: 3})
+        tree.set_ready(5, False)
+        self.assertEqual(self.schedule(tree, 3), {1: 3})
+
+    def test_reprioritize(self):
+        tree = priority.priority_tree()
+        tree.insert(1)
+        tree.insert(3, depends_on=1)
+        tree.insert(5, depends_on=3)
+        tree.set_ready(5, True)
+
+        # Moving a stream below its own dependent moves the dependent up
+        # first (RFC 7540 section 5.3.3)
+        tree.reprioritize(1, depends_on=5, weight=100)
+        self.assertEqual([node.stream_id for node in tree.root.children], [5])
+        self.assertEqual([node.stream_id for node in tree.nodes[5].children], [1])
+        self.assertEqual([node.stream_id for node in tree.nodes[1].children], [3])
+        self.assertEqual(tree.nodes[1].weight, 100)
+        self.assertEqual(tree.next_stream(), 5)
+
+        # Depending on an unknown stream gives the default priority
+        tree.reprioritize(3, depends_on=99, weight=200)
+        self.assertEqual(tree.nodes[3].parent, tree.root)
+        self.assertEqual(tree.nodes[3].weight, priority.default_weight)
+
+        self.assertEqual(tree.root.active_count, 1)
+        tree.remove(5)
+        self.assertEqual(tree.root.active_count, 0)
+        self.assertIsNone(tree.next_stream())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,6 +24,21 @@ class TestEncodeDecode(unittest.TestCase):
         self.assertEqual(encoded[1], 0xe1)
         self.assertEqual(encoded[2], 0x1f)
 
+    def test_encode_integer_into(self):
+        # Appends to what is there already, with the flags above the prefix
+        encoded = bytearray(b'\xff')
+        ed.encode_integer_into(encoded, 20, 5, 0x20)
+        ed.encode_integer_into(encoded, 4096, 5, 0x20)
+        ed.encode_integer_into(encoded, 1337, 8)
+        self.assertEqual(encoded, b'\xff\x34\x3f\xe1\x1f\xff\xba\x08')
+
+        self.assertRaises(Exception, ed.encode_integer_into, bytearray(), 1, 0)
+        self.assertRaises(Exception, ed.encode_integer_into, bytearray(), 1, 9)
+
+        encoded = bytearray(b'\x00')
+        ed.encode_string_literal_into(encoded, b'test', True)
+        self.assertEqual(encoded, b'\x00\x83\x49\x50\x9f')
+
     def test_decode_integer(self):
         decoded = ed.decode_integer(b'\x14', 0, 5)
         self.assertEqual(decoded, (20, 1))
@@ -43,6 +58,18 @@ class TestEncodeDecode(unittest.TestCase):
         decoded = ed.decode_integer(b'\x00\x0f\x00\xff\xf0', 1, 4)
         self.assertEqual(decoded, (15, 2))
 
+    def test_decode_integer_limits(self):
+        decoded = ed.decode_integer(b'\x7f\x80\xff\xff\xff\x0f', 0, 7)
+        self.assertEqual(decoded, (ed.max_integer, 6))
+
+        # Too large, or too many continuation bytes to be anything but
+        # too large
+        self.assertRaises(Exception, ed.decode_integer, b'\x7f\x81\xff\xff\xff\x0f', 0, 7)
+        self.assertRaises(Exception, ed.decode_integer, b'\x7f' + b'\x80' * 100 + b'\x00', 0, 7)
+
+        self.assertRaises(Exception, ed.decode_integer, b'\x00', 0, 0)
+        self.assertRaises(Exception, ed.decode_integer, b'\x00', 0, 9)
+
     def test_encode_string_literal(self):
         encoded = ed.encode_string_literal("test")
         self.assertEqual(encoded, b'\x04test')
@@ -85,5 +112,53 @@ class TestEncodeDecode(unittest.TestCase):
         encoded = b'\xff\xff\xff\xff\xf0' + b'\xff\x81\x13' + (b'\x18\xc6\x31\x8c\x63' * (4096//8)) + b'\x0f\xff'
         self.assertEqual(ed.decode_string_literal(encoded, 5), (longstring, 3 + 5 * (4096//8)))
 
+    def test_decode_huffman_string_rfc_examples(self):
+        # Huffman encoded literals from RFC 7541 appendices C.4 and C.6
+        examples = [
+                ('www.example.com', 'f1e3c2e5f23a6ba0ab90f4ff'),
+                ('no-cache', 'a8eb10649cbf'),
+                ('custom-key', '25a849e95ba97d7f'),
+                ('custom-value', '25a849e95bb8e8b4bf'),
+                ('302', '6402'),
+                ('private', 'aec3771a4b'),
+                ('Mon, 21 Oct 2013 20:13:21 GMT', 'd07abe941054d444a8200595040b8166e082a62d1bff'),
+                ('https://www.example.com', '9d29ad171863c78f0b97c8e9ae82ae43d3'),
+                ('307', '640eff'),
+                ('gzip', '9bd9ab'),
+                ('foo=ASDJKHQKBZXOQWEOPIUAXQWEOIU; max-age=3600; version=1',
+                    '94e7821dd7f2e6c7b335dfdfcd5b3960d5af27087f3672c1ab270fb5291f9587316065c003ed4ee5b1063d5007'),
+            ]
+        for decoded, encoded in examples:
+            encoded = bytes.fromhex(encoded)
+            self.assertEqual(ed.decode_huffman_string(encoded, 0, len(encoded)), decoded)
+
+    def test_encode_huffman_string(self):
+        self.assertEqual(ed.encode_huffman_string(b''), b'')
+        self.assertEqual(ed.encode_huffman_string(b'www.example.com'), bytes.fromhex('f1e3c2e5f23a6ba0ab90f4ff'))
+        self.assertEqual(ed.encode_huffman_string(b'Mon, 21 Oct 2013 20:13:21 GMT'),
+                bytes.fromhex('d07abe941054d444a8200595040b8166e082a62d1bff'))
+
+        # Long strings and every byte value round trip
+        for string in [bytes(range(128)) * 4, b'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36' * 10]:
+            encoded = ed.encode_huffman_string(string)
+            self.assertEqual(ed.huffman_encoded_length(string), len(encoded))
+            self.assertEqual(ed.decode_huffman_string(encoded, 0, len(encoded)), string.decode('ascii'))
+
+        self.assertEqual(len(ed.encode_huffman_string(bytes(range(256)))), ed.huffman_encoded_length(bytes(range(256))))
+
+    def test_decode_huffman_string_invalid(self):
+        # Padding longer than 7 bits
+        with self.assertRaises(Exception):
+            ed.decode_huffman_string(b'\x49\x50\x9f\xff', 0, 4)
+        # Padding that isn't a prefix of EOS
+        with self.assertRaises(Exception):
+            ed.decode_huffman_string(b'\x49\x50\x98', 0, 3)
+        # Explicit EOS symbol
+        with self.assertRaises(Exception):
+            ed.decode_huffman_string(b'\xff\xff\xff\xff', 0, 4)
+
+        # Nothing but padding is fine as long as it's short enough
+        self.assertEqual(ed.decode_huffman_string(b'', 0, 0), '')
+
 if __name__ == '__main__':
     unittest.main()
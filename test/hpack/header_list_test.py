@@ -0,0 +1,58 @@
+import unittest
+from hpack import hpack
+from hpack import header_list
+
+class TestHeaderList(unittest.TestCase):
+
+    def encode(self, headers, index_opt=hpack.index_opts.WITHOUT):
+        ctx = hpack.ctx()
+        ctx.start_encode()
+        ctx.encode_header_list(headers, index_opt)
+        return ctx.end_encode()
+
+    def test_duplicates_kept_in_order(self):
+        headers = [(':status', '200'), ('set-cookie', 'a=1'), ('vary', 'accept'), ('set-cookie', 'b=2')]
+        decoded = hpack.ctx().decode_header_list(self.encode(headers))
+        self.assertEqual(list(decoded), headers)
+        self.assertEqual(len(decoded), 4)
+        self.assertEqual(decoded[-1], ('set-cookie', 'b=2'))
+        self.assertEqual(decoded.get('set-cookie'), 'a=1')
+        self.assertEqual(decoded.get_all('set-cookie'), ['a=1', 'b=2'])
+        self.assertEqual(decoded.get('link'), None)
+        self.assertTrue('vary' in decoded)
+        self.assertEqual(decoded.to_dict(), {':status': '200', 'set-cookie': 'b=2', 'vary': 'accept'})
+
+    def test_values_decoded_on_access(self):
+        headers = [('x-custom', 'value'), ('server', 'test')]
+        decoded = hpack.ctx().decode_header_list(self.encode(headers))
+        self.assertEqual([type(item) for item in decoded.fields],
+                [header_list.encoded_literal, header_list.encoded_literal, str, header_list.encoded_literal])
+        self.assertEqual(decoded.value(1), 'test')
+        self.assertEqual(type(decoded.fields[0]), header_list.encoded_literal)
+        self.assertEqual(type(decoded.fields[3]), str)
+
+        # Literals that go into the dynamic table are decoded straight away
+        ctx = hpack.ctx()
+        decoded = ctx.decode_header_list(self.encode(headers, hpack.index_opts.INCREMENTAL))
+        self.assertEqual([type(item) for item in decoded.fields], [str] * 4)
+
+    def test_bytes(self):
+        ctx = hpack.ctx(decode_bytes=True)
+        encoder = hpack.ctx()
+        headers = [(':method', 'GET'), ('x-custom', 'value')]
+        for _ in range(2):
+            encoder.start_encode()
+            encoder.encode_header_list(headers)
+            decoded = ctx.decode_header_list(encoder.end_encode())
+            self.assertEqual(list(decoded), [(b':method', b'GET'), (b'x-custom', b'value')])
+        self.assertEqual(ctx.decode_headers(self.encode([('x-other', 'v')])), {b'x-other': b'v'})
+
+    def test_malformed_literals(self):
+        # Literals are checked when the block is decoded, even though their
+        # strings aren't built until they're looked at
+        for block in [b'\x00\x01x\x81\x00', b'\x00\x01x\x83\xff\xfe\x6f', b'\x00\x01x\x01\xff', b'\x00\x81\x00\x01x']:
+            self.assertRaises(Exception, hpack.ctx().decode_header_list, block)
+
+        # Bytes don't have to be ascii
+        decoded = hpack.ctx(decode_bytes=True).decode_header_list(b'\x00\x01x\x83\xff\xfe\x6f\x00\x01y\x01\xff')
+        self.assertEqual(list(decoded), [(b'x', b'\x80'), (b'y', b'\xff')])
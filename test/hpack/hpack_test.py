@@ -68,6 +68,126 @@ class TestHpack(unittest.TestCase):
             encoded = ctx.end_encode()
             self.assertEqual(encoded, example.huffman_encoded)
 
+    def test_encode_with_shortest_huffman_encoding(self):
+        # Every literal in the examples is shorter when huffman encoded
+        ctx = hpack.ctx(huffman_encoding=hpack.huffman_opts.SHORTEST)
+        for example in TestHpack.examples:
+            ctx.start_encode()
+            ctx.encode_header_list(example.decoded)
+            self.assertEqual(ctx.end_encode(), example.huffman_encoded)
+
+        # A random looking token is longer when huffman encoded
+        token = 'Zx8}Q~v^Yk|R{jW'
+        ctx.start_encode()
+        ctx.encode_header('x-token', token, hpack.index_opts.WITHOUT)
+        encoded = ctx.end_encode()
+        self.assertEqual(encoded[-len(token)-1:], b'\x0f' + token.encode('ascii'))
+
+    def test_encode_with_fast_huffman_encoding(self):
+        ctx = hpack.ctx(huffman_encoding=hpack.huffman_opts.FAST, huffman_max_size=8)
+        self.assertTrue(ctx.use_huffman_encoding('no-cache'))
+        self.assertFalse(ctx.use_huffman_encoding('www.example.com'))
+        self.assertFalse(ctx.use_huffman_encoding('}~'))
+
+        # Whatever was chosen, the result decodes
+        headers = [('cache-control', 'no-cache'), (':authority', 'www.example.com'), ('x-token', '}~')]
+        ctx.start_encode()
+        ctx.encode_header_list(headers)
+        self.assertHeaderListMatchesDict(headers, hpack.ctx().decode_headers(ctx.end_encode()))
+
+    def test_encode_table_size_update(self):
+        encoder = hpack.ctx()
+        decoder = hpack.ctx()
+        headers = [('custom-key', 'custom-header')]
+        encoder.start_encode()
+        encoder.encode_header_list(headers)
+        decoder.decode_headers(encoder.end_encode())
+
+        # Shrinking and then growing the table announces both sizes
+        encoder.set_max_table_size_out(0)
+        encoder.set_max_table_size_out(1024)
+        encoder.start_encode()
+        encoder.encode_header_list(headers)
+        encoded = encoder.end_encode()
+        self.assertEqual(encoded[:4], b'\x20\x3f\xe1\x07')
+        self.assertHeaderListMatchesDict(headers, decoder.decode_headers(encoded))
+        self.assertEqual(decoder.table_decode.max_size, 1024)
+
+        # The update is only announced once
+        encoder.start_encode()
+        encoder.encode_header_list(headers)
+        self.assertEqual(encoder.end_encode(), b'\xbe')
+
+    def test_encode_template(self):
+        # Small tables, so that the template's headers get evicted now and
+        # then by the headers encoded between them
+        plain = hpack.ctx(max_table_size_out=256)
+        templated = hpack.ctx(max_table_size_out=256)
+        decoder = hpack.ctx(max_table_size_in=256)
+        common = [(':method', 'GET'), (':scheme', 'https'), (':authority', 'www.example.com'),
+                ('user-agent', 'test/1.0'), ('accept-encoding', 'gzip, deflate')]
+        template = templated.compile_headers(common)
+        secrets = [('authorization', 'secret'), ('x-token', 'secret')]
+        never = templated.compile_headers(secrets, hpack.index_opts.NEVER)
+        for idx in range(20):
+            extra = [(':path', '/item/{:d}'.format(idx)), ('x-filler-{:d}'.format(idx % 3), 'v' * (idx * 5 + 1))]
+            plain.start_encode()
+            plain.encode_header_list(common)
+            plain.encode_header_list(extra)
+            plain.encode_header_list(secrets, hpack.index_opts.NEVER)
+            expected = plain.end_encode()
+
+            templated.start_encode()
+            templated.encode_template(template)
+            templated.encode_header_list(extra)
+            templated.encode_template(never)
+            encoded = templated.end_encode()
+            self.assertEqual(encoded, expected)
+            self.assertHeaderListMatchesDict(common + extra + secrets, decoder.decode_headers(encoded))
+
+        # Templates belong to the context they were compiled for
+        plain.start_encode()
+        self.assertRaises(Exception, plain.encode_template, template)
+
+    def test_encode_template_dynamic_table(self):
+        # Headers that aren't indexed still use the dynamic table when the
+        # header, or its name, gets into it after the template is compiled
+        headers = [('x-a', '1'), ('x-b', '2'), ('accept', 'text/plain')]
+        for index_opt in [hpack.index_opts.WITHOUT, hpack.index_opts.NEVER]:
+            plain = hpack.ctx()
+            templated = hpack.ctx()
+            template = templated.compile_headers(headers, index_opt)
+            for inserted in [[], [('x-a', '1'), ('x-b', 'other'), ('accept', 'text/plain')]]:
+                for ctx in [plain, templated]:
+                    ctx.start_encode()
+                    ctx.encode_header_list(inserted, hpack.index_opts.INCREMENTAL)
+                    ctx.end_encode()
+
+                plain.start_encode()
+                plain.encode_header_list(headers, index_opt)
+                templated.start_encode()
+                templated.encode_template(template)
+                self.assertEqual(templated.end_encode(), plain.end_encode())
+
+        templated.start_encode()
+        templated.encode_template(template)
+        self.assertEqual(templated.end_encode()[:1], b'\xc0')
+
+    def test_literal_cache(self):
+        ctx = hpack.ctx(literal_cache_size=2)
+        first = ctx.encode_literal('value-1')
+        self.assertEqual(ctx.encode_literal('value-1'), first)
+        self.assertEqual(ctx.literal_cache['value-1'], first)
+        ctx.encode_literal('value-2')
+        ctx.encode_literal('value-1')
+        ctx.encode_literal('value-3')
+        # value-2 was used least recently
+        self.assertEqual(list(ctx.literal_cache), ['value-1', 'value-3'])
+
+        ctx = hpack.ctx(literal_cache_size=0)
+        ctx.encode_literal('value-1')
+        self.assertEqual(len(ctx.literal_cache), 0)
+
     def test_decode(self):
         ctx = hpack.ctx()
         for example in TestHpack.examples:
@@ -78,3 +198,112 @@ class TestHpack(unittest.TestCase):
         for example in TestHpack.examples:
             decoded = ctx.decode_headers(example.huffman_encoded)
             self.assertHeaderListMatchesDict(example.decoded, decoded)
+
+    def test_decode_responses(self):
+        # RFC 7541 appendices C.5 and C.6, which evict entries from a 256
+        # byte table
+        responses = [
+                {':status': '302', 'cache-control': 'private', 'date': 'Mon, 21 Oct 2013 20:13:21 GMT',
+                    'location': 'https://www.example.com'},
+                {':status': '307', 'cache-control': 'private', 'date': 'Mon, 21 Oct 2013 20:13:21 GMT',
+                    'location': 'https://www.example.com'},
+                {':status': '200', 'cache-control': 'private', 'date': 'Mon, 21 Oct 2013 20:13:22 GMT',
+                    'location': 'https://www.example.com', 'content-encoding': 'gzip',
+                    'set-cookie': 'foo=ASDJKHQKBZXOQWEOPIUAXQWEOIU; max-age=3600; version=1'},
+            ]
+        sequences = [
+                ["4803333032580770726976617465611d4d6f6e2c203231204f637420323031332032303a31333a323120474d54"
+                    "6e1768747470733a2f2f7777772e6578616d706c652e636f6d",
+                "4803333037c1c0bf",
+                "88c1611d4d6f6e2c203231204f637420323031332032303a31333a323220474d54c05a04677a69707738666f6f"
+                    "3d4153444a4b48514b425a584f5157454f50495541585157454f49553b206d61782d6167653d333630303b"
+                    "2076657273696f6e3d31"],
+                ["488264025885aec3771a4b6196d07abe941054d444a8200595040b8166e082a62d1bff6e919d29ad171863c7"
+                    "8f0b97c8e9ae82ae43d3",
+                "4883640effc1c0bf",
+                "88c16196d07abe941054d444a8200595040b8166e084a62d1bffc05a839bd9ab77ad94e7821dd7f2e6c7b335"
+                    "dfdfcd5b3960d5af27087f3672c1ab270fb5291f9587316065c003ed4ee5b1063d5007"],
+            ]
+        for blocks in sequences:
+            ctx = hpack.ctx(max_table_size_in=256)
+            for block,expected in zip(blocks, responses):
+                self.assertEqual(ctx.decode_headers(bytes.fromhex(block)), expected)
+            self.assertEqual(ctx.table_decode.dynamic_size(), 215)
+
+    def test_decode_in_fragments(self):
+        # Fields split anywhere between fragments decode the same
+        ctx = hpack.ctx()
+        for example in TestHpack.examples:
+            decoder = ctx.start_decode()
+            for idx in range(len(example.huffman_encoded)):
+                decoder.feed(memoryview(example.huffman_encoded)[idx:idx+1])
+            self.assertHeaderListMatchesDict(example.decoded, decoder.finish())
+
+        # A block can't end in the middle of a field
+        decoder = hpack.ctx().start_decode()
+        decoder.feed(TestHpack.examples[0].encoded[:-1])
+        self.assertRaises(Exception, decoder.finish)
+
+    def test_decode_large_literal_in_fragments(self):
+        # A literal spread over many fragments is only decoded once it has
+        # all arrived, and what came before it isn't kept around
+        encoder = hpack.ctx(huffman_encoding=False)
+        encoder.start_encode()
+        encoder.encode_header_list([(':status', '200'), ('cookie', 'x' * 100000)], hpack.index_opts.WITHOUT)
+        encoded = encoder.end_encode()
+
+        decoder = hpack.ctx().start_decode()
+        decoder.feed(encoded[:1000])
+        self.assertEqual(len(decoder.pending), 999)
+        self.assertEqual(decoder.pending_needed, len(encoded) - 1)
+        for idx in range(1000, len(encoded), 1000):
+            decoder.feed(encoded[idx:idx+1000])
+        self.assertEqual(decoder.finish(), {':status': '200', 'cookie': 'x' * 100000})
+
+    def test_decode_empty_values(self):
+        # Static entries without a value decode as an empty one
+        self.assertEqual(hpack.ctx().decode_headers(b'\x81'), {':authority': ''})
+        self.assertEqual(hpack.ctx(decode_bytes=True).decode_headers(b'\x93'), {b'accept': b''})
+        self.assertEqual(list(hpack.ctx().decode_header_list(b'\x81\x93')), [(':authority', ''), ('accept', '')])
+
+        # Index 0 isn't a header field
+        self.assertRaises(Exception, hpack.ctx().decode_headers, b'\x80')
+
+        encoder = hpack.ctx()
+        headers = [(':authority', ''), ('custom-key', 'custom-value'), ('accept', '')]
+        blocks = []
+        for _ in range(2):
+            encoder.start_encode()
+            encoder.encode_header_list(headers)
+            blocks.append(bytes(encoder.end_encode()))
+        self.assertEqual(blocks[1][:1], b'\x81')
+
+        decoder = hpack.ctx()
+        for encoded in blocks:
+            self.assertEqual(decoder.decode_headers(encoded), dict(headers))
+
+        # And the same split across fragments
+        decoder = hpack.ctx()
+        for encoded in blocks:
+            header_decoder = decoder.start_decode()
+            for idx in range(len(encoded)):
+                header_decoder.feed(encoded[idx:idx+1])
+            self.assertEqual(header_decoder.finish(), dict(headers))
+
+    def test_decode_max_header_list_size(self):
+        encoder = hpack.ctx()
+        encoder.start_encode()
+        encoder.encode_header_list([('x-large', 'x' * 1000)])
+        encoded = encoder.end_encode()
+
+        # A literal that's too large is refused before all of it has arrived
+        decoder = hpack.ctx().start_decode(100)
+        self.assertRaises(Exception, decoder.feed, encoded[:16])
+
+        decoder = hpack.ctx().start_decode(2000)
+        decoder.feed(encoded)
+        self.assertEqual(decoder.finish(), {'x-large': 'x' * 1000})
+
+    def test_decode_late_table_size_update(self):
+        # Size updates have to come before any field in the block
+        self.assertRaises(Exception, hpack.ctx().decode_headers, b'\x82\x20')
@@ -0,0 +1,76 @@
+import subprocess
+import sys
+import unittest
+
+class TestImport(unittest.TestCase):
+
+    def run_python(self, *args):
+        return subprocess.run([sys.executable] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True, check=True)
+
+    def test_tables_built_lazily(self):
+        # Importing builds none of the derived tables; using them does
+        result = self.run_python("-c", "\n".join([
+                "import h2.connection",
+                "from hpack import ed, hpack, table",
+                "print(ed.huffman_decode_states is None, ed.huffman_code_lengths is None, table.header_table.static_table_rev is None)",
+                "ctx = hpack.ctx()",
+                "ctx.start_encode()",
+                "ctx.encode_header('x-custom', 'value')",
+                "ctx.decode_headers(ctx.end_encode())",
+                "print(ed.huffman_decode_states is None, ed.huffman_code_lengths is None, table.header_table.static_table_rev is None)",
+            ]))
+        self.assertEqual(result.stdout.split("\n"), ["True True True", "False False False", ""])
+
+    def test_huffman_tables_built_on_first_use(self):
+        # Headers that never meet a huffman encoded literal never build the
+        # huffman tables; the decode states wait for the first one decoded
+        result = self.run_python("-c", "\n".join([
+                "from hpack import ed, hpack",
+                "ctx = hpack.ctx(huffman_encoding=False)",
+                "ctx.start_encode()",
+                "ctx.encode_header('x-custom', 'value')",
+                "ctx.decode_headers(ctx.end_encode())",
+                "print(ed.huffman_decode_states is None, ed.huffman_code_lengths is None)",
+                "ctx.decode_headers(bytes([0x00, 0x81, 0x1f, 0x81, 0x1f]))",
+                "print(ed.huffman_decode_states is None, ed.huffman_code_lengths is None)",
+            ]))
+        self.assertEqual(result.stdout.split("\n"), ["True True", "False True", ""])
+
+    def test_no_tables_built_on_import(self):
+        # None of the functions building the tables that are put off until
+        # they're first needed may run while importing the packages
+        result = self.run_python("-c", "\n".join([
+                "import sys",
+                "called = set()",
+                "def profile(frame, event, arg):",
+                "    if event == 'call' and frame.f_globals.get('__name__', '').startswith(('hpack', 'h2')):",
+                "        called.add(frame.f_code.co_name)",
+                "sys.setprofile(profile)",
+                "import h2.connection",
+                "sys.setprofile(None)",
+                "print(' '.join(sorted(called & {'build_huffman_decode_states', 'build_huffman_decode_tables',",
+                "        'build_huffman_encode_tables', 'build_static_indexes'})))",
+            ]))
+        self.assertEqual(result.stdout.strip(), "")
+
+    def test_import_time(self):
+        # Importing hpack.ed has to take less time than building the huffman
+        # decode tables, which it used to do; both are measured in the same
+        # process, so a slow or busy machine slows them down alike. The best
+        # of a few runs, since the first may be compiling the modules.
+        import_times = []
+        build_times = []
+        for _ in range(3):
+            result = self.run_python("-X", "importtime", "-c", "\n".join([
+                    "import time",
+                    "import hpack.ed",
+                    "start = time.perf_counter()",
+                    "hpack.ed.build_huffman_decode_states()",
+                    "print(int((time.perf_counter() - start) * 1000000))",
+                ]))
+            build_times.append(int(result.stdout))
+            for line in result.stderr.splitlines():
+                if line.startswith("import time:") and line.endswith("| hpack.ed"):
+                    import_times.append(int(line[len("import time:"):].split("|")[0]))
+        self.assertLess(min(import_times), min(build_times))
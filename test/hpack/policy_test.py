@@ -0,0 +1,44 @@
+import unittest
+from hpack import hpack
+from hpack import policy
+from hpack import table
+
+class TestIndexPolicy(unittest.TestCase):
+
+    def test_rules(self):
+        index_policy = policy.index_policy(learn=False)
+        header_table = table.header_table(4096)
+        self.assertIs(index_policy.index_opt("authorization", "secret", header_table), hpack.index_opts.NEVER)
+        self.assertIs(index_policy.index_opt("content-length", "10", header_table), hpack.index_opts.WITHOUT)
+        self.assertIs(index_policy.index_opt("x-custom", "value", header_table), hpack.index_opts.INCREMENTAL)
+
+        # Entries taking up more than a quarter of the table aren't indexed
+        self.assertIs(index_policy.index_opt("x-custom", "v" * 1000, header_table), hpack.index_opts.WITHOUT)
+        self.assertIs(index_policy.index_opt("x-custom", "v" * 1000, table.header_table(65536)),
+                hpack.index_opts.INCREMENTAL)
+
+    def test_learning(self):
+        index_policy = policy.index_policy(rules=None, max_entry_fraction=None)
+        header_table = table.header_table(4096)
+        unique = [index_policy.index_opt("x-trace", str(idx), header_table) for idx in range(20)]
+        repeated = [index_policy.index_opt("x-client", str(idx % 2), header_table) for idx in range(20)]
+        self.assertEqual(unique, [hpack.index_opts.INCREMENTAL] * 7 + [hpack.index_opts.WITHOUT] * 13)
+        self.assertEqual(repeated, [hpack.index_opts.INCREMENTAL] * 20)
+
+    def test_ctx(self):
+        ctx = hpack.ctx(index_policy=policy.index_policy())
+        decoder = hpack.ctx()
+        for idx in range(20):
+            headers = [("x-request-id", "{:08x}".format(idx)), ("user-agent", "test/1.0"),
+                    ("authorization", "secret")]
+            ctx.start_encode()
+            ctx.encode_header_list(headers)
+            self.assertEqual(decoder.decode_headers(ctx.end_encode()), dict(headers))
+        self.assertEqual([field.name for field in ctx.table_encode.dynamic_table if field is not None],
+                ["user-agent"])
+
+        # Explicitly asking for an index_opt overrides the policy
+        ctx.start_encode()
+        ctx.encode_header("x-request-id", "0", hpack.index_opts.INCREMENTAL)
+        ctx.end_encode()
+        self.assertIsNotNone(ctx.table_encode.find_index_by_field("x-request-id", "0"))
@@ -0,0 +1,84 @@
+import unittest
+from hpack import hpack
+
+class TestStats(unittest.TestCase):
+
+    def test_disabled(self):
+        ctx = hpack.ctx()
+        self.assertIsNone(ctx.stats_snapshot())
+        ctx.reset_stats()
+
+    def test_counters(self):
+        encoder = hpack.ctx(max_table_size_out=128, stats=True)
+        decoder = hpack.ctx(max_table_size_in=128, stats=True)
+        blocks = [
+                # Indexed, literal name (inserted), name indexed (inserted)
+                [(':method', 'GET'), ('custom-key', 'custom-header'), (':authority', 'www.example.com')],
+                # Both found in the dynamic table now
+                [('custom-key', 'custom-header'), (':authority', 'www.example.com')],
+                # Evicts custom-key
+                [('x-long', 'v' * 40)],
+            ]
+        encoded_bytes = 0
+        for headers in blocks:
+            encoder.start_encode()
+            encoder.encode_header_list(headers)
+            encoded = encoder.end_encode()
+            encoded_bytes += len(encoded)
+            decoder.decode_headers(encoded)
+
+        snapshot = encoder.stats_snapshot()
+        self.assertEqual(snapshot["encoder"], decoder.stats_snapshot()["decoder"])
+        expected = {
+                "headers": 6,
+                "header_bytes": 10 + 23 + 25 + 23 + 25 + 46,
+                "encoded_bytes": encoded_bytes,
+                "indexed": 3,
+                "name_indexed": 1,
+                "literal": 2,
+                "insertions": 3,
+                "evictions": 2,
+                "table_entries": 1,
+                "table_size": 78,
+                "table_peak_size": 112,
+            }
+        for name,value in expected.items():
+            self.assertEqual(snapshot["encoder"][name], value, name)
+        self.assertGreater(snapshot["encoder"]["huffman_saved"], 0)
+
+        encoder.reset_stats()
+        snapshot = encoder.stats_snapshot()["encoder"]
+        self.assertEqual(snapshot["headers"], 0)
+        self.assertEqual(snapshot["insertions"], 0)
+        self.assertEqual(snapshot["table_entries"], 1)
+        self.assertEqual(snapshot["table_peak_size"], 78)
+
+    def test_template(self):
+        ctx = hpack.ctx(stats=True)
+        template = ctx.compile_headers([(':method', 'GET'), ('x-custom', 'value')])
+        for _ in range(2):
+            ctx.start_encode()
+            ctx.encode_template(template)
+            ctx.end_encode()
+        snapshot = ctx.stats_snapshot()["encoder"]
+        self.assertEqual((snapshot["headers"], snapshot["indexed"], snapshot["literal"]), (4, 3, 1))
+
+    def test_split_fragments(self):
+        encoder = hpack.ctx(stats=True)
+        encoder.start_encode()
+        encoder.encode_header_list([('x-custom-name', 'x-custom-value')])
+        encoded = encoder.end_encode()
+
+        # A field that only completes in a later fragment is counted once
+        snapshots = []
+        for split in [len(encoded), len(encoded) - 5, 1]:
+            decoder = hpack.ctx(stats=True)
+            block_decoder = decoder.start_decode()
+            block_decoder.feed(encoded[:split])
+            block_decoder.feed(encoded[split:])
+            self.assertEqual(block_decoder.finish(), {'x-custom-name': 'x-custom-value'})
+            snapshots.append(decoder.stats_snapshot()["decoder"])
+        self.assertGreater(snapshots[0]["huffman_saved"], 0)
+        self.assertEqual(snapshots[1], snapshots[0])
+        self.assertEqual(snapshots[2], snapshots[0])
+        self.assertEqual(snapshots[0]["huffman_saved"], encoder.stats_snapshot()["encoder"]["huffman_saved"])
@@ -64,3 +64,66 @@ class TestHpackTable(unittest.TestCase):
         self.assertHeaderEquals(hpack_table.find_field_by_index(61), "www-authenticate", None)
         self.assertHeaderEquals(hpack_table.find_field_by_index(62), "name2", "value2")
         self.assertHeaderEquals(hpack_table.find_field_by_index(63), "name", "value")
+
+    def test_table_index_survives_eviction(self):
+        hpack_table = table.header_table(128)
+
+        # Two entries with the same name; evicting the older one must not
+        # lose the name
+        hpack_table.new_header("x-name", "first")
+        hpack_table.new_header("x-name", "second")
+        hpack_table.new_header("x-other", "value")
+        self.assertEqual(hpack_table.find_field_by_index(62), ("x-other", "value"))
+        self.assertEqual(hpack_table.length(), 64)
+        self.assertEqual(hpack_table.find_index_by_field("x-name", "second"), 63)
+        self.assertEqual(hpack_table.find_index_by_field("x-name", "third"), 63)
+
+        # Reinserting an existing field points the index at the newest copy
+        hpack_table.new_header("x-name", "second")
+        self.assertEqual(hpack_table.find_index_by_field("x-name", "second"), 62)
+        hpack_table.new_header("x-new", "value")
+        self.assertEqual(hpack_table.find_index_by_field("x-name", "second"), 63)
+        self.assertEqual(hpack_table.find_index_by_field("x-other", "value"), None)
+        self.assertEqual(hpack_table.find_index_by_field("x-other", None), None)
+
+    def test_table_find_many(self):
+        hpack_table = table.header_table(65536)
+        for idx in range(1000):
+            hpack_table.new_header("x-header-{:d}".format(idx % 100), "value-{:d}".format(idx))
+
+        for idx in range(1000):
+            index = hpack_table.find_index_by_field("x-header-{:d}".format(idx % 100), "value-{:d}".format(idx))
+            self.assertEqual(hpack_table.find_field_by_index(index),
+                    ("x-header-{:d}".format(idx % 100), "value-{:d}".format(idx)))
+
+    def test_table_set_max_size(self):
+        hpack_table = table.header_table(4096)
+        for idx in range(10):
+            hpack_table.new_header("name", "value{:d}".format(idx))
+        self.assertEqual(hpack_table.dynamic_size(), 420)
+
+        # Shrinking the table evicts straight away, oldest first
+        hpack_table.set_max_size(100)
+        self.assertEqual(hpack_table.dynamic_size(), 84)
+        self.assertEqual(hpack_table.find_field_by_index(62), ("name", "value9"))
+        self.assertEqual(hpack_table.find_field_by_index(63), ("name", "value8"))
+        self.assertEqual(hpack_table.find_field_by_index(64), None)
+
+        hpack_table.set_max_size(0)
+        self.assertEqual(hpack_table.length(), 62)
+        self.assertEqual(hpack_table.find_index_by_field("name", "value9"), None)
+
+        # Growing again keeps working
+        hpack_table.set_max_size(4096)
+        for idx in range(200):
+            hpack_table.new_header("name", "value{:d}".format(idx))
+        self.assertEqual(hpack_table.find_field_by_index(62), ("name", "value199"))
+        self.assertEqual(hpack_table.find_index_by_field("name", "value150"), 62 + 49)
+
+    def test_table_entry_larger_than_table(self):
+        hpack_table = table.header_table(64)
+        hpack_table.new_header("a", "b")
+        hpack_table.new_header("name", "a value that doesn't fit in the table")
+        self.assertEqual(hpack_table.length(), 62)
+        self.assertEqual(hpack_table.dynamic_size(), 0)
+        self.assertEqual(hpack_table.find_index_by_field("name", None), None)